@@ -8,5 +8,6 @@ echo "Database started"
 echo "Running migrations..."
 python manage.py makemigrations --noinput
 python manage.py migrate --noinput
+python manage.py createcachetable
 echo "Starting application..."
 exec "$@"
\ No newline at end of file
@@ -0,0 +1,118 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Attributi standard di LogRecord: tutto il resto arriva da extra={...}
+_RESERVED_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class _QueueListener(QueueListener):
+    """QueueListener arrestabile più volte (close() e atexit)"""
+
+    def enqueue_sentinel(self):
+        # Bloccante: allo shutdown si attende lo svuotamento della coda
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+class NonBlockingHandler(QueueHandler):
+    """
+    Handler che accoda i record e delega formattazione e I/O a un thread
+    QueueListener dedicato.
+
+    Il thread della richiesta si limita a inserire il record in una coda
+    limitata: se la coda è piena il record viene scartato invece di
+    bloccare la richiesta. Con filename=None i record vanno su stderr.
+    """
+
+    def __init__(self, filename=None, queue_size=10000, encoding='utf-8'):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        if filename:
+            self.target = logging.FileHandler(filename, encoding=encoding, delay=True)
+        else:
+            self.target = logging.StreamHandler(sys.stderr)
+        self.dropped = 0
+        self.listener = _QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def setFormatter(self, fmt):
+        # La formattazione avviene nel thread del listener, non in quello della richiesta
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Il messaggio viene interpolato qui (i parametri potrebbero cambiare dopo
+        # il ritorno della chiamata), ma senza applicare il formatter
+        message = record.getMessage()
+        prepared = logging.makeLogRecord(record.__dict__)
+        prepared.msg = message
+        prepared.args = None
+        if record.exc_info:
+            prepared.exc_text = logging.Formatter().formatException(record.exc_info)
+            prepared.exc_info = None
+        return prepared
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self.listener.stop()
+        self.target.close()
+        super().close()
+
+
+class SampledDebugFilter(logging.Filter):
+    """
+    Lascia passare tutti i record da INFO in su e solo una frazione dei
+    record DEBUG, così i percorsi caldi non saturano i log ad alto traffico.
+
+    La decisione viene presa una sola volta per record e salvata sul record
+    stesso: tutti gli handler del logger vedono gli stessi record DEBUG.
+    """
+
+    def __init__(self, rate=0.01, name=''):
+        super().__init__(name)
+        self.rate = float(rate)
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        sampled = getattr(record, '_debug_sampled', None)
+        if sampled is None:
+            sampled = record._debug_sampled = self.rate >= 1 or random.random() < self.rate
+        return sampled
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatter che produce un oggetto JSON per riga (JSON Lines)"""
+
+    def format(self, record):
+        payload = {
+            'timestamp': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'process': record.process,
+            'thread': record.thread,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                payload[key] = value
+
+        if record.exc_info:
+            payload['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload['exception'] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
@@ -0,0 +1,172 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Bucket in secondi: dalle query DB (ms) fino alle analisi LLM più lunghe (minuti)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120, 300, math.inf)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for name, value in labels:
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{escaped}"')
+    return '{' + ','.join(parts) + '}'
+
+
+class Histogram:
+    """Istogramma in memoria con la stessa semantica di quelli Prometheus"""
+
+    def __init__(self, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def collect(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram',
+        ]
+        with self._lock:
+            snapshot = {key: {**series, 'buckets': list(series['buckets'])} for key, series in self._series.items()}
+
+        for key, series in sorted(snapshot.items()):
+            labels = list(zip(self.labelnames, key))
+            for upper_bound, count in zip(self.buckets, series['buckets']):
+                bucket_labels = _format_labels(labels + [('le', _format_value(upper_bound))])
+                lines.append(f'{self.name}_bucket{bucket_labels} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {series["sum"]}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {series["count"]}')
+        return lines
+
+
+
+class LatencyWindow:
+    """
+    Ultime N latenze per chiave (es. modello LLM), per stimare i percentili
+    recenti senza la granularità dei bucket degli istogrammi
+    """
+
+    def __init__(self, size=200):
+        self.size = size
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key, value):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.size)
+            samples.append(value)
+
+    def percentile(self, key, q, min_samples=1):
+        """Percentile nearest-rank (q tra 0 e 100), None se i campioni sono meno di min_samples"""
+        with self._lock:
+            ordered = sorted(self._samples.get(key, ()))
+        if not ordered or len(ordered) < min_samples:
+            return None
+        return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+class MetricsRegistry:
+    """Registro delle metriche del processo, esposto in formato testo Prometheus"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, documentation, labelnames, buckets)
+            return self._metrics[name]
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_DURATION = REGISTRY.histogram(
+    'cham3leon_stage_duration_seconds',
+    'Durata di ogni fase delle operazioni instrumentate',
+    ['component', 'stage', 'provider', 'model', 'status'],
+)
+
+OPERATION_DURATION = REGISTRY.histogram(
+    'cham3leon_operation_duration_seconds',
+    'Durata complessiva delle operazioni instrumentate',
+    ['component', 'provider', 'model', 'status'],
+)
+
+
+class StageTimer:
+    """
+    Misura i tempi delle fasi di una singola operazione (risoluzione path,
+    lettura file, scritture DB, chiamata LLM, deploy...).
+
+    Le osservazioni vengono registrate negli istogrammi solo in finish(),
+    quando lo status finale è noto.
+    """
+
+    def __init__(self, component, provider='', model=''):
+        self.component = component
+        self.labels = {'provider': provider, 'model': model}
+        self.timings = {}
+        self._started = time.perf_counter()
+        self._finished = False
+
+    def set_labels(self, **labels):
+        self.labels.update(labels)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.timings[name] = round(self.timings.get(name, 0) + elapsed_ms, 2)
+
+    def as_dict(self):
+        """Tempi per fase in millisecondi, più il totale trascorso finora"""
+        return {**self.timings, 'total': round((time.perf_counter() - self._started) * 1000, 2)}
+
+    def finish(self, status):
+        timings = self.as_dict()
+        if self._finished:
+            return timings
+        self._finished = True
+
+        for stage_name, elapsed_ms in self.timings.items():
+            STAGE_DURATION.observe(elapsed_ms / 1000, component=self.component, stage=stage_name, status=status, **self.labels)
+        OPERATION_DURATION.observe(timings['total'] / 1000, component=self.component, status=status, **self.labels)
+        return timings
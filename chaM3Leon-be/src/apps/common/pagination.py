@@ -0,0 +1,18 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Paginazione keyset su (created_at, id) per gli storici ad alto volume.
+    
+    Evita COUNT(*) e OFFSET: ogni pagina è una range scan sull'indice
+    composito (created_at, id), quindi il costo non dipende dalla profondità.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class HourCursorPagination(CreatedAtCursorPagination):
+    """Paginazione keyset su (hour, id) per gli aggregati orari"""
+    ordering = ('-hour', '-id')
@@ -0,0 +1,123 @@
+"""
+Retention degli storici ad alto volume (richieste LLM, deployment).
+
+Le righe più vecchie di una soglia perdono i campi di testo pesanti (prompt,
+risposte, contenuti dei file) ma restano con stato, token, costi e tempi;
+oltre una seconda soglia, se configurata, vengono cancellate. Entrambe le
+operazioni procedono a batch di id in ordine di created_at (keyset), ognuno in
+una transazione breve: su PostgreSQL con lock_timeout, così un batch che
+trova righe bloccate rinuncia invece di accodare le scritture dell'applicazione.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Dict, List
+
+from django.db import OperationalError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RetentionPolicy:
+    model: type
+    # Campi svuotati dopo la prima soglia, con il valore da assegnare
+    text_fields: Dict[str, object]
+    # Solo le righe in uno stato finale: quelle in corso possono ancora essere scritte
+    final_statuses: List[str] = field(default_factory=lambda: ['completed', 'failed'])
+
+    @property
+    def label(self):
+        return self.model.__name__
+
+
+@dataclass
+class PurgeStats:
+    rows: int = 0
+    batches: int = 0
+    skipped_batches: int = 0  # lock non ottenuto entro lock_timeout
+    max_batch_ms: float = 0.0
+
+
+@contextmanager
+def bounded_transaction(lock_timeout_ms):
+    with transaction.atomic():
+        if connection.vendor == 'postgresql' and lock_timeout_ms:
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL lock_timeout = %s", [f'{int(lock_timeout_ms)}ms'])
+        yield
+
+
+def keyset_batches(queryset, batch_size):
+    """Liste di id in ordine di (created_at, id); ogni pagina riparte dall'ultima riga letta"""
+    last = None
+    while True:
+        page = queryset.order_by('created_at', 'id')
+        if last is not None:
+            page = page.filter(Q(created_at__gt=last[0]) | Q(created_at=last[0], id__gt=last[1]))
+        rows = list(page.values_list('created_at', 'id')[:batch_size])
+        if not rows:
+            return
+        last = rows[-1]
+        yield [pk for _, pk in rows]
+
+
+def run_batches(queryset, action, batch_size, lock_timeout_ms, pause_ms, max_batches=None):
+    stats = PurgeStats()
+    for ids in keyset_batches(queryset, batch_size):
+        if max_batches is not None and stats.batches + stats.skipped_batches >= max_batches:
+            break
+        start = time.perf_counter()
+        try:
+            with bounded_transaction(lock_timeout_ms):
+                stats.rows += action(ids)
+        except OperationalError as e:
+            logger.warning("Batch di %s righe saltato (lock non ottenuto): %s", len(ids), e)
+            stats.skipped_batches += 1
+        else:
+            stats.batches += 1
+        stats.max_batch_ms = max(stats.max_batch_ms, (time.perf_counter() - start) * 1000)
+        if pause_ms:
+            # Respiro per autovacuum, repliche e scritture concorrenti
+            time.sleep(pause_ms / 1000)
+    return stats
+
+
+def text_candidates(policy: RetentionPolicy, days):
+    """Righe più vecchie di days giorni con i testi ancora presenti"""
+    cutoff = timezone.now() - timedelta(days=days)
+    return policy.model.objects.filter(
+        created_at__lt=cutoff, content_purged_at__isnull=True, status__in=policy.final_statuses
+    )
+
+
+def delete_candidates(policy: RetentionPolicy, days):
+    cutoff = timezone.now() - timedelta(days=days)
+    return policy.model.objects.filter(created_at__lt=cutoff, status__in=policy.final_statuses)
+
+
+def strip_text(policy: RetentionPolicy, days, **options) -> PurgeStats:
+    """Svuota i campi di testo delle righe più vecchie di days giorni (content_purged_at impostato)"""
+    manager = policy.model.objects
+
+    def action(ids):
+        return manager.filter(pk__in=ids, content_purged_at__isnull=True).update(
+            content_purged_at=timezone.now(), **policy.text_fields
+        )
+
+    return run_batches(text_candidates(policy, days), action, **options)
+
+
+def delete_rows(policy: RetentionPolicy, days, **options) -> PurgeStats:
+    """Cancella le righe più vecchie di days giorni (con le righe collegate in CASCADE)"""
+    manager = policy.model.objects
+
+    def action(ids):
+        deleted = manager.filter(pk__in=ids).delete()[1]
+        return deleted.get(policy.model._meta.label, 0)
+
+    return run_batches(delete_candidates(policy, days), action, **options)
@@ -0,0 +1,35 @@
+from rest_framework import serializers
+
+
+class SparseFieldsetMixin:
+    """
+    Permette al client di restringere i campi restituiti tramite
+    il query param ?fields=id,status,created_at
+    
+    I nomi non riconosciuti vengono ignorati; se nessun campo richiesto
+    è valido il serializer restituisce tutti i suoi campi.
+    """
+    fields_query_param = 'fields'
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        
+        request = self.context.get('request')
+        if request is None:
+            return
+        
+        fields_param = request.query_params.get(self.fields_query_param)
+        if not fields_param:
+            return
+        
+        requested = {name.strip() for name in fields_param.split(',') if name.strip()}
+        if not requested & set(self.fields):
+            return
+        
+        for field_name in set(self.fields) - requested:
+            self.fields.pop(field_name)
+
+
+class SparseModelSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """ModelSerializer compatto con supporto a ?fields="""
+    pass
@@ -0,0 +1,29 @@
+from django.test import SimpleTestCase, override_settings
+
+
+@override_settings(METRICS_TOKEN='', METRICS_ALLOWED_IPS=['127.0.0.1', '::1'])
+class MetricsAccessTests(SimpleTestCase):
+    """Accesso a /metrics limitato a token Bearer e IP ammessi"""
+
+    def test_localhost_allowed(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+    def test_other_ip_denied(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_TOKEN='segreto')
+    def test_bearer_token(self):
+        ok = self.client.get('/metrics', REMOTE_ADDR='10.0.0.5', headers={'Authorization': 'Bearer segreto'})
+        self.assertEqual(ok.status_code, 200)
+        wrong = self.client.get('/metrics', REMOTE_ADDR='10.0.0.5', headers={'Authorization': 'Bearer altro'})
+        self.assertEqual(wrong.status_code, 403)
+        missing = self.client.get('/metrics', REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(missing.status_code, 403)
+
+    @override_settings(METRICS_ALLOWED_IPS=[])
+    def test_no_allowed_ips(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, 403)
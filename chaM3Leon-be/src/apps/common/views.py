@@ -0,0 +1,31 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_GET
+
+from .metrics import REGISTRY
+
+
+def metrics_allowed(request):
+    """Accesso con 'Authorization: Bearer <METRICS_TOKEN>' o da un IP in METRICS_ALLOWED_IPS"""
+    token = settings.METRICS_TOKEN
+    if token:
+        scheme, _, value = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(value.strip().encode(), token.encode()):
+            return True
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+@require_GET
+def metrics(request):
+    """
+    Espone le metriche del processo in formato testo Prometheus.
+
+    Il registro è in memoria: ogni worker (gunicorn/uvicorn) espone solo le
+    proprie richieste, quindi con più processi va fatto lo scrape di ciascuno
+    (o va usato un solo worker) e le serie vanno sommate lato Prometheus.
+    """
+    if not metrics_allowed(request):
+        return HttpResponseForbidden('Metriche non accessibili')
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
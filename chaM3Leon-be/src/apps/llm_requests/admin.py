@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import LLMProvider, LLMModel, LLMRequest, LLMConversation, ConversationMessage
+from .models import LLMProvider, LLMModel, LLMModelFallback, LLMRequest, LLMConversation, ConversationMessage, ConversationArchive, LLMResultOutbox, LLMUsageHourly, WorkflowStepCache, WorkflowStructureCache, IdempotencyKey
 
 @admin.register(LLMProvider)
 class LLMProviderAdmin(admin.ModelAdmin):
@@ -7,11 +7,21 @@ class LLMProviderAdmin(admin.ModelAdmin):
     list_filter = ['is_active', 'created_at']
     search_fields = ['name', 'display_name']
 
+class LLMModelFallbackInline(admin.TabularInline):
+    model = LLMModelFallback
+    fk_name = 'model'
+    extra = 0
+    ordering = ['priority']
+
 @admin.register(LLMModel)
 class LLMModelAdmin(admin.ModelAdmin):
-    list_display = ['name', 'display_name', 'provider', 'max_tokens', 'supports_streaming', 'is_active']
+    list_display = [
+        'name', 'display_name', 'provider', 'max_tokens', 'supports_streaming',
+        'input_price_per_million', 'cached_input_price_per_million', 'output_price_per_million', 'is_active'
+    ]
     list_filter = ['provider', 'supports_streaming', 'is_active', 'created_at']
     search_fields = ['name', 'display_name']
+    inlines = [LLMModelFallbackInline]
 
 class ConversationMessageInline(admin.TabularInline):
     model = ConversationMessage
@@ -20,21 +30,32 @@ class ConversationMessageInline(admin.TabularInline):
 
 @admin.register(LLMConversation)
 class LLMConversationAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user', 'title', 'created_at', 'updated_at']
-    list_filter = ['created_at', 'updated_at']
+    list_display = ['id', 'user', 'title', 'message_count', 'last_message_at', 'total_tokens', 'archived_at', 'created_at', 'updated_at']
+    list_filter = ['created_at', 'updated_at', ('archived_at', admin.EmptyFieldListFilter)]
     search_fields = ['title', 'user__username']
+    readonly_fields = ['message_count', 'last_message_at', 'total_tokens', 'archived_at']
     inlines = [ConversationMessageInline]
 
+@admin.register(ConversationArchive)
+class ConversationArchiveAdmin(admin.ModelAdmin):
+    list_display = ['conversation', 'codec', 'message_count', 'original_bytes', 'compressed_bytes', 'archived_at']
+    list_filter = ['codec', 'archived_at']
+    exclude = ['data']
+    readonly_fields = ['conversation', 'codec', 'message_count', 'original_bytes', 'compressed_bytes', 'archived_at']
+
 @admin.register(LLMRequest)
 class LLMRequestAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user', 'model', 'status', 'tokens_used', 'response_time_ms', 'created_at']
+    list_display = ['id', 'user', 'model', 'served_by', 'status', 'tokens_used', 'cost', 'response_time_ms', 'created_at']
     list_filter = ['status', 'model__provider', 'created_at']
     search_fields = ['user__username', 'prompt']
-    readonly_fields = ['id', 'created_at', 'completed_at']
+    readonly_fields = ['id', 'shared_completion', 'created_at', 'completed_at', 'content_purged_at']
+    list_select_related = ['user', 'model__provider', 'served_by']
+    # Evita un secondo COUNT(*) sull'intera tabella quando si applicano filtri
+    show_full_result_count = False
     
     fieldsets = (
         ('Informazioni Base', {
-            'fields': ('id', 'user', 'model', 'conversation')
+            'fields': ('id', 'user', 'model', 'served_by', 'shared_completion', 'conversation')
         }),
         ('Richiesta', {
             'fields': ('prompt', 'system_message', 'max_tokens', 'temperature')
@@ -43,6 +64,52 @@ class LLMRequestAdmin(admin.ModelAdmin):
             'fields': ('response', 'status', 'error_message')
         }),
         ('Metadati', {
-            'fields': ('tokens_used', 'response_time_ms', 'created_at', 'completed_at')
+            'fields': (
+                'tokens_used', 'prompt_tokens', 'completion_tokens', 'cache_read_tokens', 'tokens_estimated', 'cost',
+                'response_time_ms', 'created_at', 'completed_at', 'content_purged_at'
+            )
         }),
     )
+
+@admin.register(LLMResultOutbox)
+class LLMResultOutboxAdmin(admin.ModelAdmin):
+    list_display = ['id', 'request', 'attempts', 'created_at', 'next_attempt_at', 'applied_at', 'dead_at']
+    list_filter = ['created_at', 'applied_at', 'dead_at']
+    readonly_fields = ['request', 'payload', 'attempts', 'last_error', 'created_at', 'next_attempt_at', 'applied_at', 'dead_at']
+
+@admin.register(LLMUsageHourly)
+class LLMUsageHourlyAdmin(admin.ModelAdmin):
+    list_display = [
+        'hour', 'provider', 'model', 'user', 'request_count', 'failed_count',
+        'prompt_tokens', 'completion_tokens', 'cache_read_tokens', 'cost'
+    ]
+    list_filter = ['provider', 'model', 'hour']
+    list_select_related = ['provider', 'model', 'user']
+    date_hierarchy = 'hour'
+    readonly_fields = [
+        'hour', 'user', 'model', 'provider', 'request_count', 'failed_count', 'prompt_tokens',
+        'completion_tokens', 'cache_read_tokens', 'estimated_requests', 'cost', 'response_time_ms_total'
+    ]
+
+@admin.register(WorkflowStepCache)
+class WorkflowStepCacheAdmin(admin.ModelAdmin):
+    list_display = ['workflow_file_path', 'class_name', 'step_name', 'model', 'source_hash', 'updated_at']
+    list_filter = ['model']
+    list_select_related = ['model']
+    search_fields = ['workflow_file_path', 'step_name']
+    readonly_fields = ['source_hash', 'improved_hash', 'prompt_hash', 'created_at', 'updated_at']
+
+@admin.register(WorkflowStructureCache)
+class WorkflowStructureCacheAdmin(admin.ModelAdmin):
+    list_display = ['structure_hash', 'model', 'hits', 'analysis', 'updated_at']
+    list_filter = ['model']
+    list_select_related = ['model', 'analysis']
+    search_fields = ['structure_hash']
+    readonly_fields = ['structure_hash', 'prompt_hash', 'identifiers', 'analysis', 'hits', 'created_at', 'updated_at']
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ['key', 'scope', 'status', 'response_status', 'created_at', 'expires_at']
+    list_filter = ['status', 'scope']
+    search_fields = ['key']
+    readonly_fields = ['scope', 'key', 'request_hash', 'status', 'response_status', 'response_body', 'created_at', 'expires_at']
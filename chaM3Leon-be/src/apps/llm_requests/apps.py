@@ -7,5 +7,5 @@ class LlmRequestsConfig(AppConfig):
     verbose_name = 'LLM Requests'
     
     def ready(self):
-        # Importa i segnali se necessario
-        pass
+        # Invalidazione del catalogo in memoria di provider e modelli
+        from . import signals  # noqa: F401
@@ -0,0 +1,154 @@
+"""
+Archiviazione delle conversazioni inattive.
+
+compact_conversations sposta i messaggi delle conversazioni non aggiornate da
+LLM_CONVERSATION_ARCHIVE_IDLE_DAYS giorni in un blob JSON compresso per
+conversazione (ConversationArchive): la riga di LLMConversation resta, con i
+contatori denormalizzati e archived_at valorizzato, così la tabella dei
+messaggi e i suoi indici contengono solo le conversazioni attive.
+
+Le letture (dettaglio, lista dei messaggi) decomprimono l'archivio senza
+toccare il database (LLMConversation.history); un nuovo messaggio o un nuovo
+turno LLM reinserisce prima i messaggi nella tabella (rehydrate_conversation).
+La compattazione successiva archivia di nuovo la conversazione, se nel
+frattempo è tornata inattiva.
+"""
+import gzip
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ConversationArchive, ConversationMessage, LLMConversation
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:  # codec 'zstd' opzionale: senza il pacchetto si usa gzip
+    zstandard = None
+
+FORMAT_VERSION = 1
+
+
+def archive_codec():
+    codec = settings.LLM_CONVERSATION_ARCHIVE_CODEC
+    if codec == 'zstd' and zstandard is None:
+        logger.warning("Pacchetto zstandard non installato: archivi compressi con gzip")
+        return 'gzip'
+    return codec
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=9)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Archivio zstd: installare il pacchetto zstandard per leggerlo")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def encode_messages(messages):
+    payload = {
+        'version': FORMAT_VERSION,
+        'messages': [
+            {'id': str(message.id), 'role': message.role, 'content': message.content,
+             'created_at': message.created_at.isoformat()}
+            for message in messages
+        ],
+    }
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def decode_messages(archive: ConversationArchive):
+    """Messaggi dell'archivio come istanze di ConversationMessage non salvate"""
+    payload = json.loads(decompress(bytes(archive.data), archive.codec))
+    return [
+        ConversationMessage(
+            id=item['id'], conversation_id=archive.conversation_id, role=item['role'],
+            content=item['content'], created_at=parse_datetime(item['created_at']),
+        )
+        for item in payload['messages']
+    ]
+
+
+def idle_cutoff(idle_days=None):
+    idle_days = settings.LLM_CONVERSATION_ARCHIVE_IDLE_DAYS if idle_days is None else idle_days
+    return timezone.now() - timedelta(days=idle_days)
+
+
+def archive_conversation(conversation_id, idle_days=None) -> bool:
+    """Archivia i messaggi della conversazione; False se già archiviata o nel frattempo modificata"""
+    codec = archive_codec()
+    cutoff = idle_cutoff(idle_days)
+    with transaction.atomic():
+        conversation = (
+            LLMConversation.objects.select_for_update()
+            .filter(pk=conversation_id, archived_at__isnull=True, updated_at__lt=cutoff)
+            .first()
+        )
+        if conversation is None:
+            return False
+        messages = list(conversation.messages.order_by('created_at', 'id'))
+        data = encode_messages(messages)
+        compressed = compress(data, codec)
+        ConversationArchive.objects.create(
+            conversation=conversation, codec=codec, data=compressed,
+            message_count=len(messages), original_bytes=len(data), compressed_bytes=len(compressed),
+        )
+        ConversationMessage.objects.filter(conversation=conversation).delete()
+        # update(): updated_at resta la data dell'ultima attività
+        LLMConversation.objects.filter(pk=conversation.pk).update(archived_at=timezone.now())
+    return True
+
+
+def rehydrate_conversation(conversation: LLMConversation) -> bool:
+    """
+    Reinserisce i messaggi archiviati nella tabella, prima di aggiungerne di
+    nuovi; False se la conversazione non era archiviata
+    """
+    with transaction.atomic():
+        archive = (
+            ConversationArchive.objects.select_for_update()
+            .filter(conversation_id=conversation.pk)
+            .first()
+        )
+        if archive is None:
+            conversation.archived_at = None
+            return False
+        messages = decode_messages(archive)
+        created_at = {message.id: message.created_at for message in messages}
+        ConversationMessage.objects.bulk_create(messages, batch_size=500)
+        # bulk_create applica auto_now_add: le date originali vanno ripristinate
+        for message in messages:
+            message.created_at = created_at[message.id]
+        ConversationMessage.objects.bulk_update(messages, ['created_at'], batch_size=500)
+        archive.delete()
+        LLMConversation.objects.filter(pk=conversation.pk).update(archived_at=None)
+    conversation.archived_at = None
+    logger.info("Conversazione %s ripristinata dall'archivio: %s messaggi", conversation.pk, len(messages))
+    return True
+
+
+def ensure_active(conversation: LLMConversation) -> None:
+    """Prima di scrivere nella conversazione: se è archiviata la ripristina"""
+    if conversation is not None and conversation.archived_at is not None:
+        rehydrate_conversation(conversation)
+
+
+def idle_conversations(idle_days=None):
+    """Conversazioni da archiviare: inattive, con messaggi e senza richieste LLM in corso"""
+    return (
+        LLMConversation.objects.filter(archived_at__isnull=True, updated_at__lt=idle_cutoff(idle_days), message_count__gt=0)
+        .exclude(requests__status__in=['pending', 'processing'])
+        .order_by('updated_at')
+    )
@@ -0,0 +1,186 @@
+"""
+View async (ASGI) degli endpoint che attendono i provider LLM.
+
+Sotto un server ASGI (uvicorn src.config.asgi:application) l'attesa della
+risposta del provider non occupa un thread: validazione, salvataggio e
+serializzazione girano in sync_to_async, la chiamata usa i client async
+(AsyncOpenAI, AsyncAnthropic, google-genai aio). Con LLM_ASYNC_VIEWS
+sostituiscono le action DRF sugli stessi path (vedi urls.py): autenticazione,
+permessi e formato degli errori sono quelli delle view DRF (vedi api_checks).
+"""
+import functools
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException, MethodNotAllowed
+from rest_framework.views import APIView
+
+from .idempotency import aidempotent
+from .models import LLMConversation
+from .serializers import CreateLLMRequestSerializer, CreateWorkflowFileAnalysisSerializer, LLMRequestSerializer
+from .services import aprocess_llm_request, aprocess_workflow_file_analysis
+from .views import (
+    LLMRequestViewSet, QuickAnalysisRejected, log_invalid_quick_analysis,
+    prepare_quick_analysis, quick_analysis_response_data
+)
+from ..common.metrics import StageTimer
+
+logger = logging.getLogger(__name__)
+
+# Le altre operazioni sulla collezione delle richieste restano sulla view DRF
+llm_request_list = LLMRequestViewSet.as_view({'get': 'list'})
+
+
+def check_access(request, methods):
+    """
+    Metodo, autenticazione (DEFAULT_AUTHENTICATION_CLASSES), permessi e throttling
+    come in APIView.initial; restituisce la view DRF usata per formattare gli errori
+    e la risposta d'errore (None se la richiesta può proseguire). L'utente
+    autenticato resta su request.user. Da chiamare fuori dall'event loop.
+    """
+    view = APIView()
+    view.args, view.kwargs, view.headers = (), {}, {}
+    view.request = view.initialize_request(request)
+    try:
+        if request.method not in methods:
+            raise MethodNotAllowed(request.method)
+        view.initial(view.request)
+    except APIException as exc:
+        return view, error_response(view, exc)
+    return view, None
+
+
+def error_response(view, exc):
+    """Errore nello stesso formato ({"detail": ...}, status e header) delle view DRF"""
+    response = view.handle_exception(exc)
+    json_response = JsonResponse(response.data, status=response.status_code, safe=False)
+    for header, value in response.items():
+        if header != 'Content-Type':
+            json_response[header] = value
+    return json_response
+
+
+def api_checks(*methods):
+    """Decoratore delle view async: stessi controlli ed errori delle action DRF sincrone"""
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            view, response = await sync_to_async(check_access)(request, methods)
+            if response is not None:
+                return response
+            try:
+                return await view_func(request, *args, **kwargs)
+            except (APIException, Http404, PermissionDenied) as exc:
+                return error_response(view, exc)
+        return wrapper
+    return decorator
+
+
+def parse_json_body(request):
+    """Corpo JSON della richiesta (None se non è un oggetto JSON valido)"""
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def invalid_json_response():
+    return JsonResponse({'detail': 'Corpo JSON non valido'}, status=400)
+
+
+def save_llm_request(data, resolve_conversation):
+    """Valida e salva la richiesta; restituisce (richiesta, risposta d'errore)"""
+    serializer = CreateLLMRequestSerializer(data=data)
+    if not serializer.is_valid():
+        return None, JsonResponse(serializer.errors, status=400)
+
+    if not resolve_conversation:
+        return serializer.save(), None
+
+    conversation = None
+    conversation_id = serializer.validated_data.pop('conversation_id', None)
+    if conversation_id:
+        try:
+            conversation = LLMConversation.objects.get(id=conversation_id)
+        except LLMConversation.DoesNotExist:
+            # Stesso corpo del 404 di get_object_or_404 nella view DRF
+            detail = f'No {LLMConversation._meta.object_name} matches the given query.'
+            return None, JsonResponse({'detail': detail}, status=404)
+    return serializer.save(conversation=conversation), None
+
+
+def serialize_llm_request(request_obj):
+    return LLMRequestSerializer(request_obj).data
+
+
+async def run_llm_request(data, resolve_conversation):
+    request_obj, error = await sync_to_async(save_llm_request)(data, resolve_conversation)
+    if error is not None:
+        return error
+
+    processed_request = await aprocess_llm_request(request_obj)
+    return JsonResponse(await sync_to_async(serialize_llm_request)(processed_request), status=201)
+
+
+@csrf_exempt
+@api_checks('GET', 'POST')
+@aidempotent('llm.requests')
+async def llm_request_collection(request):
+    """POST /api/llm/requests/: nuova richiesta o turno di conversazione (async)"""
+    if request.method != 'POST':
+        return await sync_to_async(llm_request_list)(request)
+
+    data = parse_json_body(request)
+    if data is None:
+        return invalid_json_response()
+    return await run_llm_request(data, resolve_conversation=True)
+
+
+@csrf_exempt
+@api_checks('POST')
+@aidempotent('llm.quick_request')
+async def quick_request(request):
+    """POST /api/llm/requests/quick_request/ (async)"""
+    data = parse_json_body(request)
+    if data is None:
+        return invalid_json_response()
+    return await run_llm_request(data, resolve_conversation=False)
+
+
+@csrf_exempt
+@api_checks('POST')
+@aidempotent('llm.quick_analysis')
+async def quick_analysis(request):
+    """POST /api/llm/workflow-analysis/quick_analysis/ (async, senza salvare l'analisi)"""
+    logger.info("QUICK_ANALYSIS (async): Ricevuta richiesta POST")
+    data = parse_json_body(request)
+    if data is None:
+        return invalid_json_response()
+
+    timer = StageTimer('quick_analysis')
+
+    def prepare():
+        serializer = CreateWorkflowFileAnalysisSerializer(data=data)
+        if not serializer.is_valid():
+            log_invalid_quick_analysis(serializer, data)
+            return None, serializer.errors
+        return prepare_quick_analysis(serializer.validated_data, timer), None
+
+    try:
+        temp_analysis, errors = await sync_to_async(prepare)()
+        if errors:
+            return JsonResponse(errors, status=400)
+
+        processed_analysis = await aprocess_workflow_file_analysis(temp_analysis, timer=timer)
+        return JsonResponse(quick_analysis_response_data(processed_analysis, timer))
+
+    except QuickAnalysisRejected as e:
+        return JsonResponse(e.payload, status=e.status_code)
+    except Exception as e:
+        logger.error("❌ Errore durante l'analisi: %s", e)
+        return JsonResponse({'error': str(e)}, status=400)
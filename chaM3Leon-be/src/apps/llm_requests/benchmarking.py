@@ -0,0 +1,70 @@
+import math
+
+from .models import LLMProvider, LLMModel
+
+BENCHMARK_TAG = 'benchmark-llm'
+MOCK_MODEL_NAME = 'mock-echo'
+
+# Workflow Metaflow minimale usato come input delle analisi nei benchmark
+SAMPLE_WORKFLOW = '''from metaflow import FlowSpec, step
+
+
+class BenchmarkFlow(FlowSpec):
+    """Workflow di esempio per i benchmark"""
+
+    @step
+    def start(self):
+        self.values = list(range(100))
+        self.next(self.transform)
+
+    @step
+    def transform(self):
+        self.squares = [value * value for value in self.values]
+        self.next(self.end)
+
+    @step
+    def end(self):
+        print(sum(self.squares))
+
+
+if __name__ == '__main__':
+    BenchmarkFlow()
+'''
+
+
+def ensure_mock_model():
+    """Provider e modello mock (inattivi: non compaiono nelle liste dell'API)"""
+    provider, _ = LLMProvider.objects.get_or_create(
+        name='mock',
+        defaults={'display_name': 'Mock', 'is_active': False}
+    )
+    model, _ = LLMModel.objects.get_or_create(
+        provider=provider,
+        name=MOCK_MODEL_NAME,
+        defaults={
+            'display_name': 'Mock Echo',
+            'is_active': False,
+            'input_price_per_million': 0,
+            'output_price_per_million': 0,
+        }
+    )
+    return model
+
+
+def percentile(values, q):
+    """Percentile con il metodo nearest-rank (q tra 0 e 100)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def summarize_latencies(latencies_ms):
+    """p50/p95/p99/max di una serie di latenze in millisecondi"""
+    return {
+        'p50': percentile(latencies_ms, 50),
+        'p95': percentile(latencies_ms, 95),
+        'p99': percentile(latencies_ms, 99),
+        'max': max(latencies_ms) if latencies_ms else None,
+    }
@@ -0,0 +1,161 @@
+"""
+Catalogo in memoria di provider, modelli e catene di fallback LLM.
+
+Sono dati che cambiano solo con populate_llm_data o dall'admin: ogni processo
+li carica una volta (tre query) insieme alla loro rappresentazione già
+serializzata per gli endpoint in sola lettura. Il salvataggio o la cancellazione
+di un provider, di un modello o di un fallback (vedi signals.py) svuota il
+catalogo del processo e cambia la versione condivisa nella cache Django; gli
+altri processi la rileggono al massimo ogni LLM_CATALOG_CHECK_S secondi.
+La versione è anche l'ETag degli endpoint di provider e modelli.
+
+Gli update massivi (QuerySet.update) non inviano segnali: dopo averli usare
+invalidate_catalog().
+"""
+import copy
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import LLMModel, LLMModelFallback, LLMProvider
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'llm_catalog_version'
+
+_lock = threading.Lock()
+_catalog = None
+_checked_at = 0.0
+
+
+class Catalog:
+    def __init__(self, version, providers, models, fallbacks):
+        # Import locale: i serializer usano a loro volta il catalogo
+        from .serializers import LLMModelSerializer, LLMProviderSerializer
+
+        self.version = version
+        self.etag = f'"{version}"'
+        self.providers = {provider.pk: provider for provider in providers}
+        self.models = {}
+        for model in models:
+            model.provider = self.providers[model.provider_id]
+            self.models[model.pk] = model
+
+        self.chains = {}
+        for link in fallbacks:
+            fallback = self.models.get(link.fallback_model_id)
+            # Un modello o un provider disattivato da admin non riceve traffico nemmeno come fallback
+            if (link.fallback_model_id != link.model_id and fallback is not None
+                    and fallback.is_active and fallback.provider.is_active):
+                self.chains.setdefault(link.model_id, []).append(link.fallback_model_id)
+
+        self.provider_data = {provider.pk: dict(LLMProviderSerializer(provider).data) for provider in providers}
+        self.model_data = {model.pk: dict(LLMModelSerializer(model).data) for model in models}
+        # Dati serializzati per collezione ('providers' o 'models'), per le viewset
+        self.data = {'providers': self.provider_data, 'models': self.model_data}
+
+    @classmethod
+    def load(cls, version):
+        providers = list(LLMProvider.objects.order_by('pk'))
+        models = list(LLMModel.objects.order_by('pk'))
+        fallbacks = list(
+            LLMModelFallback.objects.filter(is_active=True)
+            .only('model_id', 'fallback_model_id')
+            .order_by('priority', 'id')
+        )
+        return cls(version, providers, models, fallbacks)
+
+    def get_model(self, pk):
+        """
+        Copia del modello (con il provider già caricato), così chi la usa può
+        modificarla senza toccare il catalogo condiviso tra i thread
+        """
+        model = self.models.get(pk)
+        return copy.copy(model) if model is not None else None
+
+    def fallback_chain(self, model):
+        """Come LLMModel.fallback_chain(), senza query"""
+        return [model] + [self.get_model(pk) for pk in self.chains.get(model.pk, [])]
+
+    def active_providers(self):
+        return [provider for provider in self.providers.values() if provider.is_active]
+
+    def active_models(self, provider_name=None):
+        return [
+            model for model in self.models.values()
+            if model.is_active and (provider_name is None or model.provider.name == provider_name)
+        ]
+
+    def active(self, collection, provider_name=None):
+        """Provider o modelli attivi ('providers' o 'models'), eventualmente di un solo provider"""
+        if collection == 'providers':
+            return [
+                provider for provider in self.active_providers()
+                if provider_name is None or provider.name == provider_name
+            ]
+        return self.active_models(provider_name)
+
+
+def shared_version():
+    """Versione corrente del catalogo nella cache condivisa (creata al primo accesso)"""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def get_catalog(force_check=False):
+    """
+    Catalogo del processo: la versione condivisa viene confrontata al massimo
+    ogni LLM_CATALOG_CHECK_S secondi (force_check per confrontarla subito)
+    """
+    global _catalog, _checked_at
+    catalog = _catalog
+    now = time.monotonic()
+    if catalog is not None and not force_check and now - _checked_at < settings.LLM_CATALOG_CHECK_S:
+        return catalog
+
+    try:
+        version = shared_version()
+    except Exception as e:
+        # Cache non raggiungibile: meglio un catalogo locale che una query per richiesta
+        logger.warning("Versione del catalogo LLM non disponibile: %s", e)
+        version = catalog.version if catalog is not None else uuid.uuid4().hex
+
+    with _lock:
+        if _catalog is None or _catalog.version != version:
+            _catalog = Catalog.load(version)
+            logger.info("Catalogo LLM caricato (versione %s): %s modelli", version, len(_catalog.models))
+        _checked_at = now
+        return _catalog
+
+
+def lookup_model(pk):
+    """Modello LLM dal catalogo; se manca ricontrolla subito la versione (modello appena creato)"""
+    model = get_catalog().get_model(pk)
+    if model is None:
+        model = get_catalog(force_check=True).get_model(pk)
+    return model
+
+
+def invalidate_catalog():
+    """Svuota il catalogo del processo e, dopo il commit, cambia la versione condivisa"""
+    global _catalog
+    _catalog = None
+
+    def bump_version():
+        global _catalog
+        _catalog = None
+        try:
+            cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        except Exception as e:
+            logger.warning("Versione del catalogo LLM non aggiornata: %s", e)
+
+    # Dopo il commit: un altro processo non deve ricaricare i dati vecchi con la versione nuova
+    transaction.on_commit(bump_version)
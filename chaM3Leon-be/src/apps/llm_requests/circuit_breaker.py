@@ -0,0 +1,184 @@
+import logging
+import math
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+KEY_PREFIX = 'llm_breaker'
+WINDOW_FIELDS = ('calls', 'failures', 'slow_calls', 'latency_ms')
+
+
+class CircuitOpenError(Exception):
+    """Chiamata rifiutata senza contattare il provider: circuito aperto"""
+    pass
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker di un provider o di un modello LLM.
+
+    Esiti e latenze sono sommati in bucket di LLM_BREAKER_BUCKET_S secondi nella
+    cache Django, quindi la finestra mobile è condivisa da tutti i worker. Lo
+    stato 'open' è una chiave con la scadenza dell'apertura: passata quella il
+    circuito è half-open e una sola chiamata di prova (cache.add) decide se
+    richiuderlo o riaprirlo.
+    """
+
+    def __init__(self, scope):
+        self.scope = scope
+
+    @classmethod
+    def for_provider(cls, provider_name):
+        return cls(f'provider:{provider_name}')
+
+    @classmethod
+    def for_model(cls, model):
+        return cls(f'model:{model.pk}')
+
+    def key(self, suffix):
+        return f'{KEY_PREFIX}:{self.scope}:{suffix}'
+
+    def bucket_keys(self, now):
+        size = settings.LLM_BREAKER_BUCKET_S
+        current = int(now // size)
+        count = max(math.ceil(settings.LLM_BREAKER_WINDOW_S / size), 1)
+        return [self.key(f'bucket:{index}') for index in range(current - count + 1, current + 1)]
+
+    def window(self, now=None):
+        """Totali della finestra mobile: chiamate, errori, chiamate lente e latenza cumulata"""
+        totals = dict.fromkeys(WINDOW_FIELDS, 0)
+        for bucket in cache.get_many(self.bucket_keys(now or time.time())).values():
+            for field in WINDOW_FIELDS:
+                totals[field] += bucket.get(field, 0)
+        return totals
+
+    def is_open(self, state, now):
+        """state: valore della chiave di stato già letto dalla cache (None se chiuso)"""
+        return state is not None and now < state['open_until']
+
+    def acquire_probe(self, now):
+        """Half-open: passa solo la chiamata che riesce a prendere il lock di prova"""
+        return cache.add(self.key('probe'), now, timeout=settings.LLM_PROVIDER_TIMEOUT_S + 5)
+
+    def release_probe(self):
+        cache.delete(self.key('probe'))
+
+    def record(self, success, latency_ms=None):
+        now = time.time()
+        key = self.bucket_keys(now)[-1]
+        cached = cache.get_many([key, self.key('state')])
+        # Lettura-modifica-scrittura non atomica: con worker concorrenti qualche
+        # conteggio può andare perso, accettabile per una stima del tasso di errore
+        bucket = cached.get(key) or dict.fromkeys(WINDOW_FIELDS, 0)
+        bucket['calls'] += 1
+        if not success:
+            bucket['failures'] += 1
+        if latency_ms is not None:
+            bucket['latency_ms'] += int(latency_ms)
+            if latency_ms >= settings.LLM_BREAKER_SLOW_CALL_MS:
+                bucket['slow_calls'] += 1
+        cache.set(key, bucket, timeout=settings.LLM_BREAKER_WINDOW_S + settings.LLM_BREAKER_BUCKET_S)
+
+        state = cached.get(self.key('state'))
+        if state is not None:
+            if now >= state['open_until']:
+                # Esito della chiamata di prova half-open
+                self.release_probe()
+                if success:
+                    self.close()
+                else:
+                    self.open(now, reason='chiamata di prova fallita')
+            return
+
+        totals = self.window(now)
+        if totals['calls'] < settings.LLM_BREAKER_MIN_CALLS:
+            return
+        error_rate = totals['failures'] / totals['calls']
+        slow_rate = totals['slow_calls'] / totals['calls']
+        if error_rate >= settings.LLM_BREAKER_ERROR_RATE:
+            self.open(now, reason=f'tasso di errore {error_rate:.0%}')
+        elif slow_rate >= settings.LLM_BREAKER_SLOW_RATE:
+            self.open(now, reason=f'chiamate lente {slow_rate:.0%}')
+
+    def open(self, now, reason=''):
+        logger.warning("Circuit breaker %s aperto per %ss: %s", self.scope, settings.LLM_BREAKER_OPEN_S, reason)
+        cache.set(self.key('state'), {'opened_at': now, 'open_until': now + settings.LLM_BREAKER_OPEN_S}, timeout=None)
+
+    def close(self):
+        logger.info("Circuit breaker %s richiuso", self.scope)
+        # Azzera la finestra: gli errori che hanno aperto il circuito non devono riaprirlo subito
+        cache.delete_many([self.key('state'), *self.bucket_keys(time.time())])
+
+    def status(self):
+        """Stato e statistiche della finestra, per l'endpoint di health"""
+        now = time.time()
+        state = cache.get(self.key('state'))
+        totals = self.window(now)
+
+        if state is None:
+            current, open_until = CLOSED, None
+        else:
+            current = OPEN if now < state['open_until'] else HALF_OPEN
+            open_until = datetime.fromtimestamp(state['open_until'], tz=dt_timezone.utc)
+
+        calls = totals['calls']
+        return {
+            'state': current,
+            'open_until': open_until,
+            'window_seconds': settings.LLM_BREAKER_WINDOW_S,
+            'calls': calls,
+            'failures': totals['failures'],
+            'error_rate': round(totals['failures'] / calls, 3) if calls else None,
+            'slow_calls': totals['slow_calls'],
+            'avg_latency_ms': round(totals['latency_ms'] / calls) if calls else None,
+        }
+
+
+def model_breakers(model):
+    return [CircuitBreaker.for_provider(model.provider.name), CircuitBreaker.for_model(model)]
+
+
+def allow_model(model):
+    """False se il circuito del provider o del modello è aperto (se la cache non risponde, consente)"""
+    if not settings.LLM_BREAKER_ENABLED:
+        return True
+    try:
+        now = time.time()
+        breakers = model_breakers(model)
+        states = cache.get_many([breaker.key('state') for breaker in breakers])
+        # Prima lo stato di tutti i circuiti: un lock di prova preso da un circuito
+        # half-open resterebbe inutilizzato se poi un altro rifiutasse la chiamata
+        if any(breaker.is_open(states.get(breaker.key('state')), now) for breaker in breakers):
+            return False
+        probes = []
+        for breaker in breakers:
+            if states.get(breaker.key('state')) is None:
+                continue
+            if not breaker.acquire_probe(now):
+                for probe in probes:
+                    probe.release_probe()
+                return False
+            probes.append(breaker)
+        return True
+    except Exception as e:
+        logger.warning("Circuit breaker non disponibile, chiamata consentita: %s", e)
+        return True
+
+
+def record_model_outcome(model, success, latency_ms=None):
+    """Registra l'esito di una chiamata nei circuit breaker del provider e del modello"""
+    if not settings.LLM_BREAKER_ENABLED:
+        return
+    try:
+        for breaker in model_breakers(model):
+            breaker.record(success, latency_ms)
+    except Exception as e:
+        logger.warning("Circuit breaker non disponibile, esito non registrato: %s", e)
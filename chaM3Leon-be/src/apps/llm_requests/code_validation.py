@@ -0,0 +1,214 @@
+"""
+Validazione locale del codice restituito dal modello, prima di sovrascrivere il
+file e di deployarlo su ml_runner.
+
+I controlli, tutti in memoria: estrazione del codice dalla risposta (blocchi
+markdown o testo attorno al codice), ast.parse e compile(), presenza della
+sottoclasse di FlowSpec con un grafo di @step coerente (start, end, target di
+self.next esistenti e raggiungibili) e, se è configurato il manifest
+dell'ambiente del runner (ML_RUNNER_MODULES_MANIFEST), risoluzione dei moduli
+importati per la prima volta dalla risposta.
+"""
+import ast
+import os
+import re
+import sys
+from functools import lru_cache
+from typing import Dict, List, Optional, Set
+
+from django.conf import settings
+
+from .workflow_ast import is_step
+
+FENCE_PATTERN = re.compile(r"```[ \t]*(?:python|py|python3)?[ \t]*\n(.*?)```", re.DOTALL | re.IGNORECASE)
+CODE_START_PATTERN = re.compile(r"^(import |from |#|@|class |def |async def |\"\"\"|'''|if __name__)")
+
+
+class CodeValidationError(Exception):
+    """Il codice non supera la validazione: problems elenca i motivi"""
+
+    def __init__(self, problems: List[str]):
+        self.problems = problems
+        super().__init__('; '.join(problems))
+
+
+def extract_code(response: str) -> str:
+    """
+    Codice Python contenuto nella risposta del modello: il blocco markdown più
+    lungo se presente, altrimenti il testo senza le eventuali righe di prosa
+    prima e dopo il codice
+    """
+    blocks = [block.strip('\n') for block in FENCE_PATTERN.findall(response)]
+    if blocks:
+        return max(blocks, key=len).strip() + '\n'
+
+    text = response.strip()
+    # Blocco aperto e mai chiuso (risposta troncata)
+    text = re.sub(r"^```[ \t]*(?:python|py|python3)?[ \t]*\n", '', text, flags=re.IGNORECASE)
+    lines = text.splitlines()
+
+    start = next((index for index, line in enumerate(lines) if CODE_START_PATTERN.match(line)), 0)
+    lines = lines[start:]
+    # Prosa in coda: righe non indentate che impediscono il parsing
+    while len(lines) > 1 and not parses('\n'.join(lines)) and lines[-1] and not lines[-1][0].isspace():
+        lines.pop()
+    return '\n'.join(lines).strip() + '\n'
+
+
+def parses(code: str) -> bool:
+    try:
+        ast.parse(code)
+        return True
+    except SyntaxError:
+        return False
+
+
+def is_flowspec(node: ast.ClassDef) -> bool:
+    for base in node.bases:
+        name = base.id if isinstance(base, ast.Name) else getattr(base, 'attr', None)
+        if name == 'FlowSpec':
+            return True
+    return False
+
+
+def next_targets(function: ast.FunctionDef) -> Optional[List[str]]:
+    """Step indicati da self.next(...) nel metodo (None se il metodo non chiama self.next)"""
+    targets = None
+    for node in ast.walk(function):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'next'):
+            continue
+        if not (isinstance(node.func.value, ast.Name) and node.func.value.id == 'self'):
+            continue
+        targets = targets or []
+        for arg in node.args:
+            # self.next(self.a, self.b) oppure transizioni condizionali self.next({'x': self.a}, ...)
+            for value in (arg.values if isinstance(arg, ast.Dict) else [arg]):
+                if isinstance(value, ast.Attribute) and isinstance(value.value, ast.Name) and value.value.id == 'self':
+                    targets.append(value.attr)
+    return targets
+
+
+def flow_graphs(tree: ast.Module) -> Dict[str, Dict[str, Optional[List[str]]]]:
+    """Per ogni sottoclasse di FlowSpec: step -> step successivi"""
+    graphs = {}
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and is_flowspec(node):
+            graphs[node.name] = {item.name: next_targets(item) for item in node.body if is_step(item)}
+    return graphs
+
+
+def graph_problems(class_name: str, graph: Dict[str, Optional[List[str]]]) -> List[str]:
+    problems = []
+    for required in ('start', 'end'):
+        if required not in graph:
+            problems.append(f"{class_name}: manca lo step '{required}'")
+
+    for name, targets in graph.items():
+        if name == 'end':
+            if targets:
+                problems.append(f"{class_name}.end non deve chiamare self.next")
+            continue
+        if targets is None:
+            problems.append(f"{class_name}.{name} non chiama self.next(...)")
+            continue
+        for target in targets:
+            if target not in graph:
+                problems.append(f"{class_name}.{name}: self.next punta allo step inesistente '{target}'")
+
+    if 'start' in graph:
+        reached, pending = set(), ['start']
+        while pending:
+            name = pending.pop()
+            if name in reached or name not in graph:
+                continue
+            reached.add(name)
+            pending.extend(graph[name] or [])
+        unreachable = sorted(set(graph) - reached)
+        if unreachable:
+            problems.append(f"{class_name}: step non raggiungibili da start: {', '.join(unreachable)}")
+    return problems
+
+
+def imported_modules(tree: ast.Module) -> Set[str]:
+    """Moduli di primo livello importati (import assoluti, anche dentro funzioni)"""
+    modules = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            modules.add(node.module.split('.')[0])
+    return modules
+
+
+@lru_cache(maxsize=4)
+def load_manifest(path: str, mtime: float) -> frozenset:
+    """Moduli importabili sul runner, uno per riga (mtime invalida la cache)"""
+    with open(path, encoding='utf-8') as f:
+        return frozenset(
+            line.strip() for line in f
+            if line.strip() and not line.lstrip().startswith('#')
+        )
+
+
+def runner_modules() -> Optional[frozenset]:
+    """Moduli del manifest del runner, None se non configurato o assente"""
+    path = settings.ML_RUNNER_MODULES_MANIFEST
+    if not path or not os.path.exists(path):
+        return None
+    return load_manifest(path, os.path.getmtime(path)) | frozenset(settings.ML_RUNNER_EXTRA_MODULES)
+
+
+def validate_workflow_code(code: str, original: Optional[str] = None, filename: str = '<workflow>') -> None:
+    """
+    Solleva CodeValidationError se il codice non compila, se manca una sottoclasse
+    di FlowSpec con un grafo di step valido, se sono spariti step presenti
+    nell'originale o se importa moduli nuovi non disponibili sul runner
+    """
+    try:
+        tree = ast.parse(code, filename)
+        compile(tree, filename, 'exec')
+    except SyntaxError as e:
+        raise CodeValidationError([f"Errore di sintassi alla riga {e.lineno}: {e.msg}"])
+    except ValueError as e:
+        raise CodeValidationError([f"Codice non compilabile: {e}"])
+
+    original_tree, original_graphs = None, {}
+    if original:
+        try:
+            original_tree = ast.parse(original)
+            original_graphs = flow_graphs(original_tree)
+        except SyntaxError:
+            pass
+
+    graphs = flow_graphs(tree)
+    if not graphs and (original_tree is None or original_graphs):
+        raise CodeValidationError(["Nessuna sottoclasse di FlowSpec con metodi @step"])
+
+    problems = []
+    for class_name, graph in graphs.items():
+        # I difetti già presenti nel file originale non sono imputabili alla risposta
+        inherited = set(graph_problems(class_name, original_graphs[class_name])) if class_name in original_graphs else set()
+        problems.extend(problem for problem in graph_problems(class_name, graph) if problem not in inherited)
+
+    if original_tree is not None:
+        for class_name, original_graph in original_graphs.items():
+            if class_name not in graphs:
+                problems.append(f"La classe {class_name} non è più presente")
+                continue
+            removed = sorted(set(original_graph) - set(graphs[class_name]))
+            if removed:
+                problems.append(f"{class_name}: step rimossi: {', '.join(removed)}")
+
+    available = runner_modules()
+    if available is not None:
+        # Solo gli import introdotti dal modello: quelli del file originale erano già lì
+        known = imported_modules(original_tree) if original_tree is not None else set()
+        missing = sorted(
+            module for module in imported_modules(tree) - known
+            if module not in sys.stdlib_module_names and module not in available
+        )
+        if missing:
+            problems.append(f"Moduli non disponibili sul runner: {', '.join(missing)}")
+
+    if problems:
+        raise CodeValidationError(problems)
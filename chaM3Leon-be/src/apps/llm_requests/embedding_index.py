@@ -0,0 +1,278 @@
+"""
+Indice vettoriale locale degli step migliorati nelle analisi precedenti, per
+aggiungere al prompt esempi few-shot di miglioramenti di codice simile.
+
+Gli elementi sono le righe di WorkflowStepCache in cui il modello ha modificato
+lo step (sorgente inviato -> sorgente migliorato). Gli embedding del sorgente
+sono calcolati su CPU e salvati in LLM_EMBEDDING_INDEX_DIR come matrice NumPy
+normalizzata (indice flat: prodotto scalare = similarità coseno) insieme agli id
+delle righe e al watermark di updated_at, in un unico file .npz sostituito con
+un solo os.replace: chi legge vede sempre vettori e id della stessa versione.
+
+Backend di embedding (LLM_EMBEDDING_BACKEND):
+- 'hashing': feature hashing di identificatori e bigrammi di token, senza modelli
+  da scaricare; adatto a riconoscere codice con struttura e nomi simili;
+- 'fastembed': modello ONNX LLM_EMBEDDING_MODEL tramite il pacchetto opzionale
+  fastembed; se non è installato si usa 'hashing'.
+
+L'aggiornamento è incrementale (solo le righe modificate dopo il watermark) e
+avviene sotto un lock su file, fuori dalle richieste: un'analisi che salva
+nuovi step marca l'indice come da aggiornare (mark_stale) e l'aggiornamento
+avviene in un thread in background (LLM_EMBEDDING_AUTO_UPDATE) o con
+'manage.py update_embedding_index --if-stale' periodico. Un indice creato con
+un altro backend o un'altra dimensione viene ricostruito da capo.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db.models import F
+from django.utils.dateparse import parse_datetime
+
+from .models import WorkflowStepCache
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:  # l'indice è opzionale: senza NumPy le analisi non ricevono esempi
+    np = None
+
+INDEX_FILE = 'index.npz'
+LOCK_FILE = '.lock'
+STALE_FILE = '.stale'
+TOKEN_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+|[^\sA-Za-z0-9_]")
+
+
+class EmbeddingIndexUnavailable(Exception):
+    """NumPy non installato o indice non ancora creato"""
+    pass
+
+
+class HashingEmbedder:
+    """Feature hashing di token e bigrammi (segno dal hash, pesi log tf), vettori normalizzati"""
+    name = 'hashing'
+
+    def __init__(self, dimension):
+        self.dimension = dimension
+
+    def features(self, text):
+        tokens = TOKEN_PATTERN.findall(text)
+        return tokens + [f'{first} {second}' for first, second in zip(tokens, tokens[1:])]
+
+    def embed_one(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for feature in self.features(text):
+            digest = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+            vector[digest % self.dimension] += 1.0 if (digest >> 63) & 1 else -1.0
+        return np.sign(vector) * np.log1p(np.abs(vector))
+
+    def embed(self, texts):
+        return normalize(np.stack([self.embed_one(text) for text in texts])) if texts else self.empty()
+
+    def empty(self):
+        return np.zeros((0, self.dimension), dtype=np.float32)
+
+
+class FastEmbedEmbedder:
+    name = 'fastembed'
+
+    def __init__(self, model_name):
+        from fastembed import TextEmbedding
+        self.model_name = model_name
+        self.model = TextEmbedding(model_name=model_name)
+        self.dimension = len(next(iter(self.model.embed(['probe']))))
+
+    def embed(self, texts):
+        return normalize(np.asarray(list(self.model.embed(texts)), dtype=np.float32)) if texts else self.empty()
+
+    def empty(self):
+        return np.zeros((0, self.dimension), dtype=np.float32)
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+
+@lru_cache(maxsize=1)
+def get_embedder():
+    """Embedder configurato (uno per processo: il caricamento del modello è costoso)"""
+    if np is None:
+        raise EmbeddingIndexUnavailable('NumPy non installato')
+    if settings.LLM_EMBEDDING_BACKEND == 'fastembed':
+        try:
+            return FastEmbedEmbedder(settings.LLM_EMBEDDING_MODEL)
+        except Exception as e:
+            logger.warning("Backend fastembed non disponibile, uso hashing: %s", e)
+    return HashingEmbedder(settings.LLM_EMBEDDING_DIMENSION)
+
+
+def embedder_signature(embedder):
+    return {'backend': embedder.name, 'model': getattr(embedder, 'model_name', ''), 'dimension': embedder.dimension}
+
+
+def index_path(name):
+    return os.path.join(settings.LLM_EMBEDDING_INDEX_DIR, name)
+
+
+def indexable_steps():
+    """Step effettivamente modificati dal modello, con il sorgente originale salvato"""
+    return WorkflowStepCache.objects.exclude(source='').exclude(improved_hash=F('source_hash'))
+
+
+def read_index():
+    """(metadati, id, vettori) letti insieme dallo stesso file; None se manca o non è leggibile"""
+    try:
+        with np.load(index_path(INDEX_FILE)) as data:
+            return json.loads(str(data['meta'])), data['ids'].tolist(), data['vectors']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_index(meta, ids, vectors):
+    path = index_path(INDEX_FILE)
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez(f, meta=np.array(json.dumps(meta)), ids=np.asarray(ids, dtype=np.int64), vectors=vectors)
+    os.replace(temp_path, path)
+
+
+def ensure_index_dir():
+    if not os.path.isdir(settings.LLM_EMBEDDING_INDEX_DIR):
+        os.makedirs(settings.LLM_EMBEDDING_INDEX_DIR, exist_ok=True)
+        # File generati: fuori dal controllo di versione
+        with open(index_path('.gitignore'), 'w') as f:
+            f.write('*\n')
+
+
+def mark_stale():
+    """Segnala che ci sono step nuovi da indicizzare (operazione economica, dalle richieste)"""
+    ensure_index_dir()
+    with open(index_path(STALE_FILE), 'w'):
+        pass
+
+
+def is_stale():
+    return os.path.exists(index_path(STALE_FILE)) or not os.path.exists(index_path(INDEX_FILE))
+
+
+def update_index(rebuild=False, blocking=True, batch_size=256):
+    """
+    Aggiunge all'indice le righe nuove o modificate dopo il watermark e rimuove
+    quelle cancellate. Restituisce il numero di step (ri)calcolati, None se il
+    lock è occupato e blocking=False.
+    """
+    embedder = get_embedder()
+    ensure_index_dir()
+    with open(index_path(LOCK_FILE), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return None
+
+        # Rimosso prima di leggere le righe: gli step salvati da qui in poi lo ricreano
+        try:
+            os.remove(index_path(STALE_FILE))
+        except FileNotFoundError:
+            pass
+
+        index = None if rebuild else read_index()
+        if index is not None and index[0].get('signature') != embedder_signature(embedder):
+            logger.info("Indice creato con un altro embedder: ricostruzione completa")
+            index = None
+        if index is None:
+            ids, vectors, watermark = [], embedder.empty(), None
+        else:
+            meta, ids, vectors = index
+            watermark = parse_datetime(meta['watermark']) if meta.get('watermark') else None
+
+        queryset = indexable_steps()
+        if watermark is not None:
+            queryset = queryset.filter(updated_at__gte=watermark)
+        changed = list(queryset.order_by('updated_at').values_list('id', 'source', 'updated_at'))
+
+        # Righe cancellate o non più indicizzabili (es. step migliorato uguale all'originale)
+        existing = set(indexable_steps().values_list('id', flat=True))
+        keep = [index for index, pk in enumerate(ids) if pk in existing]
+        if len(keep) != len(ids):
+            ids = [ids[index] for index in keep]
+            vectors = vectors[keep]
+
+        positions = {pk: index for index, pk in enumerate(ids)}
+        for start in range(0, len(changed), batch_size):
+            batch = changed[start:start + batch_size]
+            embedded = embedder.embed([source for _, source, _ in batch])
+            new_rows = []
+            for (pk, _, _), vector in zip(batch, embedded):
+                if pk in positions:
+                    vectors[positions[pk]] = vector
+                else:
+                    positions[pk] = len(ids) + len(new_rows)
+                    new_rows.append((pk, vector))
+            if new_rows:
+                ids = ids + [pk for pk, _ in new_rows]
+                vectors = np.concatenate([vectors, np.stack([vector for _, vector in new_rows])])
+
+        if changed:
+            watermark = changed[-1][2]
+        write_index({
+            'signature': embedder_signature(embedder),
+            'watermark': watermark.isoformat() if watermark else None,
+        }, ids, vectors)
+    return len(changed)
+
+
+@lru_cache(maxsize=2)
+def load_index(mtime):
+    """(id, vettori) dell'indice su disco; mtime del file invalida la cache"""
+    index = read_index()
+    if index is None:
+        raise EmbeddingIndexUnavailable('Indice non ancora creato')
+    meta, ids, vectors = index
+    return ids, vectors, meta['signature']
+
+
+def search(queries, k):
+    """
+    (id, punteggio) delle k righe più simili ad almeno uno dei testi (similarità
+    massima sui testi), con punteggio non inferiore a LLM_FEW_SHOT_MIN_SCORE
+    """
+    embedder = get_embedder()
+    try:
+        mtime = os.path.getmtime(index_path(INDEX_FILE))
+    except OSError:
+        raise EmbeddingIndexUnavailable('Indice non ancora creato')
+    ids, vectors, signature = load_index(mtime)
+    if not ids or not queries or signature != embedder_signature(embedder):
+        return []
+
+    scores = (vectors @ embedder.embed(queries).T).max(axis=1)
+    ranked = np.argsort(-scores)[:k]
+    return [(ids[index], float(scores[index])) for index in ranked if scores[index] >= settings.LLM_FEW_SHOT_MIN_SCORE]
+
+
+def few_shot_examples(sources, exclude_hashes=(), k=None):
+    """
+    Le righe di WorkflowStepCache più simili ai sorgenti indicati, escluse quelle
+    il cui step migliorato è già nel file (exclude_hashes): mostrerebbero al
+    modello come risultato il codice che sta già analizzando
+    """
+    k = settings.LLM_FEW_SHOT_K if k is None else k
+    excluded = set(exclude_hashes)
+    # Qualche candidato in più: gli esclusi si riconoscono solo dopo averli letti
+    candidates = search(sources, k + len(excluded))
+    rows = WorkflowStepCache.objects.in_bulk([pk for pk, _ in candidates])
+    examples = []
+    for pk, _ in candidates:
+        row = rows.get(pk)
+        if row is not None and row.improved_hash not in excluded:
+            examples.append(row)
+        if len(examples) >= k:
+            break
+    return examples
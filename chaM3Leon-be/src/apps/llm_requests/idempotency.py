@@ -0,0 +1,258 @@
+"""
+Supporto all'header Idempotency-Key per le POST che chiamano un provider LLM o
+deployano su ml_runner.
+
+La prima richiesta con una chiave inserisce una riga IdempotencyKey in stato
+'processing' (il vincolo unico fa da lock tra i worker) e al termine salva
+status e corpo della risposta. Un retry con la stessa chiave:
+
+- riceve la risposta salvata (header Idempotent-Replayed), se la prima è terminata;
+- attende fino a IDEMPOTENCY_WAIT_S che la prima termini, se è ancora in corso;
+  oltre risponde 409 con Retry-After;
+- riceve 422 se il corpo è diverso da quello della prima richiesta.
+
+Le risposte 5xx, quelle marcate con release_on_retry (errori transitori che
+l'API restituisce come 4xx) e le eccezioni non vengono salvate: la chiave viene
+rilasciata e il retry riesegue la richiesta. Una chiave rimasta 'processing' per più di
+IDEMPOTENCY_LOCK_S (worker terminato a metà) può essere ripresa da un retry.
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+POLL_INTERVAL_S = 0.5
+
+
+class IdempotencyRejected(Exception):
+    """La richiesta non può essere eseguita né servita dalla risposta salvata"""
+
+    def __init__(self, payload, status_code, retry_after=None):
+        self.payload = payload
+        self.status_code = status_code
+        self.retry_after = retry_after
+        super().__init__(payload.get('detail'))
+
+
+def request_scope(user, scope):
+    """Le chiavi valgono per endpoint e utente: client diversi possono generare la stessa chiave"""
+    user_id = user.pk if user is not None and user.is_authenticated else 'anon'
+    return f'{scope}:{user_id}'
+
+
+def claim(scope, key, request_hash):
+    """
+    Riserva la chiave per questa richiesta: restituisce (riga, True) se va
+    eseguita, (riga esistente, False) se è un retry
+    """
+    now = timezone.now()
+    # Chiavi scadute o abbandonate da un worker terminato: la richiesta riparte da capo
+    IdempotencyKey.objects.filter(scope=scope, key=key).filter(
+        expires_at__lte=now
+    ).delete()
+    IdempotencyKey.objects.filter(
+        scope=scope, key=key, status='processing',
+        created_at__lte=now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_S),
+    ).delete()
+
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(
+                scope=scope, key=key, request_hash=request_hash,
+                expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_TTL_S),
+            )
+        return record, True
+    except IntegrityError:
+        record = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+        if record is None:
+            # Rilasciata nel frattempo dalla richiesta originale: nuovo tentativo
+            return claim(scope, key, request_hash)
+        return record, False
+
+
+def check_retry(record, request_hash):
+    if record.request_hash != request_hash:
+        raise IdempotencyRejected(
+            {'detail': f'{HEADER} già usata per una richiesta con un corpo diverso'}, 422
+        )
+
+
+def pending_rejection():
+    return IdempotencyRejected(
+        {'detail': f'Richiesta con la stessa {HEADER} ancora in corso, riprovare più tardi'},
+        409, retry_after=max(int(settings.IDEMPOTENCY_WAIT_S), 1),
+    )
+
+
+def wait_for_completion(record):
+    """
+    Attende la risposta della richiesta originale ancora in corso: None se la
+    chiave è stata rilasciata, 409 oltre IDEMPOTENCY_WAIT_S
+    """
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_S
+    while record is not None and record.status == 'processing':
+        if time.monotonic() >= deadline:
+            raise pending_rejection()
+        time.sleep(POLL_INTERVAL_S)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+    return record
+
+
+async def await_completion(record):
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_S
+    while record is not None and record.status == 'processing':
+        if time.monotonic() >= deadline:
+            raise pending_rejection()
+        await asyncio.sleep(POLL_INTERVAL_S)
+        record = await IdempotencyKey.objects.filter(pk=record.pk).afirst()
+    return record
+
+
+def acquire(scope, key, request_hash):
+    """
+    (riga, True) se la richiesta va eseguita; (riga completata, False) se è un
+    retry da servire con la risposta salvata
+    """
+    while True:
+        record, created = claim(scope, key, request_hash)
+        if created:
+            return record, True
+        check_retry(record, request_hash)
+        record = wait_for_completion(record)
+        if record is not None:
+            return record, False
+
+
+async def aacquire(scope, key, request_hash):
+    while True:
+        record, created = await sync_to_async(claim)(scope, key, request_hash)
+        if created:
+            return record, True
+        check_retry(record, request_hash)
+        record = await await_completion(record)
+        if record is not None:
+            return record, False
+
+
+def release_on_retry(response):
+    """
+    Marca la risposta di un errore transitorio (es. host SSH non raggiungibile)
+    che l'endpoint restituisce come 4xx: la chiave non conserva la risposta e il
+    retry con la stessa chiave riesegue la richiesta
+    """
+    response.idempotency_release = True
+    return response
+
+
+def store_response(record, response, body):
+    """Salva la risposta per i retry; 5xx ed errori transitori rilasciano la chiave così il retry riesegue"""
+    status_code = response.status_code
+    if status_code >= 500 or getattr(response, 'idempotency_release', False):
+        record.delete()
+        return
+    record.status = 'completed'
+    record.response_status = status_code
+    record.response_body = body
+    record.save(update_fields=['status', 'response_status', 'response_body'])
+
+
+def release(record):
+    IdempotencyKey.objects.filter(pk=record.pk, status='processing').delete()
+
+
+def read_key(request):
+    """Chiave della richiesta ('' se assente: la richiesta viene eseguita senza idempotenza)"""
+    if request.method != 'POST':
+        return ''
+    key = request.headers.get(HEADER, '').strip()
+    if len(key) > MAX_KEY_LENGTH:
+        raise IdempotencyRejected({'detail': f'{HEADER} più lunga di {MAX_KEY_LENGTH} caratteri'}, 400)
+    return key
+
+
+def body_hash(request):
+    # Letto prima del parsing di DRF: il corpo resta in cache sulla richiesta Django
+    return hashlib.sha256(request.body or b'').hexdigest()
+
+
+def idempotent(scope):
+    """Decoratore per action DRF sincrone (self, request, ...)"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(self, request, *args, **kwargs):
+            try:
+                key = read_key(request)
+                if not key:
+                    return view(self, request, *args, **kwargs)
+                record, created = acquire(request_scope(request.user, scope), key, body_hash(request))
+            except IdempotencyRejected as e:
+                headers = {'Retry-After': str(e.retry_after)} if e.retry_after else None
+                return Response(e.payload, status=e.status_code, headers=headers)
+
+            if not created:
+                logger.info("Risposta salvata restituita per %s=%s", HEADER, key)
+                return Response(record.response_body, status=record.response_status, headers={REPLAYED_HEADER: 'true'})
+
+            try:
+                response = view(self, request, *args, **kwargs)
+            except BaseException:
+                release(record)
+                raise
+            store_response(record, response, getattr(response, 'data', None))
+            return response
+        return wrapper
+    return decorator
+
+
+def aidempotent(scope):
+    """
+    Decoratore per le view async che restituiscono JsonResponse (vedi async_views.py).
+    Va applicato sotto async_views.api_checks: request.user è già l'utente
+    autenticato da DRF (es. JWT) e non l'oggetto lazy della sessione.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            try:
+                key = read_key(request)
+                if not key:
+                    return await view(request, *args, **kwargs)
+                record, created = await aacquire(request_scope(request.user, scope), key, body_hash(request))
+            except IdempotencyRejected as e:
+                response = JsonResponse(e.payload, status=e.status_code)
+                if e.retry_after:
+                    response['Retry-After'] = str(e.retry_after)
+                return response
+
+            if not created:
+                logger.info("Risposta salvata restituita per %s=%s", HEADER, key)
+                response = JsonResponse(record.response_body, status=record.response_status, safe=False)
+                response[REPLAYED_HEADER] = 'true'
+                return response
+
+            try:
+                response = await view(request, *args, **kwargs)
+            except BaseException:
+                await sync_to_async(release)(record)
+                raise
+            await sync_to_async(store_response)(record, response, json.loads(response.content))
+            return response
+        return wrapper
+    return decorator
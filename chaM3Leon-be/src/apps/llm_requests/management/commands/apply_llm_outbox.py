@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from src.apps.llm_requests.services import apply_llm_result_outbox
+
+
+class Command(BaseCommand):
+    help = 'Applica al database i risultati LLM accodati nella outbox (LLM_RESULT_OUTBOX=True)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Voci applicate per transazione')
+        parser.add_argument('--loop', action='store_true', help='Resta in ascolto invece di terminare a coda vuota')
+        parser.add_argument('--interval', type=float, default=1.0, help='Secondi di attesa a coda vuota (con --loop)')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            # Fuori dal ciclo richiesta/risposta nessuno applica CONN_MAX_AGE e
+            # CONN_HEALTH_CHECKS: ogni giro è trattato come una richiesta
+            close_old_connections()
+            applied = apply_llm_result_outbox(batch_size=options['batch_size'])
+            total += applied
+            if applied:
+                self.stdout.write(f'✓ Applicati {applied} risultati')
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'✅ Outbox svuotata ({total} risultati applicati)'))
@@ -0,0 +1,103 @@
+import copy
+import statistics
+import time
+from contextlib import contextmanager
+from importlib.util import find_spec
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+class Command(BaseCommand):
+    help = (
+        'Simula N cicli richiesta/risposta con diverse configurazioni delle connessioni '
+        '(nuova connessione, persistente, health check, pool psycopg) e misura la latenza'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Cicli richiesta/risposta per configurazione')
+        parser.add_argument('--queries', type=int, default=3, help='Query per richiesta')
+        parser.add_argument('--database', default='default', help='Alias del database')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        cases = [
+            ('Nuova connessione (CONN_MAX_AGE=0)', {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False}),
+            ('Persistente', {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': False}),
+            ('Persistente + health check', {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': True}),
+        ]
+        if connection.vendor == 'postgresql' and find_spec('psycopg_pool'):
+            cases.append(('Pool psycopg', {
+                'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': True,
+                'OPTIONS': {**connection.settings_dict['OPTIONS'], 'pool': {'min_size': 2, 'max_size': 4}},
+            }))
+        else:
+            self.stdout.write('Pool psycopg non misurato: richiede PostgreSQL e psycopg[pool]')
+        cases.append((f'Configurazione attuale ({settings.PROCESS_ROLE}, pool {settings.DB_POOL_MODE})', {}))
+
+        self.stdout.write(
+            f'\n{connection.vendor} - {options["requests"]} richieste da {options["queries"]} query (ms per richiesta):'
+        )
+        self.stdout.write(f'{"configurazione":<45} {"min":>8} {"median":>8} {"p95":>8} {"max":>8} {"conn":>6}')
+        medians = {}
+        for label, overrides in cases:
+            with self.database_settings(connection, overrides):
+                timings, opened = self.run_requests(connection, options['requests'], options['queries'])
+            medians[label] = statistics.median(timings)
+            p95 = sorted(timings)[int(len(timings) * 0.95) - 1] if len(timings) >= 20 else max(timings)
+            self.stdout.write(
+                f'{label:<45} {min(timings):>8.2f} {medians[label]:>8.2f} {p95:>8.2f} '
+                f'{max(timings):>8.2f} {opened:>6}'
+            )
+
+        baseline = medians[cases[0][0]]
+        best = min(medians, key=medians.get)
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Migliore: {best} ({baseline - medians[best]:.2f} ms risparmiati per richiesta rispetto a una nuova connessione)'
+        ))
+
+    @contextmanager
+    def database_settings(self, connection, overrides):
+        """Applica temporaneamente le impostazioni alla connessione, chiudendola prima e dopo"""
+        original = copy.deepcopy(connection.settings_dict)
+        self.reset(connection)
+        connection.settings_dict.update(overrides)
+        try:
+            yield
+        finally:
+            self.reset(connection)
+            connection.settings_dict.clear()
+            connection.settings_dict.update(original)
+
+    def reset(self, connection):
+        connection.close()
+        if getattr(connection, 'pool', None):
+            connection.close_pool()
+
+    def run_requests(self, connection, requests, queries):
+        opened = 0
+
+        def count_connection(sender, connection, **kwargs):
+            nonlocal opened
+            opened += 1
+
+        connection_created.connect(count_connection)
+        timings = []
+        try:
+            for _ in range(requests):
+                start = time.perf_counter()
+                # Stessi segnali del ciclo richiesta/risposta: close_old_connections
+                # applica CONN_MAX_AGE, health check e restituzione al pool
+                request_started.send(sender=self.__class__)
+                for _ in range(queries):
+                    with connection.cursor() as cursor:
+                        cursor.execute('SELECT 1')
+                        cursor.fetchone()
+                request_finished.send(sender=self.__class__)
+                timings.append((time.perf_counter() - start) * 1000)
+        finally:
+            connection_created.disconnect(count_connection)
+        return timings, opened
@@ -0,0 +1,273 @@
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from src.apps.llm_requests.benchmarking import (
+    BENCHMARK_TAG, SAMPLE_WORKFLOW, ensure_mock_model, summarize_latencies
+)
+from src.apps.llm_requests.models import (
+    LLMConversation, LLMRequest, LLMUsageHourly, WorkflowFileAnalysis, WorkflowStepCache, WorkflowStructureCache,
+)
+
+SCENARIOS = ('quick_request', 'quick_analysis', 'conversation')
+
+# Opzione della command -> impostazione del provider mock
+MOCK_OPTIONS = {
+    'latency_ms': 'MOCK_LLM_LATENCY_MS',
+    'latency_distribution': 'MOCK_LLM_LATENCY_DISTRIBUTION',
+    'latency_spread': 'MOCK_LLM_LATENCY_SPREAD',
+    'stream_chunks': 'MOCK_LLM_STREAM_CHUNKS',
+    'chunk_interval_ms': 'MOCK_LLM_CHUNK_INTERVAL_MS',
+    'error_rate': 'MOCK_LLM_ERROR_RATE',
+    'completion_tokens': 'MOCK_LLM_COMPLETION_TOKENS',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark di carico degli endpoint LLM (quick_request, quick_analysis, conversazioni) '
+        'con il provider mock: throughput e latenze p50/p95/p99'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f'Scenari separati da virgola: {", ".join(SCENARIOS)}')
+        parser.add_argument('--requests', type=int, default=200, help='Richieste misurate per scenario')
+        parser.add_argument('--concurrency', type=int, default=8, help='Richieste contemporanee')
+        parser.add_argument('--warmup', type=int, default=5, help='Richieste di riscaldamento non misurate')
+        parser.add_argument(
+            '--base-url',
+            help='Server già avviato (es. http://localhost:8000). Di default usa il client Django in-process; '
+                 'con un server esterno valgono le sue impostazioni MOCK_LLM_*'
+        )
+        parser.add_argument('--latency-ms', type=float, help='Mediana della latenza al primo token')
+        parser.add_argument('--latency-distribution', choices=['fixed', 'uniform', 'lognormal'])
+        parser.add_argument('--latency-spread', type=float, help='Dispersione della latenza (sigma per lognormal)')
+        parser.add_argument('--stream-chunks', type=int, help='Numero di chunk simulati (0 = nessuno streaming)')
+        parser.add_argument('--chunk-interval-ms', type=float, help='Intervallo tra i chunk')
+        parser.add_argument('--error-rate', type=float, help='Frazione di chiamate che falliscono')
+        parser.add_argument('--completion-tokens', type=int, help='Token generati per le risposte non di codice')
+        parser.add_argument('--json', dest='json_path', help='Salva i risultati in un file JSON')
+        parser.add_argument('--keep-data', action='store_true', help='Non rimuove richieste e conversazioni create')
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Scenari non supportati: {", ".join(sorted(unknown))}')
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--requests e --concurrency devono essere positivi')
+
+        mock_overrides = {
+            setting_name: options[option] for option, setting_name in MOCK_OPTIONS.items()
+            if options[option] is not None
+        }
+        if options['base_url'] and mock_overrides:
+            self.stdout.write(self.style.WARNING(
+                'Con --base-url le opzioni del mock non si applicano: configura MOCK_LLM_* sul server'
+            ))
+
+        model = ensure_mock_model()
+        started_at = timezone.now()
+        workdir = tempfile.mkdtemp(prefix=f'{BENCHMARK_TAG}-')
+        # Il mock restituisce il codice invariato: con le cache delle analisi (step,
+        # struttura) le richieste successive alla prima non chiamerebbero più il provider
+        overrides = {
+            'MOCK_LLM_ENABLED': True,
+            'LLM_ANALYSIS_AUTO_DEPLOY': False,
+            'LLM_ANALYSIS_STEP_CACHE': False,
+            'LLM_ANALYSIS_STRUCTURE_CACHE': False,
+            'LLM_FEW_SHOT_ENABLED': False,
+            'LLM_EMBEDDING_AUTO_UPDATE': False,
+            'LLM_EMBEDDING_INDEX_DIR': os.path.join(workdir, 'embedding_index'),
+            **mock_overrides,
+        }
+        results = []
+        try:
+            with override_settings(**overrides):
+                for name in scenarios:
+                    results.append(self.run_scenario(name, model, workdir, options))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+            if not options['keep_data']:
+                self.cleanup(model, started_at)
+
+        self.report(results, options)
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as f:
+                json.dump({
+                    'started_at': started_at.isoformat(),
+                    'concurrency': options['concurrency'],
+                    'mock_settings': {key: value for key, value in overrides.items() if key.startswith('MOCK_LLM_')},
+                    'results': results,
+                }, f, indent=2)
+            self.stdout.write(f'Risultati salvati in {options["json_path"]}')
+
+    # ------------------------------------------------------------------
+    # Client
+    # ------------------------------------------------------------------
+
+    def make_sender(self, base_url):
+        """Funzione (path, payload) -> (status HTTP, body JSON) legata al thread corrente"""
+        if base_url:
+            session = requests.Session()
+
+            def send(path, payload):
+                response = session.post(base_url.rstrip('/') + path, json=payload, timeout=300)
+                return response.status_code, self.parse_body(response.content)
+        else:
+            client = Client(SERVER_NAME='localhost')
+
+            def send(path, payload):
+                response = client.post(path, data=json.dumps(payload), content_type='application/json')
+                return response.status_code, self.parse_body(response.content)
+        return send
+
+    @staticmethod
+    def parse_body(content):
+        try:
+            return json.loads(content)
+        except ValueError:
+            return {}
+
+    # ------------------------------------------------------------------
+    # Scenari
+    # ------------------------------------------------------------------
+
+    def build_scenario(self, name, model, workdir, options):
+        """Restituisce la funzione indice -> (path, payload) dello scenario"""
+        slots = options['concurrency']
+
+        if name == 'quick_request':
+            return lambda i: ('/api/llm/requests/quick_request/', {
+                'model': model.id,
+                'prompt': f'{BENCHMARK_TAG} prompt {i}: riassumi il workflow in una frase',
+            })
+
+        if name == 'quick_analysis':
+            # Un file per slot: il mock restituisce il codice invariato, quindi il contenuto resta valido
+            paths = []
+            for slot in range(slots):
+                path = os.path.join(workdir, f'benchmark_flow_{slot}.py')
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(SAMPLE_WORKFLOW)
+                paths.append(path)
+            return lambda i: ('/api/llm/workflow-analysis/quick_analysis/', {
+                'model': model.id,
+                'workflow_file_path': paths[i % slots],
+            })
+
+        # Conversazioni: una per slot, che cresce a ogni turno
+        send = self.make_sender(options['base_url'])
+        conversation_ids = []
+        for slot in range(slots):
+            status_code, body = send('/api/llm/conversations/', {'title': f'{BENCHMARK_TAG} {slot}'})
+            if status_code != 201:
+                raise CommandError(f'Impossibile creare la conversazione di benchmark (HTTP {status_code})')
+            conversation_ids.append(body['id'])
+        return lambda i: ('/api/llm/requests/', {
+            'model': model.id,
+            'prompt': f'{BENCHMARK_TAG} turno {i}',
+            'conversation_id': conversation_ids[i % slots],
+        })
+
+    def run_scenario(self, name, model, workdir, options):
+        build = self.build_scenario(name, model, workdir, options)
+        self.stdout.write(f'→ {name}: {options["requests"]} richieste, concorrenza {options["concurrency"]}')
+
+        send = self.make_sender(options['base_url'])
+        for i in range(options['warmup']):
+            send(*build(-1 - i))
+
+        pending = queue.SimpleQueue()
+        for i in range(options['requests']):
+            pending.put(i)
+
+        latencies = []
+        errors = Counter()
+        lock = threading.Lock()
+
+        def worker():
+            send = self.make_sender(options['base_url'])
+            try:
+                while True:
+                    try:
+                        index = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    path, payload = build(index)
+                    start = time.perf_counter()
+                    try:
+                        status_code, body = send(path, payload)
+                        error = None
+                        if status_code >= 400:
+                            error = f'http_{status_code}'
+                        elif body.get('status') == 'failed':
+                            error = 'llm_failed'
+                    except Exception as e:
+                        error = type(e).__name__
+                    elapsed_ms = (time.perf_counter() - start) * 1000
+                    with lock:
+                        latencies.append(elapsed_ms)
+                        if error:
+                            errors[error] += 1
+            finally:
+                # Ogni thread ha le sue connessioni DB (client in-process)
+                connections.close_all()
+
+        wall_start = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(options['concurrency'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_seconds = time.perf_counter() - wall_start
+
+        return {
+            'scenario': name,
+            'requests': len(latencies),
+            'errors': sum(errors.values()),
+            'error_breakdown': dict(errors),
+            'wall_seconds': round(wall_seconds, 3),
+            'throughput_rps': round(len(latencies) / wall_seconds, 2) if wall_seconds else None,
+            'latency_ms': {key: round(value, 1) if value is not None else None
+                           for key, value in summarize_latencies(latencies).items()},
+        }
+
+    # ------------------------------------------------------------------
+    # Report e pulizia
+    # ------------------------------------------------------------------
+
+    def report(self, results, options):
+        self.stdout.write('\nRisultati (latenze in ms):')
+        self.stdout.write(
+            f'{"scenario":<16} {"req":>6} {"err":>5} {"req/s":>8} {"p50":>8} {"p95":>8} {"p99":>8} {"max":>8}'
+        )
+        for result in results:
+            latency = result['latency_ms']
+            self.stdout.write(
+                f'{result["scenario"]:<16} {result["requests"]:>6} {result["errors"]:>5} '
+                f'{result["throughput_rps"]:>8} {latency["p50"]:>8} {latency["p95"]:>8} '
+                f'{latency["p99"]:>8} {latency["max"]:>8}'
+            )
+            if result['error_breakdown']:
+                self.stdout.write(f'  errori: {result["error_breakdown"]}')
+
+    def cleanup(self, model, started_at):
+        LLMRequest.objects.filter(model=model, created_at__gte=started_at).delete()
+        WorkflowFileAnalysis.objects.filter(model=model, created_at__gte=started_at).delete()
+        WorkflowStepCache.objects.filter(model=model, created_at__gte=started_at).delete()
+        WorkflowStructureCache.objects.filter(model=model, created_at__gte=started_at).delete()
+        LLMConversation.objects.filter(title__startswith=BENCHMARK_TAG, created_at__gte=started_at).delete()
+        LLMUsageHourly.objects.filter(model=model, hour__gte=started_at.replace(minute=0, second=0, microsecond=0)).delete()
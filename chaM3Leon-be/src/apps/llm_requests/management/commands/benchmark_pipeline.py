@@ -0,0 +1,285 @@
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from src.apps.llm_requests.benchmarking import BENCHMARK_TAG, ensure_mock_model, percentile
+from src.apps.llm_requests.models import LLMUsageHourly, WorkflowFileAnalysis, WorkflowStepCache, WorkflowStructureCache
+from src.apps.llm_requests.services import process_workflow_file_analysis
+from src.apps.ssh_deployment.models import FileDeployment, SSHConnection
+from src.apps.ssh_deployment.services import deploy_workflow_to_ml_runner_with_folder
+from src.apps.workflow_generator.models import WorkflowGeneration
+from src.apps.workflow_generator.services import generate_workflow_from_config
+
+STAGES = ('generate', 'analyze', 'deploy', 'total')
+PIPELINE_TAG = f'{BENCHMARK_TAG}-pipeline'
+
+
+def build_config(class_name, steps):
+    """Config in stile ml_workflow.json con una catena lineare di `steps` step"""
+    names = ['Start'] + [f'step_{index}' for index in range(1, steps - 1)] + ['End']
+    step_configs = []
+    for index, name in enumerate(names):
+        step = {'name': name}
+        if index < len(names) - 1:
+            step['next'] = names[index + 1]
+        if 0 < index < len(names) - 1 and index % 3 == 0:
+            step['decorators'] = [{'name': 'retry', 'parameters': {'times': str(index % 5 + 1)}}]
+        step_configs.append(step)
+
+    return {
+        'imports': [
+            'os',
+            'sys',
+            'mlflow',
+            {'from': 'sklearn.model_selection', 'elements': ['train_test_split']},
+        ],
+        'class': {'name': class_name, 'steps': step_configs},
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark end-to-end della pipeline config → generazione → analisi LLM → deploy, '
+        'con provider mock e server SSH simulato: tempi per fase, query DB e memoria'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='5,25,100', help='Numero di step dei config sintetici, separati da virgola')
+        parser.add_argument('--runs', type=int, default=3, help='Config eseguiti per ogni dimensione')
+        parser.add_argument('--warmup', type=int, default=1, help='Esecuzioni di riscaldamento non misurate')
+        parser.add_argument('--llm-latency-ms', type=float, default=0, help='Latenza fissa del provider mock')
+        parser.add_argument('--ssh-latency-ms', type=float, default=1, help='Latenza per round trip del server SSH simulato')
+        parser.add_argument('--no-memory', action='store_true', help='Disabilita tracemalloc (misure di tempo più precise)')
+        parser.add_argument('--save-baseline', help='Salva i risultati come baseline JSON')
+        parser.add_argument('--baseline', help='Confronta con una baseline JSON salvata in precedenza')
+        parser.add_argument(
+            '--max-regression', type=float, default=20,
+            help='Peggioramento percentuale oltre il quale il confronto con la baseline fallisce'
+        )
+        parser.add_argument('--keep-data', action='store_true', help='Non rimuove i record creati')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        except ValueError:
+            raise CommandError('--sizes deve essere una lista di interi separati da virgola')
+        if not sizes or min(sizes) < 2 or options['runs'] < 1:
+            raise CommandError('Servono almeno 2 step per config e almeno una esecuzione')
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        model = ensure_mock_model()
+        ml_runner_existed = SSHConnection.objects.filter(name='ml_runner').exists()
+        started_at = timezone.now()
+        workdir = tempfile.mkdtemp(prefix=f'{PIPELINE_TAG}-')
+        self.created = {'generations': [], 'analyses': []}
+        self.track_memory = not options['no_memory']
+        self.open_measures = []
+
+        overrides = {
+            'GENERATED_WORKFLOWS_DIR': os.path.join(workdir, 'generated_workflows'),
+            'SSH_DEPLOYMENT_BACKEND': 'local',
+            'SSH_LOCAL_ROOT': os.path.join(workdir, 'ssh_root'),
+            'SSH_LOCAL_LATENCY_MS': options['ssh_latency_ms'],
+            'MOCK_LLM_ENABLED': True,
+            'MOCK_LLM_LATENCY_MS': options['llm_latency_ms'],
+            'MOCK_LLM_LATENCY_DISTRIBUTION': 'fixed',
+            'MOCK_LLM_STREAM_CHUNKS': 0,
+            'MOCK_LLM_ERROR_RATE': 0,
+            'LLM_ANALYSIS_AUTO_DEPLOY': False,  # il deploy è misurato come fase a sé
+            # Senza cache: dopo il riscaldamento 'analyze' misurerebbe solo hit, senza chiamate al provider
+            'LLM_ANALYSIS_STEP_CACHE': False,
+            'LLM_ANALYSIS_STRUCTURE_CACHE': False,
+            'LLM_FEW_SHOT_ENABLED': False,
+            'LLM_EMBEDDING_AUTO_UPDATE': False,
+            'LLM_EMBEDDING_INDEX_DIR': os.path.join(workdir, 'embedding_index'),
+            'METRICS_STORE_STAGE_TIMINGS': True,
+        }
+
+        if self.track_memory:
+            tracemalloc.start()
+        try:
+            with override_settings(**overrides):
+                for index in range(options['warmup']):
+                    self.run_pipeline(model, min(sizes), f'warmup{index}')
+
+                results = {}
+                for size in sizes:
+                    self.stdout.write(f'→ {size} step: {options["runs"]} esecuzioni')
+                    runs = [self.run_pipeline(model, size, run) for run in range(options['runs'])]
+                    results[str(size)] = self.summarize(runs)
+        finally:
+            if self.track_memory:
+                tracemalloc.stop()
+            shutil.rmtree(workdir, ignore_errors=True)
+            if not options['keep_data']:
+                self.cleanup(model, started_at, ml_runner_existed)
+
+        report = {
+            'started_at': started_at.isoformat(),
+            'runs': options['runs'],
+            'llm_latency_ms': options['llm_latency_ms'],
+            'ssh_latency_ms': options['ssh_latency_ms'],
+            'memory_tracked': self.track_memory,
+            'results': results,
+        }
+        self.print_report(results)
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f'Baseline salvata in {options["save_baseline"]}')
+
+        if baseline:
+            regressions = self.compare(baseline, report, options['max_regression'])
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressioni oltre il {options["max_regression"]}%: ' + '; '.join(regressions))
+            self.stdout.write(self.style.SUCCESS('✅ Nessuna regressione rispetto alla baseline'))
+
+    # ------------------------------------------------------------------
+    # Esecuzione
+    # ------------------------------------------------------------------
+
+    def fold_peak(self):
+        """
+        Riporta il picco di tracemalloc su tutte le misure aperte prima di azzerarlo:
+        le fasi annidate (es. 'analyze' dentro 'total') non perdono il picco esterno
+        """
+        peak = tracemalloc.get_traced_memory()[1]
+        for frame in self.open_measures:
+            frame['peak'] = max(frame['peak'], peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def measure(self, stages, name):
+        """Misura tempo, numero di query e picco di memoria allocata della fase"""
+        if self.track_memory:
+            self.fold_peak()
+            frame = {'before': tracemalloc.get_traced_memory()[0], 'peak': 0}
+            self.open_measures.append(frame)
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                yield
+                elapsed_ms = (time.perf_counter() - start) * 1000
+        finally:
+            if self.track_memory:
+                self.fold_peak()
+                self.open_measures.pop()
+        stages[name] = {
+            'ms': elapsed_ms,
+            'queries': len(queries.captured_queries),
+            'peak_kb': (frame['peak'] - frame['before']) / 1024 if self.track_memory else None,
+        }
+
+    def run_pipeline(self, model, size, run):
+        stages = {}
+        with self.measure(stages, 'total'):
+            generation = WorkflowGeneration.objects.create(
+                config_name=f'{PIPELINE_TAG}-{size}-{run}',
+                config_data=build_config(f'BenchmarkFlow{size}x{run}', size),
+            )
+            self.created['generations'].append(generation.id)
+            with self.measure(stages, 'generate'):
+                generate_workflow_from_config(generation)
+
+            analysis = WorkflowFileAnalysis.objects.create(model=model, workflow_file_path=generation.generated_file_path)
+            self.created['analyses'].append(analysis.id)
+            with self.measure(stages, 'analyze'):
+                process_workflow_file_analysis(analysis)
+            if analysis.status != 'completed':
+                raise CommandError(f'Analisi fallita ({size} step): {analysis.error_message}')
+
+            with self.measure(stages, 'deploy'):
+                deployment = deploy_workflow_to_ml_runner_with_folder(
+                    file_content=analysis.workflow_content,
+                    file_name=os.path.basename(generation.generated_file_path),
+                    workflow_id=str(generation.id),
+                )
+            if deployment.status != 'completed':
+                raise CommandError(f'Deploy fallito ({size} step): {deployment.error_message}')
+
+        return {'stages': stages, 'analysis_timings': analysis.stage_timings or {}}
+
+    def summarize(self, runs):
+        summary = {}
+        for stage in STAGES:
+            timings = [run['stages'][stage]['ms'] for run in runs]
+            peaks = [run['stages'][stage]['peak_kb'] for run in runs if run['stages'][stage]['peak_kb'] is not None]
+            summary[stage] = {
+                'p50_ms': round(percentile(timings, 50), 2),
+                'p95_ms': round(percentile(timings, 95), 2),
+                'queries': round(statistics.mean(run['stages'][stage]['queries'] for run in runs), 1),
+                'peak_kb': round(max(peaks), 1) if peaks else None,
+            }
+
+        substages = sorted({name for run in runs for name in run['analysis_timings']})
+        summary['analyze_substages_ms'] = {
+            name: round(statistics.median(run['analysis_timings'].get(name, 0) for run in runs), 2)
+            for name in substages
+        }
+        return summary
+
+    # ------------------------------------------------------------------
+    # Report, baseline e pulizia
+    # ------------------------------------------------------------------
+
+    def print_report(self, results):
+        self.stdout.write('\nRisultati per fase:')
+        self.stdout.write(f'{"step":>6} {"fase":<10} {"p50 ms":>10} {"p95 ms":>10} {"query":>7} {"picco KB":>10}')
+        for size, summary in results.items():
+            for stage in STAGES:
+                row = summary[stage]
+                peak = f'{row["peak_kb"]:.1f}' if row['peak_kb'] is not None else '-'
+                self.stdout.write(
+                    f'{size:>6} {stage:<10} {row["p50_ms"]:>10.2f} {row["p95_ms"]:>10.2f} '
+                    f'{row["queries"]:>7} {peak:>10}'
+                )
+            substages = ', '.join(f'{name}={value}' for name, value in summary['analyze_substages_ms'].items())
+            self.stdout.write(f'{"":>6} analyze: {substages}')
+
+    def compare(self, baseline, report, max_regression):
+        """Confronta p50, query e memoria con la baseline; restituisce le regressioni oltre soglia"""
+        regressions = []
+        self.stdout.write('\nConfronto con la baseline:')
+        for size, summary in report['results'].items():
+            previous = baseline.get('results', {}).get(size)
+            if previous is None:
+                self.stdout.write(f'- {size} step: assente nella baseline')
+                continue
+            for stage in STAGES:
+                for metric, min_delta in (('p50_ms', 1.0), ('queries', 0), ('peak_kb', 64)):
+                    old, new = previous[stage].get(metric), summary[stage].get(metric)
+                    if old is None or new is None:
+                        continue
+                    delta = new - old
+                    percent = (delta / old * 100) if old else (100.0 if delta else 0.0)
+                    self.stdout.write(f'  {size:>4} {stage:<10} {metric:<8} {old:>10} → {new:>10} ({percent:+.1f}%)')
+                    # Le variazioni assolute minime (rumore di misura) non contano come regressione
+                    if percent > max_regression and delta > min_delta:
+                        regressions.append(f'{size}/{stage}/{metric} {percent:+.1f}%')
+        return regressions
+
+    def cleanup(self, model, started_at, ml_runner_existed):
+        generation_ids = self.created['generations']
+        FileDeployment.objects.filter(workflow_id__in=generation_ids).delete()
+        WorkflowFileAnalysis.objects.filter(id__in=self.created['analyses']).delete()
+        WorkflowGeneration.objects.filter(id__in=generation_ids).delete()
+        WorkflowStepCache.objects.filter(model=model, created_at__gte=started_at).delete()
+        WorkflowStructureCache.objects.filter(model=model, created_at__gte=started_at).delete()
+        LLMUsageHourly.objects.filter(model=model, hour__gte=started_at.replace(minute=0, second=0, microsecond=0)).delete()
+        if not ml_runner_existed:
+            SSHConnection.objects.filter(name='ml_runner').delete()
@@ -0,0 +1,249 @@
+import random
+import statistics
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from src.apps.llm_requests.models import (
+    LLMProvider, LLMModel, LLMRequest, LLMConversation, ConversationMessage, WorkflowFileAnalysis
+)
+from src.apps.workflow_generator.models import WorkflowGeneration
+from src.apps.ssh_deployment.models import SSHConnection, FileDeployment
+
+SEED_TAG = 'benchmark-seed'
+ADMIN_USERNAME = 'benchmark-admin'
+
+
+class Command(BaseCommand):
+    help = (
+        'Popola il database con dati sintetici (default 10k righe per tabella storica) '
+        'e misura la latenza delle query di endpoint e changelist admin'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000, help='Righe da generare per ogni tabella storica')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Dimensione dei batch di bulk_create')
+        parser.add_argument('--repeat', type=int, default=5, help='Ripetizioni per ogni caso misurato')
+        parser.add_argument('--skip-seed', action='store_true', help='Usa i dati già generati in precedenza')
+        parser.add_argument('--explain', action='store_true', help='Stampa il query plan delle query filtrate')
+        parser.add_argument('--cleanup', action='store_true', help='Rimuove i dati sintetici e termina')
+        parser.add_argument('--force', action='store_true', help='Esegue anche con DEBUG=False')
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            self.cleanup()
+            return
+
+        if not settings.DEBUG and not options['force']:
+            raise CommandError(
+                f'DEBUG=False: il database "{connection.settings_dict["NAME"]}" potrebbe essere di produzione. '
+                'Il comando vi inserisce dati sintetici: usare --force per procedere'
+            )
+
+        if not options['skip_seed']:
+            self.seed(options['rows'], options['batch_size'])
+
+        self.run_benchmarks(options['repeat'], options['explain'])
+
+    # ------------------------------------------------------------------
+    # Seeding
+    # ------------------------------------------------------------------
+
+    def get_seed_model(self):
+        provider = LLMProvider.objects.order_by('id').first()
+        if provider is None:
+            provider = LLMProvider.objects.create(name='openai', display_name='OpenAI')
+        model, _ = LLMModel.objects.get_or_create(
+            provider=provider,
+            name=SEED_TAG,
+            defaults={'display_name': 'Benchmark Seed', 'is_active': False}
+        )
+        return model
+
+    def seed(self, rows, batch_size):
+        self.stdout.write(f'Generazione di {rows} righe sintetiche per tabella...')
+        model = self.get_seed_model()
+        connection_obj, _ = SSHConnection.objects.get_or_create(
+            name=SEED_TAG,
+            defaults={'host': 'localhost', 'username': 'benchmark', 'is_active': False}
+        )
+
+        now = timezone.now()
+        statuses = ['completed'] * 90 + ['failed'] * 8 + ['pending', 'processing']
+        deploy_statuses = ['completed'] * 90 + ['failed'] * 8 + ['pending', 'uploading']
+        workflow_ids = [uuid.uuid4() for _ in range(max(rows // 50, 1))]
+
+        conversations = LLMConversation.objects.bulk_create([
+            LLMConversation(title=f'{SEED_TAG} {i}') for i in range(max(rows // 100, 1))
+        ], batch_size=batch_size)
+
+        seeded = {
+            'LLMRequest': self._bulk_seed(LLMRequest, rows, batch_size, lambda i, created_at: LLMRequest(
+                created_at=created_at,
+                model=model,
+                conversation=conversations[i % len(conversations)] if i % 4 == 0 else None,
+                prompt=f'{SEED_TAG} prompt {i}',
+                response='x' * 200,
+                status=random.choice(statuses),
+                tokens_used=random.randint(50, 4000),
+                response_time_ms=random.randint(200, 40000),
+                completed_at=created_at,
+            ), now),
+            'WorkflowFileAnalysis': self._bulk_seed(WorkflowFileAnalysis, rows, batch_size, lambda i, created_at: WorkflowFileAnalysis(
+                created_at=created_at,
+                model=model,
+                workflow_file_path=f'/tmp/{SEED_TAG}/{i}.py',
+                workflow_content='y' * 200,
+                analysis_response='z' * 200,
+                status=random.choice(statuses),
+            ), now),
+            'WorkflowGeneration': self._bulk_seed(WorkflowGeneration, rows, batch_size, lambda i, created_at: WorkflowGeneration(
+                created_at=created_at,
+                config_name=SEED_TAG,
+                config_data={'class': {'name': f'Flow{i}'}},
+                generated_content='w' * 200,
+                status=random.choice(statuses),
+            ), now),
+            'FileDeployment': self._bulk_seed(FileDeployment, rows, batch_size, lambda i, created_at: FileDeployment(
+                created_at=created_at,
+                ssh_connection=connection_obj,
+                file_name=f'flow_{i}.py',
+                file_content='v' * 200,
+                remote_file_path=f'/app/workflows/{i}.py',
+                workflow_id=workflow_ids[i % len(workflow_ids)],
+                status=random.choice(deploy_statuses),
+            ), now),
+            'ConversationMessage': self._bulk_seed(ConversationMessage, rows, batch_size, lambda i, created_at: ConversationMessage(
+                created_at=created_at,
+                conversation=conversations[i % len(conversations)],
+                role='user' if i % 2 == 0 else 'assistant',
+                content=f'{SEED_TAG} message {i}',
+            ), now),
+        }
+
+        for table, count in seeded.items():
+            self.stdout.write(f'✓ {table}: {count} righe')
+
+    def _bulk_seed(self, model_class, rows, batch_size, factory, now):
+        """Inserisce le righe a batch, con created_at distribuito sull'ultimo anno"""
+        created = 0
+        with self.explicit_created_at(model_class):
+            while created < rows:
+                size = min(batch_size, rows - created)
+                objs = [
+                    factory(created + i, now - timedelta(seconds=random.randint(0, 365 * 24 * 3600)))
+                    for i in range(size)
+                ]
+                with transaction.atomic():
+                    model_class.objects.bulk_create(objs, batch_size=batch_size)
+                created += size
+        return created
+
+    @contextmanager
+    def explicit_created_at(self, model_class):
+        """Disattiva auto_now_add durante il seed: created_at arriva dal costruttore"""
+        field = model_class._meta.get_field('created_at')
+        auto_now_add = field.auto_now_add
+        field.auto_now_add = False
+        try:
+            yield
+        finally:
+            field.auto_now_add = auto_now_add
+
+    def cleanup(self):
+        self.stdout.write('Rimozione dei dati sintetici...')
+        LLMModel.objects.filter(name=SEED_TAG).delete()
+        LLMConversation.objects.filter(title__startswith=SEED_TAG).delete()
+        WorkflowGeneration.objects.filter(config_name=SEED_TAG).delete()
+        SSHConnection.objects.filter(name=SEED_TAG).delete()
+        User.objects.filter(username=ADMIN_USERNAME).delete()
+        self.stdout.write(self.style.SUCCESS('✅ Dati sintetici rimossi'))
+
+    # ------------------------------------------------------------------
+    # Benchmark
+    # ------------------------------------------------------------------
+
+    def run_benchmarks(self, repeat, explain):
+        admin_user, created = User.objects.get_or_create(
+            username=ADMIN_USERNAME,
+            defaults={'is_staff': True, 'is_superuser': True}
+        )
+        client = Client(SERVER_NAME='localhost')
+        client.force_login(admin_user)
+
+        model = self.get_seed_model()
+        workflow = WorkflowGeneration.objects.filter(config_name=SEED_TAG).only('id').first()
+        deployment = FileDeployment.objects.filter(ssh_connection__name=SEED_TAG).only('workflow_id').first()
+        conversation = LLMConversation.objects.filter(title__startswith=SEED_TAG).only('id').first()
+
+        cases = [
+            ('API requests list', '/api/llm/requests/'),
+            ('API analyses list', '/api/llm/workflow-analysis/'),
+            ('API workflows list', '/api/workflow-generator/workflows/'),
+            ('API deployments list', '/api/ssh/deployments/'),
+            ('API conversations list', '/api/llm/conversations/'),
+            ('Admin LLMRequest changelist', '/admin/llm_requests/llmrequest/'),
+            ('Admin LLMRequest ?status=pending', '/admin/llm_requests/llmrequest/?status__exact=pending'),
+            ('Admin LLMRequest ?provider', f'/admin/llm_requests/llmrequest/?model__provider__id__exact={model.provider_id}'),
+            ('Admin WorkflowGeneration ?status=failed', '/admin/workflow_generator/workflowgeneration/?status__exact=failed'),
+            ('Admin FileDeployment ?status=failed', '/admin/ssh_deployment/filedeployment/?status__exact=failed'),
+        ]
+        if workflow:
+            cases.append((
+                'API check_workflow_status',
+                f'/api/llm/workflow-analysis/check_workflow_status/?workflow_id={workflow.id}'
+            ))
+
+        self.stdout.write('\nLatenza endpoint (ms):')
+        self.stdout.write(f'{"caso":<45} {"min":>8} {"median":>8} {"max":>8} {"query":>6} {"http":>5}')
+        for label, url in cases:
+            self._measure(label, repeat, lambda url=url: client.get(url))
+
+        querysets = [
+            ('Richieste attive (parziale)', LLMRequest.objects.filter(status__in=['pending', 'processing']).order_by('-created_at')[:20]),
+            ('Richieste per status', LLMRequest.objects.filter(status='failed').order_by('-created_at')[:20]),
+            ('Richieste per provider', LLMRequest.objects.filter(model__provider_id=model.provider_id).order_by('-created_at')[:20]),
+            ('Workflow attivi (parziale)', WorkflowGeneration.objects.filter(status__in=['pending', 'processing']).order_by('-created_at')[:20]),
+        ]
+        if deployment:
+            querysets.append((
+                'Deployment per workflow_id',
+                FileDeployment.objects.filter(workflow_id=deployment.workflow_id).order_by('-created_at')[:20]
+            ))
+        if conversation:
+            querysets.append((
+                'Messaggi di una conversazione',
+                ConversationMessage.objects.filter(conversation=conversation).order_by('created_at')[:50]
+            ))
+
+        self.stdout.write('\nLatenza query ORM (ms):')
+        for label, queryset in querysets:
+            self._measure(label, repeat, lambda queryset=queryset: list(queryset.all()))
+            if explain:
+                self.stdout.write(queryset.explain())
+
+    def _measure(self, label, repeat, func):
+        timings = []
+        query_count = 0
+        status_code = ''
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                result = func()
+                timings.append((time.perf_counter() - start) * 1000)
+            query_count = len(queries.captured_queries)
+            status_code = getattr(result, 'status_code', '')
+
+        self.stdout.write(
+            f'{label:<45} {min(timings):>8.1f} {statistics.median(timings):>8.1f} '
+            f'{max(timings):>8.1f} {query_count:>6} {status_code:>5}'
+        )
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+
+from src.apps.llm_requests.archive import archive_codec, archive_conversation, idle_conversations
+from src.apps.llm_requests.models import ConversationArchive
+
+
+class Command(BaseCommand):
+    help = (
+        'Archivia in blob compressi i messaggi delle conversazioni inattive da '
+        'LLM_CONVERSATION_ARCHIVE_IDLE_DAYS giorni (una transazione per conversazione)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-days', type=int, default=None,
+                            help='Giorni di inattività (default LLM_CONVERSATION_ARCHIVE_IDLE_DAYS)')
+        parser.add_argument('--limit', type=int, default=None, help='Numero massimo di conversazioni da archiviare')
+        parser.add_argument('--dry-run', action='store_true', help='Conta le conversazioni senza archiviarle')
+
+    def handle(self, *args, **options):
+        idle_days = options['idle_days']
+        if idle_days is None:
+            idle_days = settings.LLM_CONVERSATION_ARCHIVE_IDLE_DAYS
+        candidates = idle_conversations(idle_days).values_list('id', flat=True)
+        if options['limit']:
+            candidates = candidates[:options['limit']]
+        candidates = list(candidates)
+
+        if options['dry_run']:
+            self.stdout.write(f'Conversazioni inattive da più di {idle_days} giorni: {len(candidates)}')
+            return
+
+        codec = archive_codec()
+        archived = sum(1 for conversation_id in candidates if archive_conversation(conversation_id, idle_days))
+
+        totals = ConversationArchive.objects.aggregate(original=Sum('original_bytes'), compressed=Sum('compressed_bytes'))
+        ratio = (totals['original'] or 0) / (totals['compressed'] or 1)
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Conversazioni archiviate ({codec}): {archived}/{len(candidates)}; '
+            f'archivi: {totals["compressed"] or 0} byte compressi, rapporto {ratio:.1f}x'
+        ))
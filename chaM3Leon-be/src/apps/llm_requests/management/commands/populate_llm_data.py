@@ -32,21 +32,30 @@ class Command(BaseCommand):
                 'name': 'gpt-4o',
                 'display_name': 'GPT-4o',
                 'max_tokens': 4096,
-                'supports_streaming': True
+                'supports_streaming': True,
+                'input_price_per_million': '2.50',
+                'cached_input_price_per_million': '1.25',
+                'output_price_per_million': '10.00'
             },
             {
                 'provider': 'openai',
                 'name': 'gpt-4o-mini',
                 'display_name': 'GPT-4o Mini',
                 'max_tokens': 16384,
-                'supports_streaming': True
+                'supports_streaming': True,
+                'input_price_per_million': '0.15',
+                'cached_input_price_per_million': '0.075',
+                'output_price_per_million': '0.60'
             },
             {
                 'provider': 'openai',
                 'name': 'gpt-3.5-turbo',
                 'display_name': 'GPT-3.5 Turbo',
                 'max_tokens': 4096,
-                'supports_streaming': True
+                'supports_streaming': True,
+                'input_price_per_million': '0.50',
+                'cached_input_price_per_million': None,
+                'output_price_per_million': '1.50'
             },
             
             # Anthropic Models
@@ -55,14 +64,20 @@ class Command(BaseCommand):
                 'name': 'claude-3-5-sonnet-20241022',
                 'display_name': 'Claude 3.5 Sonnet',
                 'max_tokens': 8192,
-                'supports_streaming': True
+                'supports_streaming': True,
+                'input_price_per_million': '3.00',
+                'cached_input_price_per_million': '0.30',
+                'output_price_per_million': '15.00'
             },
             {
                 'provider': 'anthropic',
                 'name': 'claude-3-haiku-20240307',
                 'display_name': 'Claude 3 Haiku',
                 'max_tokens': 4096,
-                'supports_streaming': True
+                'supports_streaming': True,
+                'input_price_per_million': '0.25',
+                'cached_input_price_per_million': '0.03',
+                'output_price_per_million': '1.25'
             },
             
             # Gemini Models
@@ -71,14 +86,20 @@ class Command(BaseCommand):
                 'name': 'gemini-2.5-flash',
                 'display_name': 'Gemini 2.5 Flash',
                 'max_tokens': 8192,
-                'supports_streaming': False
+                'supports_streaming': False,
+                'input_price_per_million': '0.30',
+                'cached_input_price_per_million': '0.075',
+                'output_price_per_million': '2.50'
             },
             {
                 'provider': 'gemini',
                 'name': 'gemini-1.5-pro',
                 'display_name': 'Gemini 1.5 Pro',
                 'max_tokens': 32768,
-                'supports_streaming': False
+                'supports_streaming': False,
+                'input_price_per_million': '1.25',
+                'cached_input_price_per_million': '0.3125',
+                'output_price_per_million': '5.00'
             },
         ]
         
@@ -90,13 +111,26 @@ class Command(BaseCommand):
                 defaults={
                     'display_name': model_data['display_name'],
                     'max_tokens': model_data['max_tokens'],
-                    'supports_streaming': model_data['supports_streaming']
+                    'supports_streaming': model_data['supports_streaming'],
+                    'input_price_per_million': model_data['input_price_per_million'],
+                    'cached_input_price_per_million': model_data['cached_input_price_per_million'],
+                    'output_price_per_million': model_data['output_price_per_million']
                 }
             )
             if created:
                 self.stdout.write(f'✓ Creato modello: {model.display_name}')
             else:
                 self.stdout.write(f'- Modello già esistente: {model.display_name}')
+                # I modelli creati prima dell'introduzione dei prezzi ricevono quelli di listino
+                if model.input_price_per_million is None and model.output_price_per_million is None:
+                    model.input_price_per_million = model_data['input_price_per_million']
+                    model.output_price_per_million = model_data['output_price_per_million']
+                    model.save(update_fields=['input_price_per_million', 'output_price_per_million'])
+                    self.stdout.write(f'  ✓ Prezzi impostati per: {model.display_name}')
+                if model.cached_input_price_per_million is None and model_data['cached_input_price_per_million']:
+                    model.cached_input_price_per_million = model_data['cached_input_price_per_million']
+                    model.save(update_fields=['cached_input_price_per_million'])
+                    self.stdout.write(f'  ✓ Prezzo input in cache impostato per: {model.display_name}')
         
         self.stdout.write(
             self.style.SUCCESS('✅ Popolamento completato con successo!')
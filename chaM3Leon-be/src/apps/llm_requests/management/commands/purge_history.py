@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from src.apps.common.retention import (
+    RetentionPolicy, delete_candidates, delete_rows, strip_text, text_candidates,
+)
+from src.apps.llm_requests.models import LLMRequest
+from src.apps.ssh_deployment.models import FileDeployment
+
+POLICIES = [
+    RetentionPolicy(LLMRequest, text_fields={'prompt': '', 'system_message': '', 'response': ''}),
+    RetentionPolicy(FileDeployment, text_fields={'file_content': ''}),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Retention di LLMRequest e FileDeployment: svuota i campi di testo dopo '
+        'HISTORY_TEXT_RETENTION_DAYS giorni e cancella le righe dopo HISTORY_DELETE_RETENTION_DAYS, '
+        'a batch brevi'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--text-days', type=int, default=None,
+                            help='Giorni prima di svuotare i testi (default HISTORY_TEXT_RETENTION_DAYS)')
+        parser.add_argument('--delete-days', type=int, default=None,
+                            help='Giorni prima di cancellare le righe, 0 per mai (default HISTORY_DELETE_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Righe per transazione')
+        parser.add_argument('--max-batches', type=int, default=None, help='Batch massimi per tabella e fase')
+        parser.add_argument('--dry-run', action='store_true', help='Conta le righe senza modificarle')
+
+    def handle(self, *args, **options):
+        text_days = options['text_days'] if options['text_days'] is not None else settings.HISTORY_TEXT_RETENTION_DAYS
+        delete_days = options['delete_days'] if options['delete_days'] is not None else settings.HISTORY_DELETE_RETENTION_DAYS
+        batch_options = {
+            'batch_size': options['batch_size'] or settings.HISTORY_PURGE_BATCH_SIZE,
+            'lock_timeout_ms': settings.HISTORY_PURGE_LOCK_TIMEOUT_MS,
+            'pause_ms': settings.HISTORY_PURGE_PAUSE_MS,
+            'max_batches': options['max_batches'],
+        }
+
+        phases = []
+        if delete_days:
+            # Prima le cancellazioni: le righe più vecchie non vanno svuotate inutilmente
+            phases.append(('cancellate', 'cancellare', delete_candidates, delete_rows, delete_days))
+        if text_days:
+            phases.append(('svuotate', 'svuotare', text_candidates, strip_text, text_days))
+
+        for policy in POLICIES:
+            for verb, infinitive, candidates, purge, days in phases:
+                if options['dry_run']:
+                    count = candidates(policy, days).count()
+                    self.stdout.write(f'- {policy.label}: {count} righe da {infinitive} oltre {days} giorni')
+                    continue
+                stats = purge(policy, days, **batch_options)
+                self.stdout.write(
+                    f'- {policy.label}: {stats.rows} righe {verb} oltre {days} giorni '
+                    f'({stats.batches} batch, {stats.skipped_batches} saltati per lock, '
+                    f'batch più lungo {stats.max_batch_ms:.0f} ms)'
+                )
+
+        self.stdout.write(self.style.SUCCESS('✅ Retention completata'))
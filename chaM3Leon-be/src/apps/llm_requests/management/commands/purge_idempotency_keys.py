@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from src.apps.llm_requests.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Rimuove le Idempotency-Key scadute (IDEMPOTENCY_TTL_S), a batch per non tenere lock lunghi'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Righe rimosse per query')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        total = 0
+        while True:
+            ids = list(
+                IdempotencyKey.objects.filter(expires_at__lte=now)
+                .values_list('id', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            deleted, _ = IdempotencyKey.objects.filter(id__in=ids).delete()
+            total += deleted
+
+        self.stdout.write(self.style.SUCCESS(f'✅ Idempotency-Key scadute rimosse: {total}'))
@@ -0,0 +1,112 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce, TruncHour
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from src.apps.llm_requests.models import LLMModel, LLMRequest, LLMUsageHourly, WorkflowFileAnalysis
+
+USAGE_FIELDS = [
+    'request_count', 'failed_count', 'prompt_tokens', 'completion_tokens', 'cache_read_tokens',
+    'estimated_requests', 'cost', 'response_time_ms_total'
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Ricostruisce gli aggregati orari di utilizzo LLM a partire da LLMRequest e '
+        'WorkflowFileAnalysis (backfill dopo la migrazione o dopo una correzione dei prezzi)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=str, help='Ricostruisce solo dalla data indicata (YYYY-MM-DD)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Dimensione dei batch di bulk_create')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since_date = parse_date(options['since'])
+            if since_date is None:
+                raise CommandError('--since deve essere nel formato YYYY-MM-DD')
+            since = timezone.make_aware(datetime.combine(since_date, datetime.min.time()))
+
+        # Le righe cancellate dalla retention (purge_history) non si possono riaggregare:
+        # gli aggregati più vecchi restano come sono
+        if settings.HISTORY_DELETE_RETENTION_DAYS:
+            horizon = timezone.now() - timedelta(days=settings.HISTORY_DELETE_RETENTION_DAYS)
+            if since is None or since < horizon:
+                since = horizon
+                self.stdout.write(self.style.WARNING(
+                    f'Ricostruzione limitata a dopo {horizon:%Y-%m-%d %H:%M} (HISTORY_DELETE_RETENTION_DAYS)'
+                ))
+
+        models_by_id = {model.id: model for model in LLMModel.objects.all()}
+        buckets = defaultdict(lambda: dict.fromkeys(USAGE_FIELDS, 0))
+
+        for source in (LLMRequest, WorkflowFileAnalysis):
+            for row in self.aggregate(source, since):
+                model = models_by_id[row['billed_model']]
+                bucket = buckets[(row['bucket'], row['billed_model'], row['user'])]
+                bucket['request_count'] += row['request_total']
+                bucket['failed_count'] += row['failed_total']
+                # Le righe precedenti alla suddivisione hanno solo tokens_used: contate come input
+                bucket['prompt_tokens'] += (row['prompt_sum'] or 0) + (row['legacy_sum'] or 0)
+                bucket['completion_tokens'] += row['completion_sum'] or 0
+                bucket['cache_read_tokens'] += row['cache_read_sum'] or 0
+                bucket['estimated_requests'] += row['estimated_total']
+                legacy_cost = model.compute_cost(row['legacy_sum'], 0) if row['legacy_sum'] else None
+                bucket['cost'] += (row['cost_sum'] or Decimal('0')) + (legacy_cost or Decimal('0'))
+                bucket['response_time_ms_total'] += row['response_time_sum'] or 0
+
+        rows = [
+            LLMUsageHourly(
+                hour=hour, model_id=model_id, user_id=user_id,
+                provider_id=models_by_id[model_id].provider_id, **values
+            )
+            for (hour, model_id, user_id), values in buckets.items()
+        ]
+
+        with transaction.atomic():
+            existing = LLMUsageHourly.objects.all()
+            if since:
+                existing = existing.filter(hour__gte=since)
+            deleted, _ = existing.delete()
+            LLMUsageHourly.objects.bulk_create(rows, batch_size=options['batch_size'])
+
+        self.stdout.write(f'- Aggregati rimossi: {deleted}')
+        self.stdout.write(self.style.SUCCESS(f'✅ Aggregati orari ricostruiti: {len(rows)}'))
+
+    def aggregate(self, source, since):
+        """Aggregati (ora, modello, utente) di una tabella storica, calcolati dal database"""
+        queryset = source.objects.filter(status__in=['completed', 'failed'])
+        queryset = queryset.annotate(
+            bucket=TruncHour(Coalesce('completed_at', 'created_at')),
+            # Dopo un fallback l'utilizzo va al modello che ha risposto
+            billed_model=Coalesce('served_by', 'model'),
+        )
+        if since:
+            queryset = queryset.filter(bucket__gte=since)
+
+        legacy = Q(prompt_tokens__isnull=True, tokens_used__isnull=False)
+        return (
+            queryset
+            .order_by()
+            .values('bucket', 'billed_model', 'user')
+            .annotate(
+                request_total=Count('id'),
+                failed_total=Count('id', filter=Q(status='failed')),
+                prompt_sum=Sum('prompt_tokens'),
+                completion_sum=Sum('completion_tokens'),
+                cache_read_sum=Sum('cache_read_tokens'),
+                legacy_sum=Sum('tokens_used', filter=legacy),
+                estimated_total=Count('id', filter=Q(tokens_estimated=True) | legacy),
+                cost_sum=Sum('cost'),
+                response_time_sum=Sum('response_time_ms'),
+            )
+        )
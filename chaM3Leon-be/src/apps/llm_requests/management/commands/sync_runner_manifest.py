@@ -0,0 +1,58 @@
+import os
+import shlex
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from src.apps.ssh_deployment.services import SSHDeploymentError, get_deployment_service, get_ml_runner_connection
+
+# Moduli di primo livello importabili dall'interprete del runner (pacchetti installati e PYTHONPATH)
+LIST_MODULES_SCRIPT = (
+    "import pkgutil, sys; "
+    "print('\\n'.join(sorted(set(sys.builtin_module_names) | {m.name for m in pkgutil.iter_modules()})))"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Legge via SSH i moduli importabili sull'ambiente di ml_runner e li salva nel manifest "
+        "usato dalla validazione del codice restituito dalle analisi (ML_RUNNER_MODULES_MANIFEST)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.ML_RUNNER_MODULES_MANIFEST, help='File del manifest')
+        parser.add_argument('--runner-python', default=settings.ML_RUNNER_PYTHON, help='Interprete Python sul runner')
+        parser.add_argument('--runner-pythonpath', default=settings.ML_RUNNER_PYTHONPATH, help='PYTHONPATH dei workflow sul runner')
+
+    def handle(self, *args, **options):
+        ssh_connection = get_ml_runner_connection()
+        if ssh_connection is None:
+            raise CommandError('Connessione SSH ml_runner non configurata')
+
+        command = f"{shlex.quote(options['runner_python'])} -c {shlex.quote(LIST_MODULES_SCRIPT)}"
+        if options['runner_pythonpath']:
+            command = f"PYTHONPATH={shlex.quote(options['runner_pythonpath'])} {command}"
+
+        service = get_deployment_service(ssh_connection)
+        try:
+            service.connect()
+            result = service.execute_command(command)
+        except SSHDeploymentError as e:
+            raise CommandError(str(e))
+        finally:
+            service.disconnect()
+
+        if not result['success']:
+            raise CommandError(f"Comando fallito sul runner (exit {result['exit_status']}): {result['stderr'].strip()}")
+
+        modules = sorted({line.strip() for line in result['stdout'].splitlines() if line.strip()})
+        output = options['output']
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        # Scrittura atomica: la validazione può leggere il manifest in qualsiasi momento
+        temp_path = f'{output}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(f'# Moduli importabili su {ssh_connection.host} ({options["runner_python"]})\n')
+            f.write('\n'.join(modules) + '\n')
+        os.replace(temp_path, output)
+
+        self.stdout.write(self.style.SUCCESS(f'✅ {len(modules)} moduli salvati in {output}'))
@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from src.apps.llm_requests.embedding_index import EmbeddingIndexUnavailable, get_embedder, is_stale, update_index
+
+
+class Command(BaseCommand):
+    help = "Aggiorna l'indice vettoriale degli step migliorati usato per gli esempi few-shot delle analisi"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help="Ricalcola l'indice da capo")
+        parser.add_argument('--batch-size', type=int, default=256, help='Step per chiamata all\'embedder')
+        parser.add_argument(
+            '--if-stale', action='store_true',
+            help="Aggiorna solo se un'analisi ha salvato nuovi step dall'ultimo aggiornamento (per cron)"
+        )
+
+    def handle(self, *args, **options):
+        if options['if_stale'] and not options['rebuild'] and not is_stale():
+            self.stdout.write('Indice già aggiornato')
+            return
+
+        start = time.perf_counter()
+        try:
+            embedder = get_embedder()
+            updated = update_index(rebuild=options['rebuild'], batch_size=options['batch_size'])
+        except EmbeddingIndexUnavailable as e:
+            raise CommandError(str(e))
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Indice aggiornato in {settings.LLM_EMBEDDING_INDEX_DIR}: {updated} step '
+            f'(backend {embedder.name}, dimensione {embedder.dimension}, {elapsed:.2f}s)'
+        ))
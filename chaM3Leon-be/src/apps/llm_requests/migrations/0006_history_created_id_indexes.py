@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_requests', '0005_populate_llm_data'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='llmrequest',
+            index=models.Index(fields=['-created_at', '-id'], name='llmrequest_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowfileanalysis',
+            index=models.Index(fields=['-created_at', '-id'], name='wfanalysis_created_id_idx'),
+        ),
+    ]
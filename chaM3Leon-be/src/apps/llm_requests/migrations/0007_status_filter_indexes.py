@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_requests', '0006_history_created_id_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversationmessage',
+            index=models.Index(fields=['conversation', 'created_at'], name='convmsg_conv_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='llmconversation',
+            index=models.Index(fields=['-updated_at'], name='llmconv_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='llmrequest',
+            index=models.Index(fields=['status', '-created_at'], name='llmrequest_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='llmrequest',
+            index=models.Index(fields=['model', '-created_at'], name='llmrequest_model_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='llmrequest',
+            index=models.Index(fields=['conversation', '-created_at'], name='llmrequest_conv_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='llmrequest',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'processing'])), fields=['-created_at'], name='llmrequest_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowfileanalysis',
+            index=models.Index(fields=['status', '-created_at'], name='wfanalysis_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowfileanalysis',
+            index=models.Index(fields=['model', '-created_at'], name='wfanalysis_model_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowfileanalysis',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'processing'])), fields=['-created_at'], name='wfanalysis_active_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:13
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+
+
+def backfill_conversation_counters(apps, schema_editor):
+    """
+    Calcola i contatori denormalizzati per le conversazioni esistenti
+    """
+    LLMConversation = apps.get_model('llm_requests', 'LLMConversation')
+    
+    conversations = LLMConversation.objects.annotate(
+        counted_messages=Count('messages', distinct=True),
+        latest_message_at=Max('messages__created_at'),
+    ).iterator(chunk_size=1000)
+    
+    batch = []
+    for conversation in conversations:
+        conversation.message_count = conversation.counted_messages
+        conversation.last_message_at = conversation.latest_message_at
+        batch.append(conversation)
+        if len(batch) >= 1000:
+            LLMConversation.objects.bulk_update(batch, ['message_count', 'last_message_at'])
+            batch = []
+    if batch:
+        LLMConversation.objects.bulk_update(batch, ['message_count', 'last_message_at'])
+    
+    # I token sono sommati in una query separata per non moltiplicare i join
+    tokens = LLMConversation.objects.annotate(
+        used_tokens=Sum('requests__tokens_used', filter=Q(requests__status='completed'))
+    ).filter(used_tokens__gt=0).values_list('id', 'used_tokens')
+    for conversation_id, used_tokens in tokens.iterator(chunk_size=1000):
+        LLMConversation.objects.filter(id=conversation_id).update(total_tokens=used_tokens)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_requests', '0007_status_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='llmconversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='llmconversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='llmconversation',
+            name='total_tokens',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_conversation_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_requests', '0008_conversation_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMResultOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.JSONField()),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('applied_at', models.DateTimeField(blank=True, null=True)),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox_entries', to='llm_requests.llmrequest')),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(condition=models.Q(('applied_at__isnull', True)), fields=['created_at'], name='llmoutbox_pending_idx')],
+            },
+        ),
+    ]
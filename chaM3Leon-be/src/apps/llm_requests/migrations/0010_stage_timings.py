@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_requests', '0009_llmresultoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='llmrequest',
+            name='stage_timings',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='workflowfileanalysis',
+            name='stage_timings',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:24
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_requests', '0010_stage_timings'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='llmmodel',
+            name='input_price_per_million',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='llmmodel',
+            name='output_price_per_million',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='llmrequest',
+            name='completion_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='llmrequest',
+            name='cost',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='llmrequest',
+            name='prompt_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='llmrequest',
+            name='tokens_estimated',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='workflowfileanalysis',
+            name='completion_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='workflowfileanalysis',
+            name='cost',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='workflowfileanalysis',
+            name='prompt_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='workflowfileanalysis',
+            name='tokens_estimated',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='LLMUsageHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('request_count', models.PositiveIntegerField(default=0)),
+                ('failed_count', models.PositiveIntegerField(default=0)),
+                ('prompt_tokens', models.PositiveBigIntegerField(default=0)),
+                ('completion_tokens', models.PositiveBigIntegerField(default=0)),
+                ('estimated_requests', models.PositiveIntegerField(default=0)),
+                ('cost', models.DecimalField(decimal_places=6, default=Decimal('0'), max_digits=18)),
+                ('response_time_ms_total', models.PositiveBigIntegerField(default=0)),
+                ('model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='llm_requests.llmmodel')),
+                ('provider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='llm_requests.llmprovider')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='llm_usage', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-hour'],
+                'indexes': [models.Index(fields=['-hour'], name='llmusage_hour_idx'), models.Index(fields=['provider', '-hour'], name='llmusage_provider_hour_idx'), models.Index(fields=['user', '-hour'], name='llmusage_user_hour_idx')],
+                'constraints': [models.UniqueConstraint(fields=('hour', 'model', 'user'), name='llmusage_hour_model_user_uniq', nulls_distinct=False)],
+            },
+        ),
+    ]
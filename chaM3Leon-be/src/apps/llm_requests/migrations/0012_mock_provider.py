@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_requests', '0011_token_cost_accounting'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='llmprovider',
+            name='name',
+            field=models.CharField(choices=[('openai', 'OpenAI'), ('anthropic', 'Anthropic'), ('gemini', 'Google Gemini'), ('mock', 'Mock (test locale)')], max_length=50, unique=True),
+        ),
+    ]
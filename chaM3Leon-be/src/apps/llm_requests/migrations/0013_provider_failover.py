@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_requests', '0012_mock_provider'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='llmrequest',
+            name='served_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='served_requests', to='llm_requests.llmmodel'),
+        ),
+        migrations.AddField(
+            model_name='workflowfileanalysis',
+            name='served_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='served_analyses', to='llm_requests.llmmodel'),
+        ),
+        migrations.CreateModel(
+            name='LLMModelFallback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('priority', models.PositiveSmallIntegerField(default=0)),
+                ('is_active', models.BooleanField(default=True)),
+                ('fallback_model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fallback_for', to='llm_requests.llmmodel')),
+                ('model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fallbacks', to='llm_requests.llmmodel')),
+            ],
+            options={
+                'ordering': ['model', 'priority'],
+                'constraints': [models.UniqueConstraint(fields=('model', 'fallback_model'), name='llmfallback_model_fallback_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_requests', '0013_provider_failover'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowfileanalysis',
+            name='analysis_mode',
+            field=models.CharField(choices=[('auto', 'Auto'), ('full', 'File intero'), ('chunked', 'Per step')], default='auto', max_length=10),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_requests', '0014_workflow_analysis_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkflowStepCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('workflow_file_path', models.CharField(max_length=500)),
+                ('prompt_hash', models.CharField(max_length=64)),
+                ('class_name', models.CharField(max_length=200)),
+                ('step_name', models.CharField(max_length=200)),
+                ('source_hash', models.CharField(max_length=64)),
+                ('improved_hash', models.CharField(max_length=64)),
+                ('improved_source', models.TextField()),
+                ('imports', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='step_cache', to='llm_requests.llmmodel')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['workflow_file_path', 'model', 'prompt_hash', 'improved_hash'], name='wfstepcache_improved_idx')],
+                'constraints': [models.UniqueConstraint(fields=('workflow_file_path', 'model', 'prompt_hash', 'source_hash'), name='wfstepcache_source_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_requests', '0015_workflow_step_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='llmmodel',
+            name='cached_input_price_per_million',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='llmrequest',
+            name='cache_read_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='llmusagehourly',
+            name='cache_read_tokens',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='workflowfileanalysis',
+            name='cache_read_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_requests', '0017_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='llmrequest',
+            name='shared_completion',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='coalesced_requests', to='llm_requests.llmrequest'),
+        ),
+        migrations.AddField(
+            model_name='workflowfileanalysis',
+            name='shared_completion',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='coalesced_analyses', to='llm_requests.workflowfileanalysis'),
+        ),
+    ]
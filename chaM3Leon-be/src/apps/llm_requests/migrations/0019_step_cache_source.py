@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_requests', '0018_shared_completion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowstepcache',
+            name='source',
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_requests', '0019_step_cache_source'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkflowStructureCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prompt_hash', models.CharField(max_length=64)),
+                ('structure_hash', models.CharField(max_length=64)),
+                ('identifiers', models.JSONField(default=list)),
+                ('improved_source', models.TextField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('analysis', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='llm_requests.workflowfileanalysis')),
+                ('model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='structure_cache', to='llm_requests.llmmodel')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('model', 'prompt_hash', 'structure_hash'), name='wfstructcache_uniq')],
+            },
+        ),
+    ]
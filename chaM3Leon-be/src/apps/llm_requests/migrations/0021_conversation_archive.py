@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_requests', '0020_workflow_structure_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationArchive',
+            fields=[
+                ('conversation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='llm_requests.llmconversation')),
+                ('codec', models.CharField(choices=[('gzip', 'gzip'), ('zstd', 'zstd')], max_length=10)),
+                ('data', models.BinaryField()),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('original_bytes', models.PositiveBigIntegerField(default=0)),
+                ('compressed_bytes', models.PositiveBigIntegerField(default=0)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='llmconversation',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_requests', '0021_conversation_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='llmrequest',
+            name='content_purged_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='llmrequest',
+            index=models.Index(condition=models.Q(('content_purged_at__isnull', True)), fields=['created_at', 'id'], name='llmrequest_unpurged_idx'),
+        ),
+    ]
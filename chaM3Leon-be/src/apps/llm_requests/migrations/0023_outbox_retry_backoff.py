@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:37
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_requests', '0022_request_retention'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='llmresultoutbox',
+            name='llmoutbox_pending_idx',
+        ),
+        migrations.AddField(
+            model_name='llmresultoutbox',
+            name='dead_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='llmresultoutbox',
+            name='next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='llmresultoutbox',
+            index=models.Index(condition=models.Q(('applied_at__isnull', True), ('dead_at__isnull', True)), fields=['next_attempt_at'], name='llmoutbox_due_idx'),
+        ),
+    ]
@@ -1,5 +1,9 @@
-from django.db import models
+from decimal import Decimal
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 import uuid
 
 class LLMProvider(models.Model):
@@ -8,6 +12,7 @@ class LLMProvider(models.Model):
         ('openai', 'OpenAI'),
         ('anthropic', 'Anthropic'),
         ('gemini', 'Google Gemini'),
+        ('mock', 'Mock (test locale)'),
     ]
     
     name = models.CharField(max_length=50, choices=PROVIDER_CHOICES, unique=True)
@@ -28,11 +33,60 @@ class LLMModel(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    # Prezzi di listino per milione di token (USD)
+    input_price_per_million = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True)
+    output_price_per_million = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True)
+    # Prezzo dei token di input letti dalla cache del prompt del provider (se vuoto: prezzo pieno)
+    cached_input_price_per_million = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True)
+    
     class Meta:
         unique_together = ['provider', 'name']
     
     def __str__(self):
         return f"{self.provider.display_name} - {self.display_name}"
+    
+    def compute_cost(self, prompt_tokens, completion_tokens, cache_read_tokens=None):
+        """
+        Costo in USD di una chiamata, None se il modello non ha prezzi configurati.
+        cache_read_tokens è la parte di prompt_tokens letta dalla cache del provider.
+        """
+        if self.input_price_per_million is None or self.output_price_per_million is None:
+            return None
+        cached = min(cache_read_tokens or 0, prompt_tokens or 0)
+        cached_price = self.cached_input_price_per_million
+        if cached_price is None:
+            cached_price = self.input_price_per_million
+        cost = (
+            Decimal((prompt_tokens or 0) - cached) * self.input_price_per_million
+            + Decimal(cached) * cached_price
+            + Decimal(completion_tokens or 0) * self.output_price_per_million
+        ) / Decimal(1_000_000)
+        return cost.quantize(Decimal('0.000001'))
+    
+    def fallback_chain(self):
+        """Il modello seguito dai fallback attivi (con modello e provider attivi), in ordine di priorità"""
+        links = (
+            self.fallbacks.filter(is_active=True, fallback_model__is_active=True, fallback_model__provider__is_active=True)
+            .select_related('fallback_model__provider')
+            .order_by('priority', 'id')
+        )
+        return [self] + [link.fallback_model for link in links if link.fallback_model_id != self.pk]
+
+class LLMModelFallback(models.Model):
+    """Catena di fallback di un modello: provati in ordine di priorità se il modello fallisce"""
+    model = models.ForeignKey(LLMModel, on_delete=models.CASCADE, related_name='fallbacks')
+    fallback_model = models.ForeignKey(LLMModel, on_delete=models.CASCADE, related_name='fallback_for')
+    priority = models.PositiveSmallIntegerField(default=0)  # valori più bassi vengono provati prima
+    is_active = models.BooleanField(default=True)
+    
+    class Meta:
+        ordering = ['model', 'priority']
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'fallback_model'], name='llmfallback_model_fallback_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.model} → {self.fallback_model} ({self.priority})"
 
 class LLMConversation(models.Model):
     """Modello per le conversazioni con LLM"""
@@ -42,12 +96,40 @@ class LLMConversation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Contatori denormalizzati, aggiornati da register_messages()
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    total_tokens = models.PositiveBigIntegerField(default=0)
+    # Messaggi spostati in ConversationArchive (vedi archive.py): la riga resta come stub
+    archived_at = models.DateTimeField(null=True, blank=True)
+    
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['-updated_at'], name='llmconv_updated_idx'),
+        ]
     
     def __str__(self):
         username = self.user.username if self.user else "Anonymous"
         return f"Conversation {self.id} - {username}"
+    
+    @property
+    def history(self):
+        """Messaggi in ordine cronologico, dalla tabella o dall'archivio compresso"""
+        if self.archived_at is None:
+            return list(self.messages.all())
+        from .archive import decode_messages
+        return decode_messages(self.archive)
+    
+    def register_messages(self, count, tokens=None, at=None):
+        """Aggiorna atomicamente (con F()) i contatori dopo l'inserimento di nuovi messaggi"""
+        at = at or timezone.now()
+        LLMConversation.objects.filter(pk=self.pk).update(
+            message_count=F('message_count') + count,
+            total_tokens=F('total_tokens') + (tokens or 0),
+            last_message_at=at,
+            updated_at=at,
+        )
 
 class ConversationMessage(models.Model):
     """Modello per i messaggi in una conversazione"""
@@ -65,10 +147,31 @@ class ConversationMessage(models.Model):
     
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['conversation', 'created_at'], name='convmsg_conv_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.role}: {self.content[:50]}..."
 
+class ConversationArchive(models.Model):
+    """Messaggi di una conversazione inattiva, come JSON compresso (vedi archive.py)"""
+    CODEC_CHOICES = [
+        ('gzip', 'gzip'),
+        ('zstd', 'zstd'),
+    ]
+    
+    conversation = models.OneToOneField(LLMConversation, on_delete=models.CASCADE, primary_key=True, related_name='archive')
+    codec = models.CharField(max_length=10, choices=CODEC_CHOICES)
+    data = models.BinaryField()
+    message_count = models.PositiveIntegerField(default=0)
+    original_bytes = models.PositiveBigIntegerField(default=0)
+    compressed_bytes = models.PositiveBigIntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Archive {self.conversation_id} ({self.message_count} messaggi, {self.codec})"
+
 class LLMRequest(models.Model):
     """Modello per le richieste singole agli LLM"""
     STATUS_CHOICES = [
@@ -78,10 +181,18 @@ class LLMRequest(models.Model):
         ('failed', 'Failed'),
     ]
     
+    # Lunghezza della parte iniziale del prompt stabile tra chiamate (istruzioni e codice
+    # delle analisi): viene marcata per la cache dei prompt del provider. Non salvata
+    cacheable_prefix = 0
+    
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='llm_requests', null=True, blank=True)  # TEMPORANEO per test
     conversation = models.ForeignKey(LLMConversation, on_delete=models.CASCADE, related_name='requests', null=True, blank=True)
     model = models.ForeignKey(LLMModel, on_delete=models.CASCADE)
+    # Modello che ha effettivamente risposto (diverso da model dopo un fallback o un hedging)
+    served_by = models.ForeignKey(LLMModel, on_delete=models.SET_NULL, null=True, blank=True, related_name='served_requests')
+    # Richiesta identica e contemporanea che ha chiamato il provider: la risposta è condivisa
+    shared_completion = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='coalesced_requests')
     
     # Parametri della richiesta
     prompt = models.TextField()
@@ -96,16 +207,134 @@ class LLMRequest(models.Model):
     
     # Metadati
     tokens_used = models.IntegerField(null=True, blank=True)
+    prompt_tokens = models.IntegerField(null=True, blank=True)
+    completion_tokens = models.IntegerField(null=True, blank=True)
+    cache_read_tokens = models.IntegerField(null=True, blank=True)  # parte di prompt_tokens letta dalla cache del provider
+    tokens_estimated = models.BooleanField(default=False)  # True se contati localmente, non dal provider
+    cost = models.DecimalField(max_digits=12, decimal_places=6, null=True, blank=True)  # USD
     response_time_ms = models.IntegerField(null=True, blank=True)
+    stage_timings = models.JSONField(null=True, blank=True)  # ms per fase, se METRICS_STORE_STAGE_TIMINGS
     created_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
+    # Prompt e risposta svuotati dalla retention (purge_history): restano token, costi e tempi
+    content_purged_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='llmrequest_created_id_idx'),
+            models.Index(fields=['status', '-created_at'], name='llmrequest_status_created_idx'),
+            models.Index(fields=['model', '-created_at'], name='llmrequest_model_created_idx'),
+            models.Index(fields=['conversation', '-created_at'], name='llmrequest_conv_created_idx'),
+            # Indice parziale: solo le richieste ancora in lavorazione
+            models.Index(
+                fields=['-created_at'], name='llmrequest_active_idx',
+                condition=models.Q(status__in=['pending', 'processing'])
+            ),
+            # Indice parziale: solo le righe non ancora toccate dalla retention
+            models.Index(
+                fields=['created_at', 'id'], name='llmrequest_unpurged_idx',
+                condition=models.Q(content_purged_at__isnull=True)
+            ),
+        ]
     
     def __str__(self):
         return f"Request {self.id} - {self.model.display_name}"
 
+class LLMResultOutbox(models.Model):
+    """
+    Outbox durevole dei risultati LLM, applicati in batch dai worker in ordine di
+    next_attempt_at: una voce che fallisce viene riprovata con un backoff
+    esponenziale (dietro alle voci nuove) e dopo LLM_OUTBOX_MAX_ATTEMPTS
+    tentativi viene marcata come morta (dead_at)
+    """
+    request = models.ForeignKey(LLMRequest, on_delete=models.CASCADE, related_name='outbox_entries')
+    payload = models.JSONField()
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    applied_at = models.DateTimeField(null=True, blank=True)
+    dead_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            # Indice parziale: solo le voci ancora da applicare
+            models.Index(
+                fields=['next_attempt_at'], name='llmoutbox_due_idx',
+                condition=models.Q(applied_at__isnull=True, dead_at__isnull=True)
+            ),
+        ]
+    
+    def __str__(self):
+        return f"Outbox {self.id} - Request {self.request_id}"
+
+class LLMUsageHourly(models.Model):
+    """
+    Aggregati orari di richieste, token e costi per utente/modello.
+    Aggiornati in modo incrementale (F()) al termine di ogni chiamata LLM,
+    così le dashboard di utilizzo non devono scansionare LLMRequest.
+    """
+    hour = models.DateTimeField()
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='llm_usage', null=True, blank=True)
+    model = models.ForeignKey(LLMModel, on_delete=models.CASCADE, related_name='usage')
+    provider = models.ForeignKey(LLMProvider, on_delete=models.CASCADE, related_name='usage')  # denormalizzato da model
+    
+    request_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
+    cache_read_tokens = models.PositiveBigIntegerField(default=0)
+    estimated_requests = models.PositiveIntegerField(default=0)
+    cost = models.DecimalField(max_digits=18, decimal_places=6, default=Decimal('0'))
+    response_time_ms_total = models.PositiveBigIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-hour']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['hour', 'model', 'user'], name='llmusage_hour_model_user_uniq',
+                nulls_distinct=False
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['-hour'], name='llmusage_hour_idx'),
+            models.Index(fields=['provider', '-hour'], name='llmusage_provider_hour_idx'),
+            models.Index(fields=['user', '-hour'], name='llmusage_user_hour_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Usage {self.hour:%Y-%m-%d %H}:00 - {self.model_id}"
+    
+    @classmethod
+    def record(cls, model, user_id=None, at=None, prompt_tokens=None, completion_tokens=None,
+               cost=None, response_time_ms=None, failed=False, estimated=False, cache_read_tokens=None):
+        """Somma una chiamata LLM all'aggregato della sua ora (UPDATE con F(), INSERT se manca)"""
+        hour = (at or timezone.now()).replace(minute=0, second=0, microsecond=0)
+        lookup = {'hour': hour, 'model_id': model.id, 'user_id': user_id}
+        values = {
+            'request_count': 1,
+            'failed_count': 1 if failed else 0,
+            'prompt_tokens': prompt_tokens or 0,
+            'completion_tokens': completion_tokens or 0,
+            'cache_read_tokens': cache_read_tokens or 0,
+            'estimated_requests': 1 if estimated else 0,
+            'cost': cost or Decimal('0'),
+            'response_time_ms_total': response_time_ms or 0,
+        }
+        increments = {field: F(field) + value for field, value in values.items()}
+        
+        with transaction.atomic():
+            if cls.objects.filter(**lookup).update(**increments):
+                return
+            try:
+                with transaction.atomic():
+                    cls.objects.create(provider_id=model.provider_id, **lookup, **values)
+            except IntegrityError:
+                # Riga creata in parallelo da un'altra richiesta
+                cls.objects.filter(**lookup).update(**increments)
+
 class WorkflowFileAnalysis(models.Model):
     """Modello per l'analisi dei file workflow generati tramite LLM"""
     STATUS_CHOICES = [
@@ -114,10 +343,24 @@ class WorkflowFileAnalysis(models.Model):
         ('completed', 'Completed'),
         ('failed', 'Failed'),
     ]
+    ANALYSIS_MODE_CHOICES = [
+        ('auto', 'Auto'),
+        ('full', 'File intero'),
+        ('chunked', 'Per step'),
+    ]
+    
+    # Struttura normalizzata del workflow letto all'inizio dell'analisi, per salvarne
+    # il risultato in WorkflowStructureCache (vedi workflow_ast.normalize_structure). Non salvata
+    structure = None
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='workflow_analyses', null=True, blank=True)
     model = models.ForeignKey(LLMModel, on_delete=models.CASCADE)
+    # Modello che ha effettivamente risposto (diverso da model dopo un fallback o un hedging)
+    served_by = models.ForeignKey(LLMModel, on_delete=models.SET_NULL, null=True, blank=True, related_name='served_analyses')
+    # Analisi che ha chiamato il provider e di cui si usa la risposta: identica e
+    # contemporanea (coalescing) o precedente con la stessa struttura (WorkflowStructureCache)
+    shared_completion = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='coalesced_analyses')
     
     # File workflow da analizzare - RESO OPZIONALE
     workflow_file_path = models.CharField(max_length=500, blank=True)  # Path del file nella cartella generated_workflows
@@ -126,6 +369,9 @@ class WorkflowFileAnalysis(models.Model):
     # Prompting
     system_prompt = models.TextField(default="Sei un esperto sviluppatore Python specializzato nell'analisi di workflow Metaflow. Analizza il codice fornito e fornisci feedback dettagliato su struttura, logica, possibili miglioramenti e best practices.")
     user_prompt = models.TextField(blank=True)  # Prompt aggiuntivo dell'utente
+    # 'chunked' invia ogni metodo @step al modello separatamente e in parallelo;
+    # 'auto' lo fa oltre LLM_ANALYSIS_CHUNK_MIN_LINES righe. Dopo l'analisi indica la modalità usata
+    analysis_mode = models.CharField(max_length=10, choices=ANALYSIS_MODE_CHOICES, default='auto')
     
     # Risposta LLM
     analysis_response = models.TextField(blank=True)
@@ -134,12 +380,123 @@ class WorkflowFileAnalysis(models.Model):
     
     # Metadati
     tokens_used = models.IntegerField(null=True, blank=True)
+    prompt_tokens = models.IntegerField(null=True, blank=True)
+    completion_tokens = models.IntegerField(null=True, blank=True)
+    cache_read_tokens = models.IntegerField(null=True, blank=True)  # parte di prompt_tokens letta dalla cache del provider
+    tokens_estimated = models.BooleanField(default=False)  # True se contati localmente, non dal provider
+    cost = models.DecimalField(max_digits=12, decimal_places=6, null=True, blank=True)  # USD
     response_time_ms = models.IntegerField(null=True, blank=True)
+    stage_timings = models.JSONField(null=True, blank=True)  # ms per fase, se METRICS_STORE_STAGE_TIMINGS
     created_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='wfanalysis_created_id_idx'),
+            models.Index(fields=['status', '-created_at'], name='wfanalysis_status_created_idx'),
+            models.Index(fields=['model', '-created_at'], name='wfanalysis_model_created_idx'),
+            # Indice parziale: solo le analisi ancora in lavorazione
+            models.Index(
+                fields=['-created_at'], name='wfanalysis_active_idx',
+                condition=models.Q(status__in=['pending', 'processing'])
+            ),
+        ]
     
     def __str__(self):
         return f"Workflow Analysis {self.id} - {self.workflow_file_path}"
+
+class WorkflowStepCache(models.Model):
+    """
+    Risultato dell'analisi di un singolo metodo @step, per rianalizzare solo gli
+    step modificati. La chiave è il contenuto dello step (hash del sorgente
+    inviato al modello) per workflow, modello e prompt; improved_hash permette
+    di riconoscere anche gli step già migliorati e rimasti invariati nel file.
+    Le coppie source -> improved_source sono anche gli esempi few-shot
+    dell'indice vettoriale (vedi embedding_index.py).
+    """
+    workflow_file_path = models.CharField(max_length=500)
+    model = models.ForeignKey(LLMModel, on_delete=models.CASCADE, related_name='step_cache')
+    prompt_hash = models.CharField(max_length=64)  # system prompt + richieste dell'utente
+    class_name = models.CharField(max_length=200)
+    step_name = models.CharField(max_length=200)
+    source_hash = models.CharField(max_length=64)
+    improved_hash = models.CharField(max_length=64)
+    source = models.TextField(blank=True)  # sorgente inviato (vuoto nelle righe precedenti)
+    improved_source = models.TextField()
+    imports = models.JSONField(default=list, blank=True)  # import aggiunti dal modello
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['workflow_file_path', 'model', 'prompt_hash', 'source_hash'],
+                name='wfstepcache_source_uniq'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['workflow_file_path', 'model', 'prompt_hash', 'improved_hash'], name='wfstepcache_improved_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.class_name}.{self.step_name} ({self.source_hash[:12]})"
+
+class WorkflowStructureCache(models.Model):
+    """
+    Risultato dell'analisi di un intero workflow, indicizzato per struttura
+    normalizzata (AST senza commenti, docstring e con gli identificatori
+    canonici, vedi workflow_ast.normalize_structure), modello e prompt: un
+    workflow che differisce solo per formattazione o nomi riusa improved_source
+    con gli identificatori rinominati, senza chiamare il provider.
+    """
+    model = models.ForeignKey(LLMModel, on_delete=models.CASCADE, related_name='structure_cache')
+    prompt_hash = models.CharField(max_length=64)  # system prompt + richieste dell'utente
+    structure_hash = models.CharField(max_length=64)
+    identifiers = models.JSONField(default=list)  # identificatori del workflow originale, in ordine canonico
+    improved_source = models.TextField()
+    # Analisi che ha chiamato il provider (diventa shared_completion delle analisi che la riusano)
+    analysis = models.ForeignKey(WorkflowFileAnalysis, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'prompt_hash', 'structure_hash'], name='wfstructcache_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.model_id}:{self.structure_hash[:12]}"
+
+class IdempotencyKey(models.Model):
+    """
+    Esito di una POST con header Idempotency-Key (vedi idempotency.py): i retry
+    del client con la stessa chiave ricevono la risposta salvata invece di
+    rieseguire la chiamata al provider o il deploy. Le righe scadono in
+    expires_at e vengono rimosse da purge_idempotency_keys.
+    """
+    STATUS_CHOICES = [
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+    ]
+    
+    scope = models.CharField(max_length=150)  # endpoint e utente
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)  # hash del corpo della prima richiesta
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='processing')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='idempotency_scope_key_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.scope} {self.key} ({self.status})"
@@ -1,5 +1,8 @@
 from rest_framework import serializers
-from .models import LLMProvider, LLMModel, LLMRequest, LLMConversation, ConversationMessage, WorkflowFileAnalysis
+from django.core.exceptions import ValidationError as DjangoValidationError
+from .models import LLMProvider, LLMModel, LLMRequest, LLMConversation, ConversationMessage, WorkflowFileAnalysis, LLMUsageHourly
+from .catalog import get_catalog, lookup_model
+from ..common.serializers import SparseModelSerializer
 import os
 
 class LLMProviderSerializer(serializers.ModelSerializer):
@@ -12,7 +15,43 @@ class LLMModelSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = LLMModel
-        fields = ['id', 'provider', 'name', 'display_name', 'max_tokens', 'supports_streaming', 'is_active']
+        fields = [
+            'id', 'provider', 'name', 'display_name', 'max_tokens', 'supports_streaming', 'is_active',
+            'input_price_per_million', 'cached_input_price_per_million', 'output_price_per_million'
+        ]
+
+class CatalogModelField(serializers.PrimaryKeyRelatedField):
+    """Modello LLM indicato per id, risolto dal catalogo in memoria invece che con una query"""
+    
+    def __init__(self, **kwargs):
+        kwargs.setdefault('queryset', LLMModel.objects.all())
+        super().__init__(**kwargs)
+    
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = LLMModel._meta.pk.to_python(data)
+        except DjangoValidationError:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        model = lookup_model(pk)
+        if model is None:
+            self.fail('does_not_exist', pk_value=data)
+        return model
+
+class CatalogModelInfoField(serializers.Field):
+    """model_info già serializzato dal catalogo: nessuna query né serializzazione per riga"""
+    
+    def __init__(self, **kwargs):
+        kwargs.setdefault('source', 'model_id')
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+    
+    def to_representation(self, value):
+        data = get_catalog().model_data.get(value)
+        if data is None:
+            data = get_catalog(force_check=True).model_data.get(value)
+        return data
 
 class ConversationMessageSerializer(serializers.ModelSerializer):
     class Meta:
@@ -20,30 +59,61 @@ class ConversationMessageSerializer(serializers.ModelSerializer):
         fields = ['id', 'role', 'content', 'created_at']
 
 class LLMConversationSerializer(serializers.ModelSerializer):
-    messages = ConversationMessageSerializer(many=True, read_only=True)
-    message_count = serializers.SerializerMethodField()
+    # Anche per le conversazioni archiviate (letti dall'archivio compresso)
+    messages = ConversationMessageSerializer(source='history', many=True, read_only=True)
     
     class Meta:
         model = LLMConversation
-        fields = ['id', 'title', 'created_at', 'updated_at', 'messages', 'message_count']
-    
-    def get_message_count(self, obj):
-        return obj.messages.count()
+        fields = [
+            'id', 'title', 'created_at', 'updated_at', 'messages',
+            'message_count', 'last_message_at', 'total_tokens', 'archived_at'
+        ]
+        read_only_fields = ['message_count', 'last_message_at', 'total_tokens', 'archived_at']
+
+class LLMConversationListSerializer(SparseModelSerializer):
+    """Serializer compatto per la lista delle conversazioni (senza messaggi)"""
+    class Meta:
+        model = LLMConversation
+        fields = [
+            'id', 'title', 'created_at', 'updated_at',
+            'message_count', 'last_message_at', 'total_tokens', 'archived_at'
+        ]
+        read_only_fields = fields
 
 class LLMRequestSerializer(serializers.ModelSerializer):
-    model_info = LLMModelSerializer(source='model', read_only=True)
+    model_info = CatalogModelInfoField()
     
     class Meta:
         model = LLMRequest
         fields = [
             'id', 'model', 'model_info', 'prompt', 'system_message', 
             'max_tokens', 'temperature', 'response', 'status', 
-            'error_message', 'tokens_used', 'response_time_ms',
-            'created_at', 'completed_at'
+            'error_message', 'tokens_used', 'prompt_tokens', 'completion_tokens', 'cache_read_tokens',
+            'tokens_estimated', 'cost', 'served_by', 'shared_completion', 'response_time_ms', 'stage_timings',
+            'created_at', 'completed_at', 'content_purged_at'
+        ]
+        read_only_fields = [
+            'id', 'response', 'status', 'error_message', 'tokens_used',
+            'prompt_tokens', 'completion_tokens', 'cache_read_tokens', 'tokens_estimated', 'cost',
+            'served_by', 'shared_completion', 'response_time_ms', 'stage_timings', 'completed_at',
+            'content_purged_at'
         ]
-        read_only_fields = ['id', 'response', 'status', 'error_message', 'tokens_used', 'response_time_ms', 'completed_at']
+
+class LLMRequestListSerializer(SparseModelSerializer):
+    """Serializer compatto per la lista delle richieste (senza prompt e risposta)"""
+    model_info = CatalogModelInfoField()
+    
+    class Meta:
+        model = LLMRequest
+        fields = [
+            'id', 'model', 'model_info', 'conversation', 'max_tokens', 'temperature',
+            'status', 'error_message', 'tokens_used', 'prompt_tokens', 'completion_tokens', 'cache_read_tokens',
+            'cost', 'served_by', 'shared_completion', 'response_time_ms', 'created_at', 'completed_at'
+        ]
+        read_only_fields = fields
 
 class CreateLLMRequestSerializer(serializers.ModelSerializer):
+    model = CatalogModelField()
     conversation_id = serializers.UUIDField(required=False, allow_null=True)
     
     class Meta:
@@ -51,22 +121,38 @@ class CreateLLMRequestSerializer(serializers.ModelSerializer):
         fields = ['model', 'prompt', 'system_message', 'max_tokens', 'temperature', 'conversation_id']
 
 class WorkflowFileAnalysisSerializer(serializers.ModelSerializer):
-    model_info = LLMModelSerializer(source='model', read_only=True)
+    model_info = CatalogModelInfoField()
     
     class Meta:
         model = WorkflowFileAnalysis
         fields = [
             'id', 'model', 'model_info', 'workflow_file_path', 'workflow_content',
-            'system_prompt', 'user_prompt', 'analysis_response', 'status',
-            'error_message', 'tokens_used', 'response_time_ms',
+            'system_prompt', 'user_prompt', 'analysis_mode', 'analysis_response', 'status',
+            'error_message', 'tokens_used', 'prompt_tokens', 'completion_tokens', 'cache_read_tokens',
+            'tokens_estimated', 'cost', 'served_by', 'shared_completion', 'response_time_ms', 'stage_timings',
             'created_at', 'completed_at'
         ]
         read_only_fields = [
             'id', 'workflow_content', 'analysis_response', 'status', 
-            'error_message', 'tokens_used', 'response_time_ms', 'completed_at'
+            'error_message', 'tokens_used', 'prompt_tokens', 'completion_tokens', 'cache_read_tokens',
+            'tokens_estimated', 'cost', 'served_by', 'shared_completion', 'response_time_ms', 'stage_timings', 'completed_at'
+        ]
+
+class WorkflowFileAnalysisListSerializer(SparseModelSerializer):
+    """Serializer compatto per la lista delle analisi (senza codice e risposta)"""
+    model_info = CatalogModelInfoField()
+    
+    class Meta:
+        model = WorkflowFileAnalysis
+        fields = [
+            'id', 'model', 'model_info', 'workflow_file_path', 'analysis_mode', 'status',
+            'error_message', 'tokens_used', 'prompt_tokens', 'completion_tokens', 'cache_read_tokens',
+            'cost', 'served_by', 'shared_completion', 'response_time_ms', 'created_at', 'completed_at'
         ]
+        read_only_fields = fields
 
 class CreateWorkflowFileAnalysisSerializer(serializers.ModelSerializer):
+    model = CatalogModelField()
     workflow_id = serializers.UUIDField(required=False, allow_null=True, help_text="ID del workflow generato (opzionale)")
     workflow_file_name = serializers.CharField(required=False, allow_blank=True, help_text="Nome del file nella cartella generated_workflows (opzionale)")
     workflow_file_path = serializers.CharField(required=False, allow_blank=True, help_text="Path completo del file (opzionale)")
@@ -75,7 +161,7 @@ class CreateWorkflowFileAnalysisSerializer(serializers.ModelSerializer):
         model = WorkflowFileAnalysis
         fields = [
             'model', 'workflow_id', 'workflow_file_name', 'workflow_file_path',
-            'system_prompt', 'user_prompt'
+            'system_prompt', 'user_prompt', 'analysis_mode'
         ]
         extra_kwargs = {
             'workflow_file_path': {'required': False, 'allow_blank': True}
@@ -100,6 +186,16 @@ class CreateWorkflowFileAnalysisSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(f"Il file {value} non esiste")
         return value
 
+class LLMUsageHourlySerializer(serializers.ModelSerializer):
+    """Serializer per gli aggregati orari di utilizzo"""
+    class Meta:
+        model = LLMUsageHourly
+        fields = [
+            'id', 'hour', 'user', 'model', 'provider', 'request_count', 'failed_count',
+            'prompt_tokens', 'completion_tokens', 'cache_read_tokens', 'estimated_requests', 'cost', 'response_time_ms_total'
+        ]
+        read_only_fields = fields
+
 class AvailableWorkflowFileSerializer(serializers.Serializer):
     """Serializer per listare i file workflow disponibili"""
     workflow_id = serializers.UUIDField()
@@ -1,17 +1,48 @@
 import os
+import re
+import copy
+import hashlib
+import asyncio
+import weakref
 import glob
+import math
 import time
+import uuid
+import random
 import logging
-from datetime import datetime
-from typing import Dict, Any, Optional
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import F, Q, prefetch_related_objects
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from decouple import config
+import httpx
 import openai
 import anthropic
 from google import genai
-from .models import LLMRequest, LLMConversation, ConversationMessage
+from google.genai import types as genai_types
+from .models import (
+    LLMModel, LLMRequest, LLMConversation, ConversationMessage, LLMResultOutbox, LLMUsageHourly, WorkflowStepCache,
+    WorkflowStructureCache,
+)
+from .tokens import estimate_tokens
+from .archive import ensure_active
+from .catalog import get_catalog, lookup_model
+from .circuit_breaker import CircuitOpenError, allow_model, record_model_outcome
+from .code_validation import CodeValidationError, extract_code, validate_workflow_code
+from .embedding_index import EmbeddingIndexUnavailable, few_shot_examples, is_stale, mark_stale, update_index
+from .workflow_ast import (
+    WorkflowParseError, normalize_structure, parse_step, remap_identifiers, split_workflow, stitch_workflow,
+)
 from ..workflow_generator.models import WorkflowGeneration
+from ..common.metrics import LatencyWindow, StageTimer
 
 # Configura il logger
 logger = logging.getLogger(__name__)
@@ -20,20 +51,158 @@ class LLMServiceError(Exception):
     """Eccezione personalizzata per errori del servizio LLM"""
     pass
 
+class LLMProviderUnavailableError(LLMServiceError):
+    """Errore transitorio del provider (anche simulato dal provider mock)"""
+    pass
+
+TRANSIENT_ERRORS = (
+    LLMProviderUnavailableError, TimeoutError, ConnectionError, httpx.TransportError,
+    openai.APIConnectionError, anthropic.APIConnectionError,
+)
+
+def is_retryable_error(error: Exception) -> bool:
+    """
+    Timeout, errori di connessione, 429 e 5xx: il provider non ha servito la
+    richiesta ma potrebbe farlo poco dopo, o un altro modello al suo posto. Gli
+    errori della richiesta (parametri, contesto troppo lungo, chiave non valida,
+    errori locali) si ripeterebbero uguali.
+    """
+    if isinstance(error, TRANSIENT_ERRORS):
+        return True
+    # status_code per OpenAI e Anthropic, code per google.genai.errors.APIError
+    status = getattr(error, 'status_code', None) or getattr(error, 'code', None)
+    return isinstance(status, int) and (status in (408, 429) or status >= 500)
+
+# Client async dei provider condivisi per event loop: sotto ASGI ogni worker ha un solo
+# loop e riusa il pool di connessioni; con async_to_sync (WSGI) il loop è per richiesta
+_ASYNC_CLIENTS = weakref.WeakKeyDictionary()
+
 class BaseLLMService:
-    """Classe base per i servizi LLM"""
+    """
+    Classe base per i servizi LLM.
+    
+    Una chiamata è divisa in tre fasi: build_payload (può leggere la conversazione
+    dal database), call/acall (la sola chiamata di rete al provider, sincrona o
+    async) e build_result (testo e usage della risposta). generate_response e
+    agenerate_response le compongono nelle versioni sincrona e async.
+    """
     
     def __init__(self):
         self.client = None
+        self.api_key = None
         self.setup_client()
     
     def setup_client(self):
         """Configura il client per il provider specifico"""
         raise NotImplementedError
     
+    def create_async_client(self):
+        """Crea il client async del provider"""
+        raise NotImplementedError
+    
+    def client_options(self) -> Dict[str, Any]:
+        """Timeout e retry dei client SDK (LLM_PROVIDER_TIMEOUT_S, LLM_PROVIDER_MAX_RETRIES)"""
+        return {
+            'timeout': settings.LLM_PROVIDER_TIMEOUT_S,
+            'max_retries': settings.LLM_PROVIDER_MAX_RETRIES,
+        }
+    
+    def get_async_client(self):
+        """Client async condiviso tra le richieste servite dallo stesso event loop"""
+        clients = _ASYNC_CLIENTS.setdefault(asyncio.get_running_loop(), {})
+        key = type(self).__name__
+        if key not in clients:
+            clients[key] = self.create_async_client()
+        return clients[key]
+    
+    def build_payload(self, request: LLMRequest) -> Dict[str, Any]:
+        """Parametri della chiamata al provider"""
+        raise NotImplementedError
+    
+    def call(self, payload: Dict[str, Any]):
+        """Chiamata sincrona al provider"""
+        raise NotImplementedError
+    
+    async def acall(self, payload: Dict[str, Any]):
+        """Chiamata async al provider; di default esegue quella sincrona in un thread"""
+        return await sync_to_async(self.call, thread_sensitive=False)(payload)
+    
+    def build_result(self, request: LLMRequest, payload: Dict[str, Any], response) -> Dict[str, Any]:
+        """Testo della risposta e token utilizzati"""
+        raise NotImplementedError
+    
     def generate_response(self, request: LLMRequest) -> Dict[str, Any]:
         """Genera una risposta dal modello LLM"""
-        raise NotImplementedError
+        start_time = time.time()
+        try:
+            payload = self.build_payload(request)
+            response = self.call(payload)
+            return self.completed(request, payload, response, start_time)
+        except Exception as e:
+            return self.failed(e)
+    
+    async def agenerate_response(self, request: LLMRequest) -> Dict[str, Any]:
+        """Come generate_response, ma l'attesa del provider non occupa un thread"""
+        start_time = time.time()
+        try:
+            payload = await sync_to_async(self.build_payload)(request)
+            response = await self.acall(payload)
+            return self.completed(request, payload, response, start_time)
+        except Exception as e:
+            return self.failed(e)
+    
+    def completed(self, request: LLMRequest, payload: Dict[str, Any], response, start_time: float) -> Dict[str, Any]:
+        response_time_ms = int((time.time() - start_time) * 1000)
+        logger.info("Risposta %s ricevuta in %sms", type(self).__name__, response_time_ms)
+        return {
+            **self.build_result(request, payload, response),
+            'response_time_ms': response_time_ms,
+            'status': 'completed'
+        }
+    
+    def failed(self, error: Exception) -> Dict[str, Any]:
+        logger.error("Errore %s: %s", type(self).__name__, error)
+        return {
+            'status': 'failed',
+            'error_message': str(error),
+            'error_type': type(error).__name__,
+            'retryable': is_retryable_error(error),
+        }
+    
+    def build_usage(self, request: LLMRequest, input_text: str, output_text: str,
+                    prompt_tokens: Optional[int] = None, completion_tokens: Optional[int] = None,
+                    cache_read_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Token di input/output: quelli restituiti dal provider, altrimenti stimati localmente.
+        prompt_tokens comprende i cache_read_tokens letti dalla cache dei prompt del provider.
+        """
+        estimated = prompt_tokens is None or completion_tokens is None
+        if prompt_tokens is None:
+            prompt_tokens = estimate_tokens(input_text, request.model.name)
+        if completion_tokens is None:
+            completion_tokens = estimate_tokens(output_text, request.model.name)
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'tokens_used': prompt_tokens + completion_tokens,
+            'cache_read_tokens': cache_read_tokens,
+            'tokens_estimated': estimated,
+        }
+
+def split_cacheable_prompt(request: LLMRequest):
+    """(parte stabile, resto) del prompt: la parte stabile può essere letta dalla cache del provider"""
+    prefix_length = request.cacheable_prefix if settings.LLM_PROMPT_CACHING else 0
+    return request.prompt[:prefix_length], request.prompt[prefix_length:]
+
+def prompt_cache_key(request: LLMRequest) -> str:
+    """Chiave stabile per modello e system prompt: instrada le chiamate simili sulla stessa cache"""
+    return hashlib.sha256(f"{request.model.name}\0{request.system_message}".encode('utf-8')).hexdigest()[:32]
+
+def content_text(content) -> str:
+    """Testo di un messaggio, anche se suddiviso in blocchi (cache_control di Anthropic)"""
+    if isinstance(content, str):
+        return content
+    return "".join(block.get('text', '') for block in content)
 
 class OpenAIService(BaseLLMService):
     """Servizio per OpenAI GPT"""
@@ -47,58 +216,60 @@ class OpenAIService(BaseLLMService):
             logger.error("OpenAI API key non configurata")
             raise LLMServiceError("OpenAI API key non configurata")
         
-        self.client = openai.OpenAI(api_key=api_key)
+        self.api_key = api_key
+        self.client = openai.OpenAI(api_key=api_key, **self.client_options())
         logger.info("OpenAI client configurato con successo")
     
-    def generate_response(self, request: LLMRequest) -> Dict[str, Any]:
-        logger.info("Generando risposta OpenAI...")
-        logger.debug(f"Modello: {request.model.name}, Prompt length: {len(request.prompt)}")
+    def create_async_client(self):
+        return openai.AsyncOpenAI(api_key=self.api_key, **self.client_options())
+    
+    def build_payload(self, request: LLMRequest) -> Dict[str, Any]:
+        logger.debug("Modello: %s, Prompt length: %s", request.model.name, len(request.prompt))
         
-        try:
-            start_time = time.time()
-            
-            messages = []
-            if request.system_message:
-                messages.append({"role": "system", "content": request.system_message})
-                logger.debug("System message aggiunto")
-            
-            # Se fa parte di una conversazione, aggiungi i messaggi precedenti
-            if request.conversation:
-                conversation_messages = request.conversation.messages.all()
-                logger.debug(f"Aggiungendo {conversation_messages.count()} messaggi dalla conversazione")
-                for msg in conversation_messages:
-                    messages.append({"role": msg.role, "content": msg.content})
-            
-            messages.append({"role": "user", "content": request.prompt})
-            logger.debug(f"Totale messaggi da inviare: {len(messages)}")
-            
-            logger.info("Chiamando API OpenAI...")
-            response = self.client.chat.completions.create(
-                model=request.model.name,
-                messages=messages,
-                max_tokens=request.max_tokens,
-                temperature=request.temperature
-            )
-            
-            end_time = time.time()
-            response_time_ms = int((end_time - start_time) * 1000)
-            
-            logger.info(f"Risposta OpenAI ricevuta in {response_time_ms}ms")
-            logger.debug(f"Token utilizzati: {response.usage.total_tokens if response.usage else 'N/A'}")
-            
-            return {
-                'response': response.choices[0].message.content,
-                'tokens_used': response.usage.total_tokens if response.usage else None,
-                'response_time_ms': response_time_ms,
-                'status': 'completed'
-            }
-            
-        except Exception as e:
-            logger.error(f"Errore OpenAI: {str(e)}")
-            return {
-                'status': 'failed',
-                'error_message': str(e)
-            }
+        messages = []
+        if request.system_message:
+            messages.append({"role": "system", "content": request.system_message})
+            logger.debug("System message aggiunto")
+        
+        # Se fa parte di una conversazione, aggiungi i messaggi precedenti
+        if request.conversation:
+            for msg in request.conversation.messages.all():
+                messages.append({"role": msg.role, "content": msg.content})
+        
+        messages.append({"role": "user", "content": request.prompt})
+        logger.debug("Totale messaggi da inviare: %s", len(messages))
+        
+        payload = {
+            'model': request.model.name,
+            'messages': messages,
+            'max_tokens': request.max_tokens,
+            'temperature': request.temperature,
+        }
+        # La cache dei prompt di OpenAI è automatica sui prefissi comuni (system message per
+        # primo); prompt_cache_key fa arrivare le richieste con lo stesso prefisso sugli stessi server
+        if settings.LLM_PROMPT_CACHING and request.system_message:
+            payload['extra_body'] = {'prompt_cache_key': prompt_cache_key(request)}
+        return payload
+    
+    def call(self, payload: Dict[str, Any]):
+        logger.info("Chiamando API OpenAI...")
+        return self.client.chat.completions.create(**payload)
+    
+    async def acall(self, payload: Dict[str, Any]):
+        logger.info("Chiamando API OpenAI (async)...")
+        return await self.get_async_client().chat.completions.create(**payload)
+    
+    def build_result(self, request: LLMRequest, payload: Dict[str, Any], response) -> Dict[str, Any]:
+        content = response.choices[0].message.content or ''
+        usage = self.build_usage(
+            request,
+            "\n".join(message['content'] for message in payload['messages']),
+            content,
+            prompt_tokens=response.usage.prompt_tokens if response.usage else None,
+            completion_tokens=response.usage.completion_tokens if response.usage else None,
+            cache_read_tokens=getattr(getattr(response.usage, 'prompt_tokens_details', None), 'cached_tokens', None),
+        )
+        return {'response': content, **usage}
 
 class AnthropicService(BaseLLMService):
     """Servizio per Anthropic Claude"""
@@ -108,45 +279,72 @@ class AnthropicService(BaseLLMService):
         if not api_key or api_key == 'your-anthropic-api-key-here':
             raise LLMServiceError("Anthropic API key non configurata")
         
-        self.client = anthropic.Anthropic(api_key=api_key)
+        self.api_key = api_key
+        self.client = anthropic.Anthropic(api_key=api_key, **self.client_options())
     
-    def generate_response(self, request: LLMRequest) -> Dict[str, Any]:
-        try:
-            start_time = time.time()
-            
-            messages = []
-            
-            # Se fa parte di una conversazione, aggiungi i messaggi precedenti
-            if request.conversation:
-                for msg in request.conversation.messages.all():
-                    if msg.role != 'system':  # Claude gestisce il system message separatamente
-                        messages.append({"role": msg.role, "content": msg.content})
-            
-            messages.append({"role": "user", "content": request.prompt})
-            
-            response = self.client.messages.create(
-                model=request.model.name,
-                max_tokens=request.max_tokens or 1000,
-                temperature=request.temperature,
-                system=request.system_message if request.system_message else None,
-                messages=messages
-            )
-            
-            end_time = time.time()
-            response_time_ms = int((end_time - start_time) * 1000)
-            
-            return {
-                'response': response.content[0].text,
-                'tokens_used': response.usage.input_tokens + response.usage.output_tokens,
-                'response_time_ms': response_time_ms,
-                'status': 'completed'
-            }
-            
-        except Exception as e:
-            return {
-                'status': 'failed',
-                'error_message': str(e)
-            }
+    def create_async_client(self):
+        return anthropic.AsyncAnthropic(api_key=self.api_key, **self.client_options())
+    
+    CACHE_CONTROL = {'type': 'ephemeral'}
+    
+    def cached_block(self, text: str) -> Dict[str, Any]:
+        return {'type': 'text', 'text': text, 'cache_control': self.CACHE_CONTROL}
+    
+    def build_payload(self, request: LLMRequest) -> Dict[str, Any]:
+        messages = []
+        caching = settings.LLM_PROMPT_CACHING
+        
+        # Se fa parte di una conversazione, aggiungi i messaggi precedenti
+        if request.conversation:
+            for msg in request.conversation.messages.all():
+                if msg.role != 'system':  # Claude gestisce il system message separatamente
+                    messages.append({"role": msg.role, "content": msg.content})
+            # Cache breakpoint sull'ultimo turno: lo storico viene riletto dalla cache al turno successivo
+            if caching and messages:
+                messages[-1]['content'] = [self.cached_block(messages[-1]['content'])]
+        
+        prefix, rest = split_cacheable_prompt(request)
+        if prefix:
+            content = [self.cached_block(prefix)] + ([{'type': 'text', 'text': rest}] if rest else [])
+        else:
+            content = request.prompt
+        messages.append({"role": "user", "content": content})
+        
+        system = request.system_message if request.system_message else None
+        if caching and system:
+            system = [self.cached_block(system)]
+        
+        return {
+            'model': request.model.name,
+            'max_tokens': request.max_tokens or 1000,
+            'temperature': request.temperature,
+            'system': system,
+            'messages': messages,
+        }
+    
+    def call(self, payload: Dict[str, Any]):
+        return self.client.messages.create(**payload)
+    
+    async def acall(self, payload: Dict[str, Any]):
+        return await self.get_async_client().messages.create(**payload)
+    
+    def build_result(self, request: LLMRequest, payload: Dict[str, Any], response) -> Dict[str, Any]:
+        content = response.content[0].text
+        usage = response.usage
+        prompt_tokens = cache_read_tokens = None
+        if usage:
+            # input_tokens esclude i token letti dalla cache e quelli scritti in cache
+            cache_read_tokens = getattr(usage, 'cache_read_input_tokens', None) or 0
+            prompt_tokens = usage.input_tokens + cache_read_tokens + (getattr(usage, 'cache_creation_input_tokens', None) or 0)
+        usage = self.build_usage(
+            request,
+            "\n".join([request.system_message] + [content_text(message['content']) for message in payload['messages']]),
+            content,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=response.usage.output_tokens if response.usage else None,
+            cache_read_tokens=cache_read_tokens,
+        )
+        return {'response': content, **usage}
 
 class GeminiService(BaseLLMService):
     """Servizio per Google Gemini"""
@@ -156,50 +354,184 @@ class GeminiService(BaseLLMService):
         if not api_key or api_key == 'your-gemini-api-key-here':
             raise LLMServiceError("Gemini API key non configurata")
         
-        self.client = genai.Client(api_key=api_key)
+        self.api_key = api_key
+        self.client = genai.Client(api_key=api_key, http_options=self.http_options())
     
-    def generate_response(self, request: LLMRequest) -> Dict[str, Any]:
+    def http_options(self):
+        # google-genai esprime il timeout in millisecondi e non ha un'opzione per i retry
+        return genai_types.HttpOptions(timeout=int(settings.LLM_PROVIDER_TIMEOUT_S * 1000))
+    
+    def create_async_client(self):
+        # Le chiamate async di google-genai passano da client.aio
+        return genai.Client(api_key=self.api_key, http_options=self.http_options()).aio
+    
+    def cached_content_name(self, request: LLMRequest) -> Optional[str]:
+        """
+        Cached content esplicito con il system prompt (LLM_GEMINI_EXPLICIT_CACHE), condiviso
+        tra i worker tramite la cache Django. Se il provider lo rifiuta (es. prompt sotto la
+        soglia minima di token) per LLM_GEMINI_CACHE_TTL_S si usa il prompt inline.
+        """
+        ttl = settings.LLM_GEMINI_CACHE_TTL_S
+        key = f"llm_gemini_cached_content:{prompt_cache_key(request)}"
+        name = cache.get(key)
+        if name is not None:
+            return name or None
+        
         try:
-            start_time = time.time()
-            
-            # Costruisci il contenuto per Gemini
-            contents = []
-            
-            # Se c'è un system message, aggiungilo come primo messaggio
-            if request.system_message:
-                contents.append(f"System: {request.system_message}\n\n")
-            
-            # Se fa parte di una conversazione, aggiungi i messaggi precedenti
-            if request.conversation:
-                for msg in request.conversation.messages.all():
-                    contents.append(f"{msg.role.capitalize()}: {msg.content}\n")
-            
-            # Aggiungi il prompt corrente
-            contents.append(f"User: {request.prompt}")
-            
-            # Unisci tutto in un singolo contenuto
-            full_content = "\n".join(contents)
-            
-            response = self.client.models.generate_content(
+            cached_content = self.client.caches.create(
                 model=request.model.name,
-                contents=full_content
+                config=genai_types.CreateCachedContentConfig(
+                    system_instruction=request.system_message,
+                    ttl=f"{ttl}s",
+                ),
             )
-            
-            end_time = time.time()
-            response_time_ms = int((end_time - start_time) * 1000)
-            
-            return {
-                'response': response.text,
-                'tokens_used': None,  # Gemini non fornisce sempre info sui token
-                'response_time_ms': response_time_ms,
-                'status': 'completed'
-            }
-            
+            name = cached_content.name
         except Exception as e:
-            return {
-                'status': 'failed',
-                'error_message': str(e)
-            }
+            logger.warning("Cached content Gemini non creato, system prompt inline: %s", e)
+            name = ''
+        # Scade prima del contenuto sul provider, per non riferire cache già eliminate
+        cache.set(key, name, timeout=max(ttl - 60, 1))
+        return name or None
+    
+    def build_payload(self, request: LLMRequest) -> Dict[str, Any]:
+        # Costruisci il contenuto per Gemini
+        contents = []
+        cached_content = None
+        if settings.LLM_PROMPT_CACHING and settings.LLM_GEMINI_EXPLICIT_CACHE and request.system_message:
+            cached_content = self.cached_content_name(request)
+        
+        # Se c'è un system message, aggiungilo come primo messaggio: un prefisso stabile
+        # che i modelli Gemini 2.5 rileggono dalla cache implicita
+        if request.system_message and not cached_content:
+            contents.append(f"System: {request.system_message}\n\n")
+        
+        # Se fa parte di una conversazione, aggiungi i messaggi precedenti
+        if request.conversation:
+            for msg in request.conversation.messages.all():
+                contents.append(f"{msg.role.capitalize()}: {msg.content}\n")
+        
+        # Aggiungi il prompt corrente
+        contents.append(f"User: {request.prompt}")
+        
+        # Unisci tutto in un singolo contenuto
+        payload = {
+            'model': request.model.name,
+            'contents': "\n".join(contents),
+        }
+        if cached_content:
+            payload['config'] = genai_types.GenerateContentConfig(cached_content=cached_content)
+        return payload
+    
+    def call(self, payload: Dict[str, Any]):
+        return self.client.models.generate_content(**payload)
+    
+    async def acall(self, payload: Dict[str, Any]):
+        return await self.get_async_client().models.generate_content(**payload)
+    
+    def build_result(self, request: LLMRequest, payload: Dict[str, Any], response) -> Dict[str, Any]:
+        # Gemini non fornisce sempre info sui token: in quel caso vengono stimati
+        content = response.text or ''
+        usage_metadata = getattr(response, 'usage_metadata', None)
+        usage = self.build_usage(
+            request,
+            payload['contents'],
+            content,
+            prompt_tokens=getattr(usage_metadata, 'prompt_token_count', None),
+            completion_tokens=getattr(usage_metadata, 'candidates_token_count', None),
+            cache_read_tokens=getattr(usage_metadata, 'cached_content_token_count', None),
+        )
+        return {'response': content, **usage}
+
+class MockLLMService(BaseLLMService):
+    """
+    Provider fittizio per load test e benchmark offline, configurato dalle
+    impostazioni MOCK_LLM_*: latenza al primo token (fixed/uniform/lognormal),
+    streaming a chunk, tasso di errore e numero di token generati.
+    
+    Se il prompt contiene un blocco di codice lo restituisce invariato, così
+    il flusso di analisi riscrive il file con codice valido.
+    """
+    CODE_BLOCK_PATTERN = re.compile(r"```(?:python)?\n(.*?)```", re.DOTALL)
+    FILLER_WORDS = ['mock', 'response', 'token', 'workflow', 'metaflow', 'step', 'data', 'model']
+    
+    def setup_client(self):
+        if not settings.MOCK_LLM_ENABLED:
+            raise LLMServiceError("Provider mock non abilitato (MOCK_LLM_ENABLED)")
+    
+    def sample_latency_ms(self) -> float:
+        """Estrae la latenza al primo token dalla distribuzione configurata"""
+        median = settings.MOCK_LLM_LATENCY_MS
+        spread = settings.MOCK_LLM_LATENCY_SPREAD
+        distribution = settings.MOCK_LLM_LATENCY_DISTRIBUTION
+        
+        if median <= 0:
+            return 0
+        if distribution == 'fixed':
+            return median
+        if distribution == 'uniform':
+            return random.uniform(median * max(1 - spread, 0), median * (1 + spread))
+        if distribution == 'lognormal':
+            return random.lognormvariate(math.log(median), spread)
+        raise LLMServiceError(f"Distribuzione di latenza mock non supportata: {distribution}")
+    
+    def build_content(self, prompt: str) -> str:
+        match = self.CODE_BLOCK_PATTERN.search(prompt)
+        if match:
+            return match.group(1).rstrip() + "\n"
+        
+        words = self.FILLER_WORDS
+        return ' '.join(words[i % len(words)] for i in range(settings.MOCK_LLM_COMPLETION_TOKENS))
+    
+    def split_chunks(self, content: str):
+        """Suddivide la risposta nei chunk configurati (un solo chunk senza streaming)"""
+        chunks = settings.MOCK_LLM_STREAM_CHUNKS
+        if chunks <= 0:
+            return [content]
+        size = max(math.ceil(len(content) / chunks), 1)
+        return [content[start:start + size] for start in range(0, len(content), size)]
+    
+    def stream_chunks(self, content: str):
+        """Restituisce la risposta a chunk con la cadenza configurata, come uno stream del provider"""
+        for chunk in self.split_chunks(content):
+            if settings.MOCK_LLM_STREAM_CHUNKS > 0:
+                time.sleep(settings.MOCK_LLM_CHUNK_INTERVAL_MS / 1000)
+            yield chunk
+    
+    async def astream_chunks(self, content: str):
+        for chunk in self.split_chunks(content):
+            if settings.MOCK_LLM_STREAM_CHUNKS > 0:
+                await asyncio.sleep(settings.MOCK_LLM_CHUNK_INTERVAL_MS / 1000)
+            yield chunk
+    
+    def build_payload(self, request: LLMRequest) -> Dict[str, Any]:
+        input_parts = [request.system_message]
+        if request.conversation:
+            input_parts.extend(msg.content for msg in request.conversation.messages.all())
+        input_parts.append(request.prompt)
+        return {'prompt': request.prompt, 'input_text': "\n".join(input_parts)}
+    
+    def simulate_error(self):
+        if random.random() < settings.MOCK_LLM_ERROR_RATE:
+            raise LLMProviderUnavailableError('Errore simulato dal provider mock')
+    
+    def call(self, payload: Dict[str, Any]):
+        time.sleep(self.sample_latency_ms() / 1000)
+        self.simulate_error()
+        return ''.join(self.stream_chunks(self.build_content(payload['prompt'])))
+    
+    async def acall(self, payload: Dict[str, Any]):
+        await asyncio.sleep(self.sample_latency_ms() / 1000)
+        self.simulate_error()
+        return ''.join([chunk async for chunk in self.astream_chunks(self.build_content(payload['prompt']))])
+    
+    def build_result(self, request: LLMRequest, payload: Dict[str, Any], response) -> Dict[str, Any]:
+        # Il mock "restituisce" l'usage come un provider reale: non risulta stimato
+        usage = self.build_usage(
+            request, payload['input_text'], response,
+            prompt_tokens=estimate_tokens(payload['input_text'], request.model.name),
+            completion_tokens=estimate_tokens(response, request.model.name),
+        )
+        return {'response': response, **usage}
 
 class LLMServiceFactory:
     """Factory per creare i servizi LLM appropriati"""
@@ -208,6 +540,7 @@ class LLMServiceFactory:
         'openai': OpenAIService,
         'anthropic': AnthropicService,
         'gemini': GeminiService,
+        'mock': MockLLMService,
     }
     
     @classmethod
@@ -223,73 +556,554 @@ class LLMServiceFactory:
         logger.debug(f"Servizio trovato per {provider_name}: {service_class.__name__}")
         return service_class()
 
+# Latenze recenti delle chiamate completate per modello: base del ritardo di hedging
+PROVIDER_LATENCIES = LatencyWindow()
+
+def resolve_fallback_chain(request: LLMRequest) -> List[LLMModel]:
+    """
+    Modelli da provare per la richiesta (ORM): il modello richiesto seguito dai
+    fallback. Con più di un modello i messaggi della conversazione vengono
+    precaricati, così i tentativi in parallelo non interrogano il database.
+    """
+    chain = get_catalog().fallback_chain(request.model) if settings.LLM_FALLBACK_ENABLED else [request.model]
+    if len(chain) > 1 and request.conversation_id:
+        prefetch_related_objects([request], 'conversation__messages')
+    return chain
+
+def request_for_model(request: LLMRequest, model: LLMModel) -> LLMRequest:
+    """Copia in memoria della richiesta indirizzata a un altro modello (mai salvata)"""
+    if model.pk == request.model_id:
+        return request
+    attempt = copy.copy(request)
+    attempt.model = model
+    return attempt
+
+def hedge_delay_ms(model: LLMModel) -> float:
+    """Attesa prima di avviare il secondo modello: il p95 recente del primo"""
+    delay = PROVIDER_LATENCIES.percentile(model.pk, settings.LLM_HEDGE_QUANTILE, settings.LLM_HEDGE_MIN_SAMPLES)
+    return delay if delay is not None else settings.LLM_HEDGE_DEFAULT_DELAY_MS
+
+def attempt_failed(model: LLMModel, error: Exception) -> Dict[str, Any]:
+    """Modello non chiamato (circuito aperto, provider non configurato): si prova il successivo"""
+    logger.warning("Modello %s non disponibile: %s", model.name, error)
+    return {'status': 'failed', 'error_message': str(error), 'error_type': type(error).__name__,
+            'retryable': True, 'served_by': model}
+
+def attempt_final(result: Optional[Dict[str, Any]]) -> bool:
+    """
+    True se non serve provare altri modelli: la richiesta è completata oppure è
+    fallita per un errore che si ripeterebbe uguale su ogni modello (es. 400)
+    """
+    return result is not None and (result['status'] == 'completed' or not result.get('retryable'))
+
+def attempt_completed(model: LLMModel, result: Dict[str, Any]) -> Dict[str, Any]:
+    result['served_by'] = model
+    if result.get('status') == 'completed':
+        PROVIDER_LATENCIES.observe(model.pk, result['response_time_ms'])
+    else:
+        logger.warning("Modello %s fallito: %s", model.name, result.get('error_message'))
+    return result
+
+def provider_failure(result: Dict[str, Any]) -> bool:
+    """
+    Esito da contare come errore nel circuit breaker: solo gli errori transitori.
+    Una richiesta non valida non dice nulla sulla salute del provider e non deve
+    aprire il circuito per tutti gli utenti.
+    """
+    return result.get('status') != 'completed' and bool(result.get('retryable'))
+
+def circuit_open(model: LLMModel) -> CircuitOpenError:
+    return CircuitOpenError(f"Circuito aperto per {model.provider.name}/{model.name}: chiamata non eseguita")
+
+def call_model(request: LLMRequest, model: LLMModel) -> Dict[str, Any]:
+    # Circuito aperto: si passa subito al prossimo modello invece di attendere il timeout
+    if not allow_model(model):
+        return attempt_failed(model, circuit_open(model))
+    try:
+        service = LLMServiceFactory.get_service(model.provider.name)
+    except LLMServiceError as e:
+        return attempt_failed(model, e)
+    
+    start = time.perf_counter()
+    result = service.generate_response(request_for_model(request, model))
+    record_model_outcome(model, not provider_failure(result), (time.perf_counter() - start) * 1000)
+    return attempt_completed(model, result)
+
+async def acall_model(request: LLMRequest, model: LLMModel) -> Dict[str, Any]:
+    if not await sync_to_async(allow_model)(model):
+        return attempt_failed(model, circuit_open(model))
+    try:
+        service = LLMServiceFactory.get_service(model.provider.name)
+    except LLMServiceError as e:
+        return attempt_failed(model, e)
+    
+    start = time.perf_counter()
+    result = await service.agenerate_response(request_for_model(request, model))
+    await sync_to_async(record_model_outcome)(model, not provider_failure(result), (time.perf_counter() - start) * 1000)
+    return attempt_completed(model, result)
+
+def call_model_in_thread(request: LLMRequest, model: LLMModel) -> Dict[str, Any]:
+    try:
+        return call_model(request, model)
+    finally:
+        connections.close_all()
+
+def hedged_call(request: LLMRequest, primary: LLMModel, secondary: LLMModel):
+    """
+    Avvia il primo modello e, se non risponde entro hedge_delay_ms, anche il secondo:
+    restituisce la prima risposta completata e i modelli provati
+    """
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='llm-hedge')
+    try:
+        futures = {executor.submit(call_model_in_thread, request, primary): primary}
+        done, _ = wait(futures, timeout=hedge_delay_ms(primary) / 1000)
+        if done:
+            return futures.popitem()[0].result(), [primary]
+        
+        logger.info("Hedging: %s non ha risposto entro il p95, avvio %s", primary.name, secondary.name)
+        futures[executor.submit(call_model_in_thread, request, secondary)] = secondary
+        result = None
+        for future in as_completed(futures):
+            result = future.result()
+            if attempt_final(result):
+                break
+        return result, list(futures.values())
+    finally:
+        # Una chiamata sincrona in corso non si può interrompere: il suo risultato viene scartato
+        executor.shutdown(wait=False, cancel_futures=True)
+
+async def ahedged_call(request: LLMRequest, primary: LLMModel, secondary: LLMModel):
+    """Come hedged_call, ma la chiamata perdente viene cancellata"""
+    first = asyncio.ensure_future(acall_model(request, primary))
+    done, _ = await asyncio.wait({first}, timeout=hedge_delay_ms(primary) / 1000)
+    if done:
+        return first.result(), [primary]
+    
+    logger.info("Hedging: %s non ha risposto entro il p95, avvio %s", primary.name, secondary.name)
+    pending = {first, asyncio.ensure_future(acall_model(request, secondary))}
+    result = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                if attempt_final(result):
+                    return result, [primary, secondary]
+        return result, [primary, secondary]
+    finally:
+        for task in pending:
+            task.cancel()
+
+def generate_with_failover(request: LLMRequest, chain: List[LLMModel]) -> Dict[str, Any]:
+    """
+    Prova i modelli della catena in ordine finché uno risponde, passando al successivo
+    solo per errori transitori (is_retryable_error). Con LLM_HEDGING_ENABLED
+    i primi due vengono messi in corsa (hedged_call), gli altri restano in sequenza.
+    Il risultato indica in 'served_by' il modello che ha risposto.
+    """
+    result, tried = None, []
+    if settings.LLM_HEDGING_ENABLED and len(chain) > 1:
+        result, tried = hedged_call(request, chain[0], chain[1])
+    
+    for model in chain:
+        if attempt_final(result):
+            break
+        if model not in tried:
+            result = call_model(request, model)
+    return result
+
+async def agenerate_with_failover(request: LLMRequest, chain: List[LLMModel]) -> Dict[str, Any]:
+    """Versione async di generate_with_failover"""
+    result, tried = None, []
+    if settings.LLM_HEDGING_ENABLED and len(chain) > 1:
+        result, tried = await ahedged_call(request, chain[0], chain[1])
+    
+    for model in chain:
+        if attempt_final(result):
+            break
+        if model not in tried:
+            result = await acall_model(request, model)
+    return result
+
+COALESCE_KEY_PREFIX = 'llm_inflight'
+SHARED_USAGE = {'tokens_used': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cache_read_tokens': 0, 'tokens_estimated': False}
+
+def normalize_prompt_text(text: str) -> str:
+    return '\n'.join(line.rstrip() for line in (text or '').strip().splitlines())
+
+def coalescing_key(request: LLMRequest, chain: List[LLMModel], owner=None) -> Optional[str]:
+    """
+    Hash della richiesta normalizzata (modelli, system prompt, prompt e parametri);
+    None se la richiesta non va condivisa (coalescing disattivato o conversazione)
+    """
+    if not settings.LLM_COALESCING or request.conversation_id:
+        return None
+    parts = [
+        type(owner).__name__ if owner is not None else 'call',
+        ','.join(str(model.pk) for model in chain),
+        normalize_prompt_text(request.system_message),
+        normalize_prompt_text(request.prompt),
+        repr(request.temperature),
+        repr(request.max_tokens),
+    ]
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+def shared_payload(result: Dict[str, Any], owner) -> Dict[str, Any]:
+    """Risultato pubblicato per le richieste in attesa (il modello come id, serializzabile)"""
+    payload = {key: value for key, value in result.items() if key != 'served_by'}
+    if result.get('served_by'):
+        payload['served_by_id'] = result['served_by'].pk
+    persisted = owner is not None and owner.pk is not None and not owner._state.adding
+    payload['shared_completion_id'] = str(owner.pk) if persisted else None
+    return payload
+
+def shared_result(payload: Dict[str, Any], started: float) -> Dict[str, Any]:
+    """
+    Risultato di una richiesta servita dalla chiamata di un'altra: i token e il
+    costo restano sulla richiesta che ha chiamato il provider (shared_completion)
+    """
+    result = {**payload, **SHARED_USAGE}
+    served_by_id = result.pop('served_by_id', None)
+    if served_by_id:
+        result['served_by'] = lookup_model(served_by_id)
+    result['response_time_ms'] = int((time.perf_counter() - started) * 1000)
+    return result
+
+async def ashared_result(payload: Dict[str, Any], started: float) -> Dict[str, Any]:
+    """Versione async di shared_result: il catalogo si carica con cache e ORM sincroni"""
+    return await sync_to_async(shared_result)(payload, started)
+
+def generate_coalesced(request: LLMRequest, chain: List[LLMModel], owner=None) -> Dict[str, Any]:
+    """
+    generate_with_failover con single-flight tra worker e processi: la prima
+    richiesta prende il lock (cache.add) e chiama il provider, le richieste
+    identiche che arrivano mentre è in corso attendono il suo risultato. Se la
+    prima termina con un'eccezione le altre riprovano a prendere il lock; oltre
+    LLM_COALESCE_WAIT_S di attesa chiamano il provider direttamente.
+    owner è il record (LLMRequest o WorkflowFileAnalysis) a cui punta shared_completion.
+    """
+    key = coalescing_key(request, chain, owner)
+    if key is None:
+        return generate_with_failover(request, chain)
+    
+    lock_key = f'{COALESCE_KEY_PREFIX}:{key}'
+    token = uuid.uuid4().hex
+    started = time.perf_counter()
+    deadline = time.monotonic() + settings.LLM_COALESCE_WAIT_S
+    try:
+        while not cache.add(lock_key, token, timeout=settings.LLM_COALESCE_WAIT_S):
+            leader = cache.get(lock_key)
+            while leader is not None and time.monotonic() < deadline:
+                cached = cache.get_many([f'{lock_key}:{leader}', lock_key])
+                if f'{lock_key}:{leader}' in cached:
+                    logger.info("Risposta condivisa con una richiesta identica in corso")
+                    return shared_result(cached[f'{lock_key}:{leader}'], started)
+                if cached.get(lock_key) != leader:
+                    break
+                time.sleep(settings.LLM_COALESCE_POLL_MS / 1000)
+            if time.monotonic() >= deadline:
+                logger.warning("Attesa della richiesta identica scaduta: chiamata diretta al provider")
+                return generate_with_failover(request, chain)
+    except Exception as e:
+        logger.warning("Coalescing non disponibile, chiamata diretta: %s", e)
+        return generate_with_failover(request, chain)
+    
+    try:
+        result = generate_with_failover(request, chain)
+        cache.set(f'{lock_key}:{token}', shared_payload(result, owner), timeout=settings.LLM_COALESCE_RESULT_TTL_S)
+        return result
+    finally:
+        try:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+        except Exception as e:
+            logger.warning("Lock di coalescing non rilasciato (scade da solo): %s", e)
+
+async def agenerate_coalesced(request: LLMRequest, chain: List[LLMModel], owner=None) -> Dict[str, Any]:
+    """Versione async di generate_coalesced"""
+    key = coalescing_key(request, chain, owner)
+    if key is None:
+        return await agenerate_with_failover(request, chain)
+    
+    lock_key = f'{COALESCE_KEY_PREFIX}:{key}'
+    token = uuid.uuid4().hex
+    started = time.perf_counter()
+    deadline = time.monotonic() + settings.LLM_COALESCE_WAIT_S
+    try:
+        while not await cache.aadd(lock_key, token, timeout=settings.LLM_COALESCE_WAIT_S):
+            leader = await cache.aget(lock_key)
+            while leader is not None and time.monotonic() < deadline:
+                cached = await cache.aget_many([f'{lock_key}:{leader}', lock_key])
+                if f'{lock_key}:{leader}' in cached:
+                    logger.info("Risposta condivisa con una richiesta identica in corso")
+                    return await ashared_result(cached[f'{lock_key}:{leader}'], started)
+                if cached.get(lock_key) != leader:
+                    break
+                await asyncio.sleep(settings.LLM_COALESCE_POLL_MS / 1000)
+            if time.monotonic() >= deadline:
+                logger.warning("Attesa della richiesta identica scaduta: chiamata diretta al provider")
+                return await agenerate_with_failover(request, chain)
+    except Exception as e:
+        logger.warning("Coalescing non disponibile, chiamata diretta: %s", e)
+        return await agenerate_with_failover(request, chain)
+    
+    try:
+        result = await agenerate_with_failover(request, chain)
+        await cache.aset(f'{lock_key}:{token}', shared_payload(result, owner), timeout=settings.LLM_COALESCE_RESULT_TTL_S)
+        return result
+    finally:
+        try:
+            if await cache.aget(lock_key) == token:
+                await cache.adelete(lock_key)
+        except Exception as e:
+            logger.warning("Lock di coalescing non rilasciato (scade da solo): %s", e)
+
+# Campi scritti al termine di una richiesta: evita di riscrivere prompt e parametri
+LLM_RESULT_FIELDS = [
+    'response', 'status', 'error_message', 'tokens_used', 'prompt_tokens', 'completion_tokens',
+    'cache_read_tokens', 'tokens_estimated', 'cost', 'served_by', 'shared_completion', 'response_time_ms',
+    'stage_timings', 'completed_at'
+]
+
+def apply_llm_result(request: LLMRequest, result: Dict[str, Any]) -> LLMRequest:
+    """Copia il risultato del provider sulla richiesta (solo in memoria)"""
+    request.response = result.get('response', '')
+    request.status = result.get('status', 'failed')
+    request.error_message = result.get('error_message', '')
+    request.tokens_used = result.get('tokens_used')
+    request.prompt_tokens = result.get('prompt_tokens')
+    request.completion_tokens = result.get('completion_tokens')
+    request.cache_read_tokens = result.get('cache_read_tokens')
+    request.tokens_estimated = result.get('tokens_estimated', False)
+    if result.get('served_by'):
+        request.served_by = result['served_by']
+    elif result.get('served_by_id'):
+        request.served_by_id = result['served_by_id']  # risultato letto dalla outbox
+    request.shared_completion_id = result.get('shared_completion_id')
+    # Il costo segue il modello che ha risposto, non quello richiesto
+    billed_model = request.served_by or request.model
+    request.cost = billed_model.compute_cost(
+        request.prompt_tokens, request.completion_tokens, request.cache_read_tokens
+    ) if request.tokens_used else None
+    request.response_time_ms = result.get('response_time_ms')
+    if 'stage_timings' in result:
+        request.stage_timings = result['stage_timings']
+    if request.status == 'completed':
+        request.completed_at = result.get('completed_at') or timezone.now()
+    return request
+
+def record_llm_usage(call) -> None:
+    """Somma una LLMRequest o WorkflowFileAnalysis appena conclusa agli aggregati orari"""
+    LLMUsageHourly.record(
+        call.served_by or call.model,
+        user_id=call.user_id,
+        at=call.completed_at,
+        prompt_tokens=call.prompt_tokens,
+        completion_tokens=call.completion_tokens,
+        cache_read_tokens=call.cache_read_tokens,
+        cost=call.cost,
+        response_time_ms=call.response_time_ms,
+        failed=call.status != 'completed',
+        estimated=call.tokens_estimated,
+    )
+
+def record_llm_failure(call) -> None:
+    """
+    Conta negli aggregati orari una chiamata terminata con un'eccezione, se il
+    suo esito non è già stato registrato (o accodato nella outbox) prima dell'errore
+    """
+    if getattr(call, 'usage_recorded', False):
+        return
+    try:
+        record_llm_usage(call)
+        call.usage_recorded = True
+    except Exception as e:
+        logger.error("Errore nella registrazione dell'utilizzo LLM: %s", e)
+
+def persist_llm_result(request: LLMRequest) -> LLMRequest:
+    """
+    Salva il risultato di una richiesta in un'unica transazione:
+    UPDATE dei soli campi di risultato e, per le conversazioni,
+    bulk_create della coppia di messaggi e aggiornamento dei contatori
+    """
+    with transaction.atomic():
+        request.save(update_fields=LLM_RESULT_FIELDS)
+        record_llm_usage(request)
+        
+        if request.status == 'completed' and request.conversation_id:
+            messages = ConversationMessage.objects.bulk_create([
+                ConversationMessage(conversation_id=request.conversation_id, role='user', content=request.prompt),
+                ConversationMessage(conversation_id=request.conversation_id, role='assistant', content=request.response),
+            ])
+            request.conversation.register_messages(
+                len(messages), tokens=request.tokens_used, at=messages[-1].created_at
+            )
+    request.usage_recorded = True
+    return request
+
+def enqueue_llm_result(request: LLMRequest) -> LLMResultOutbox:
+    """Registra il risultato nella outbox durevole con un singolo INSERT (modalità worker)"""
+    return LLMResultOutbox.objects.create(
+        request_id=request.id,
+        payload={
+            'response': request.response,
+            'status': request.status,
+            'error_message': request.error_message,
+            'tokens_used': request.tokens_used,
+            'prompt_tokens': request.prompt_tokens,
+            'completion_tokens': request.completion_tokens,
+            'cache_read_tokens': request.cache_read_tokens,
+            'tokens_estimated': request.tokens_estimated,
+            'served_by_id': request.served_by_id,
+            'shared_completion_id': str(request.shared_completion_id) if request.shared_completion_id else None,
+            'response_time_ms': request.response_time_ms,
+            'stage_timings': request.stage_timings,
+            'completed_at': request.completed_at.isoformat() if request.completed_at else None,
+        }
+    )
+
+def outbox_retry_delay(attempts: int) -> timedelta:
+    """Backoff esponenziale tra i tentativi di una voce della outbox"""
+    return timedelta(seconds=settings.LLM_OUTBOX_RETRY_BACKOFF_S * 2 ** max(attempts - 1, 0))
+
+def apply_llm_result_outbox(batch_size: int = 100) -> int:
+    """
+    Applica i risultati della outbox scaduti (next_attempt_at); restituisce il
+    numero di voci applicate. Una voce che fallisce torna in coda dopo il backoff,
+    così non blocca le successive, e oltre LLM_OUTBOX_MAX_ATTEMPTS tentativi
+    resta come morta per l'analisi da admin.
+    """
+    applied = 0
+    now = timezone.now()
+    with transaction.atomic():
+        entries = (
+            LLMResultOutbox.objects
+            .filter(applied_at__isnull=True, dead_at__isnull=True, next_attempt_at__lte=now)
+            .select_related('request__conversation')
+            .select_for_update(skip_locked=True, of=('self',))
+            .order_by('next_attempt_at', 'created_at')[:batch_size]
+        )
+        for entry in entries:
+            payload = dict(entry.payload)
+            if payload.get('completed_at'):
+                payload['completed_at'] = parse_datetime(payload['completed_at'])
+            
+            try:
+                with transaction.atomic():
+                    persist_llm_result(apply_llm_result(entry.request, payload))
+                    entry.applied_at = timezone.now()
+                    entry.save(update_fields=['applied_at'])
+                applied += 1
+            except Exception as e:
+                entry.attempts += 1
+                entry.last_error = str(e)
+                if entry.attempts >= settings.LLM_OUTBOX_MAX_ATTEMPTS:
+                    logger.error("Voce outbox %s scartata dopo %s tentativi: %s", entry.id, entry.attempts, e)
+                    entry.dead_at = timezone.now()
+                else:
+                    logger.warning("Errore nell'applicazione della outbox %s (tentativo %s): %s", entry.id, entry.attempts, e)
+                    entry.next_attempt_at = timezone.now() + outbox_retry_delay(entry.attempts)
+                entry.save(update_fields=['attempts', 'last_error', 'next_attempt_at', 'dead_at'])
+    return applied
+
+def start_llm_request(request: LLMRequest, timer: StageTimer) -> List[LLMModel]:
+    """Prima fase di una richiesta (ORM): stato 'processing' e modelli da provare"""
+    logger.info("Processando richiesta LLM ID: %s", request.id if request.id else 'NUOVO')
+    logger.debug("Dettagli richiesta - Modello: %s, Provider: %s", request.model.name, request.model.provider.name)
+    timer.set_labels(provider=request.model.provider.name, model=request.model.name)
+    
+    request.status = 'processing'
+    with timer.stage('db_write'):
+        if request._state.adding:
+            request.save()
+        else:
+            request.save(update_fields=['status'])
+    logger.debug("Status aggiornato a 'processing'")
+    
+    if request.conversation_id:
+        # Conversazione archiviata: i messaggi tornano nella tabella prima del nuovo turno
+        with timer.stage('rehydrate'):
+            ensure_active(request.conversation)
+    
+    return resolve_fallback_chain(request)
+
+def finish_llm_request(request: LLMRequest, result: Dict[str, Any], timer: StageTimer) -> LLMRequest:
+    """Ultima fase di una richiesta (ORM): salvataggio del risultato del provider"""
+    # Aggiorna la richiesta con il risultato
+    logger.debug("Aggiornando richiesta con risultato: status=%s", result.get('status'))
+    apply_llm_result(request, result)
+    
+    if request.status == 'completed':
+        logger.info("Richiesta completata con successo")
+    else:
+        logger.warning("Richiesta completata con errore: %s", request.error_message)
+    
+    if settings.METRICS_STORE_STAGE_TIMINGS:
+        request.stage_timings = timer.as_dict()
+    
+    with timer.stage('db_write'):
+        if settings.LLM_RESULT_OUTBOX:
+            # Il risultato viene applicato da 'manage.py apply_llm_outbox'
+            enqueue_llm_result(request)
+            # L'utilizzo viene contato quando la outbox applica il risultato
+            request.usage_recorded = True
+            logger.debug("Risultato accodato nella outbox")
+        else:
+            persist_llm_result(request)
+            logger.debug("Richiesta salvata nel database")
+    timer.finish(request.status)
+    return request
+
+def fail_llm_request(request: LLMRequest, error: Exception, timer: StageTimer) -> LLMRequest:
+    logger.error("Errore durante il processing della richiesta: %s", error)
+    request.status = 'failed'
+    request.error_message = str(error)
+    request.save(update_fields=['status', 'error_message'])
+    record_llm_failure(request)
+    timer.finish(request.status)
+    return request
+
 def process_llm_request(request: LLMRequest) -> LLMRequest:
     """Processa una richiesta LLM e aggiorna il database"""
-    logger.info(f"Processando richiesta LLM ID: {request.id if request.id else 'NUOVO'}")
-    logger.debug(f"Dettagli richiesta - Modello: {request.model.name}, Provider: {request.model.provider.name}")
+    timer = StageTimer('llm_request')
     
     try:
-        request.status = 'processing'
-        request.save()
-        logger.debug("Status aggiornato a 'processing'")
-        
-        # Ottieni il servizio appropriato
-        logger.info(f"Ottenendo servizio per provider: {request.model.provider.name}")
-        service = LLMServiceFactory.get_service(request.model.provider.name)
+        chain = start_llm_request(request, timer)
         
         # Genera la risposta
         logger.info("Generando risposta...")
-        result = service.generate_response(request)
-        
-        # Aggiorna la richiesta con il risultato
-        logger.debug(f"Aggiornando richiesta con risultato: status={result.get('status')}")
-        request.response = result.get('response', '')
-        request.status = result.get('status', 'failed')
-        request.error_message = result.get('error_message', '')
-        request.tokens_used = result.get('tokens_used')
-        request.response_time_ms = result.get('response_time_ms')
-        
-        if request.status == 'completed':
-            request.completed_at = timezone.now()
-            logger.info("Richiesta completata con successo")
-            
-            # Se fa parte di una conversazione, aggiungi i messaggi
-            if request.conversation:
-                logger.debug("Aggiungendo messaggi alla conversazione...")
-                # Aggiungi il messaggio dell'utente
-                ConversationMessage.objects.create(
-                    conversation=request.conversation,
-                    role='user',
-                    content=request.prompt
-                )
-                
-                # Aggiungi la risposta dell'assistente
-                ConversationMessage.objects.create(
-                    conversation=request.conversation,
-                    role='assistant',
-                    content=request.response
-                )
-                logger.debug("Messaggi aggiunti alla conversazione")
-        else:
-            logger.warning(f"Richiesta completata con errore: {request.error_message}")
+        with timer.stage('llm_call'):
+            result = generate_coalesced(request, chain, owner=request)
         
-        request.save()
-        logger.debug("Richiesta salvata nel database")
-        return request
+        return finish_llm_request(request, result, timer)
         
     except Exception as e:
-        logger.error(f"Errore durante il processing della richiesta: {str(e)}")
-        request.status = 'failed'
-        request.error_message = str(e)
-        request.save()
-        return request
+        return fail_llm_request(request, e, timer)
 
+async def aprocess_llm_request(request: LLMRequest) -> LLMRequest:
+    """
+    Versione async di process_llm_request per le view ASGI: la chiamata al
+    provider usa il client async, le fasi ORM girano nel thread di sync_to_async
+    """
+    timer = StageTimer('llm_request')
+    
+    try:
+        chain = await sync_to_async(start_llm_request)(request, timer)
+        
+        logger.info("Generando risposta (async)...")
+        with timer.stage('llm_call'):
+            result = await agenerate_coalesced(request, chain, owner=request)
+        
+        return await sync_to_async(finish_llm_request)(request, result, timer)
+        
+    except Exception as e:
+        return await sync_to_async(fail_llm_request)(request, e, timer)
 
 def get_available_workflow_files():
     """Restituisce la lista dei file workflow disponibili"""
     from django.conf import settings
     
-    generated_workflows_dir = os.path.join(settings.BASE_DIR, 'src', 'generated_workflows')
+    generated_workflows_dir = settings.GENERATED_WORKFLOWS_DIR
     workflow_files = []
     
     if os.path.exists(generated_workflows_dir):
@@ -317,46 +1131,46 @@ def resolve_workflow_file_path(workflow_id=None, workflow_file_name=None, workfl
     """Risolve il path del file workflow da analizzare"""
     from django.conf import settings
     
-    logger.info(f"🔍 Risolvendo path file workflow...")
-    logger.debug(f"Parametri ricevuti - workflow_id: {workflow_id}, workflow_file_name: {workflow_file_name}, workflow_file_path: {workflow_file_path}")
+    logger.info("🔍 Risolvendo path file workflow...")
+    logger.debug("Parametri ricevuti - workflow_id: %s, workflow_file_name: %s, workflow_file_path: %s", workflow_id, workflow_file_name, workflow_file_path)
     
     if workflow_file_path and os.path.exists(workflow_file_path):
-        logger.info(f"Path completo fornito e verificato: {workflow_file_path}")
+        logger.info("Path completo fornito e verificato: %s", workflow_file_path)
         return workflow_file_path
     
-    generated_workflows_dir = os.path.join(settings.BASE_DIR, 'src', 'generated_workflows')
-    logger.debug(f"Directory workflows: {generated_workflows_dir}")
+    generated_workflows_dir = settings.GENERATED_WORKFLOWS_DIR
+    logger.debug("Directory workflows: %s", generated_workflows_dir)
     
     # Verifica che la directory base esista
     if not os.path.exists(generated_workflows_dir):
-        logger.error(f"Directory base workflows non esiste: {generated_workflows_dir}")
+        logger.error("Directory base workflows non esiste: %s", generated_workflows_dir)
         raise LLMServiceError(f"Directory base workflows non configurata: {generated_workflows_dir}")
     
     if workflow_id:
         # Cerca il file nella directory del workflow
         workflow_dir = os.path.join(generated_workflows_dir, str(workflow_id))
-        logger.debug(f"Cercando in directory workflow: {workflow_dir}")
+        logger.debug("Cercando in directory workflow: %s", workflow_dir)
         
         if os.path.exists(workflow_dir):
             # Cerca il primo file .py nella directory
             py_files = glob.glob(os.path.join(workflow_dir, '*.py'))
-            logger.debug(f"File .py trovati: {py_files}")
+            logger.debug("File .py trovati: %s", py_files)
             
             if py_files:
                 resolved_path = py_files[0]
-                logger.info(f"File trovato tramite workflow_id: {resolved_path}")
+                logger.info("File trovato tramite workflow_id: %s", resolved_path)
                 return resolved_path
             else:
-                logger.warning(f"Directory workflow esiste ma non contiene file .py: {workflow_dir}")
+                logger.warning("Directory workflow esiste ma non contiene file .py: %s", workflow_dir)
         else:
-            logger.warning(f"Directory workflow non esiste: {workflow_dir}")
+            logger.warning("Directory workflow non esiste: %s", workflow_dir)
             
             # Verifica se il workflow esiste nel database ma il file non è stato generato
             try:
                 from ..workflow_generator.models import WorkflowGeneration
                 workflow = WorkflowGeneration.objects.filter(id=workflow_id).first()
                 if workflow:
-                    logger.info(f"Workflow trovato nel DB - Status: {workflow.status}")
+                    logger.info("Workflow trovato nel DB - Status: %s", workflow.status)
                     if workflow.status == 'failed':
                         raise LLMServiceError(f"Il workflow {workflow_id} è fallito durante la generazione: {workflow.error_message}")
                     elif workflow.status == 'processing':
@@ -368,20 +1182,20 @@ def resolve_workflow_file_path(workflow_id=None, workflow_file_name=None, workfl
                 else:
                     raise LLMServiceError(f"Il workflow {workflow_id} non esiste nel database.")
             except Exception as db_error:
-                logger.error(f"Errore nella verifica del database: {str(db_error)}")
+                logger.error("Errore nella verifica del database: %s", db_error)
                 raise LLMServiceError(f"Il workflow {workflow_id} non è stato trovato. Verifica che sia stato generato correttamente.")
     
     if workflow_file_name:
         # Cerca il file per nome in tutte le directory
         pattern = os.path.join(generated_workflows_dir, '*', workflow_file_name)
-        logger.debug(f"Cercando con pattern: {pattern}")
+        logger.debug("Cercando con pattern: %s", pattern)
         
         matches = glob.glob(pattern)
-        logger.debug(f"File trovati con pattern: {matches}")
+        logger.debug("File trovati con pattern: %s", matches)
         
         if matches:
             resolved_path = matches[0]
-            logger.info(f"File trovato tramite workflow_file_name: {resolved_path}")
+            logger.info("File trovato tramite workflow_file_name: %s", resolved_path)
             return resolved_path
     
     # Lista i file disponibili per aiutare il debug
@@ -399,7 +1213,7 @@ def resolve_workflow_file_path(workflow_id=None, workflow_file_name=None, workfl
                         })
         
         if available_workflows:
-            logger.info(f"Workflow disponibili: {available_workflows}")
+            logger.info("Workflow disponibili: %s", available_workflows)
             available_list = ', '.join([f"{w['id']} ({', '.join(w['files'])})" for w in available_workflows])
             raise LLMServiceError(f"File workflow non trovato. Workflow disponibili: {available_list}")
         else:
@@ -407,205 +1221,758 @@ def resolve_workflow_file_path(workflow_id=None, workflow_file_name=None, workfl
             raise LLMServiceError("Nessun workflow generato trovato. Assicurati di aver generato almeno un workflow prima di richiederne l'analisi.")
             
     except Exception as list_error:
-        logger.error(f"Errore nel listare i workflow disponibili: {str(list_error)}")
+        logger.error("Errore nel listare i workflow disponibili: %s", list_error)
         
     logger.error("File workflow non trovato con nessuno dei metodi")
     raise LLMServiceError("File workflow non trovato")
 
-def process_workflow_file_analysis(analysis: 'WorkflowFileAnalysis') -> 'WorkflowFileAnalysis':
-    """Processa un'analisi di file workflow tramite LLM"""
-    logger.info(f"Iniziando analisi workflow file...")
-    logger.debug(f"Analisi ID: {analysis.id if analysis.id else 'NUOVO'}, Path: {analysis.workflow_file_path}")
-    logger.debug(f"Modello: {analysis.model.name}, Provider: {analysis.model.provider.name}")
-    
+def extract_workflow_id_from_path(workflow_file_path: str) -> Optional[str]:
+    """Estrae il workflow_id dal path {GENERATED_WORKFLOWS_DIR}/{workflow_id}/{file_name}"""
+    workflow_id = None
     try:
-        analysis.status = 'processing'
-        analysis.save()
-        logger.debug("Status analisi aggiornato a 'processing'")
+        # Normalizziamo il path per Windows
+        normalized_path = os.path.normpath(workflow_file_path)
+        path_parts = normalized_path.split(os.sep)
         
-        # Leggi il contenuto del file
-        logger.info(f"Leggendo file: {analysis.workflow_file_path}")
-        if not os.path.exists(analysis.workflow_file_path):
-            error_msg = f"File non trovato: {analysis.workflow_file_path}"
-            logger.error(f"{error_msg}")
-            raise LLMServiceError(error_msg)
-        
-        with open(analysis.workflow_file_path, 'r', encoding='utf-8') as f:
-            workflow_content = f.read()
+        if 'generated_workflows' in path_parts:
+            workflow_idx = path_parts.index('generated_workflows')
+            if len(path_parts) > workflow_idx + 1:
+                workflow_id = path_parts[workflow_idx + 1]
+                logger.info("Workflow ID estratto: %s", workflow_id)
         
-        logger.debug(f"Contenuto file letto: {len(workflow_content)} caratteri")
-        analysis.workflow_content = workflow_content
-        analysis.save()
+        # Fallback: cerca pattern UUID nel path
+        if not workflow_id:
+            import re
+            uuid_pattern = r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
+            for part in path_parts:
+                if re.match(uuid_pattern, part, re.IGNORECASE):
+                    workflow_id = part
+                    logger.info("Workflow ID trovato tramite UUID pattern: %s", workflow_id)
+                    break
+                    
+    except Exception as extract_error:
+        logger.warning("Impossibile estrarre workflow ID: %s", extract_error)
+        logger.debug("Path analizzato: %s", workflow_file_path)
+    
+    return workflow_id
+
+def deploy_improved_workflow(workflow_file_path: str, file_content: str):
+    """Deploya il file migliorato su ml_runner (cartella per workflow_id se disponibile)"""
+    from ..ssh_deployment.services import deploy_workflow_to_ml_runner, deploy_workflow_to_ml_runner_with_folder
+    
+    workflow_id = extract_workflow_id_from_path(workflow_file_path)
+    file_name = os.path.basename(workflow_file_path)
+    
+    # Se abbiamo un workflow_id, crea una cartella specifica
+    if workflow_id:
+        # Deployment con cartella workflow_id
+        deployment = deploy_workflow_to_ml_runner_with_folder(
+            file_content=file_content,
+            file_name=file_name,
+            workflow_id=workflow_id
+        )
         
-        # Costruisci il prompt completo con istruzioni specifiche per solo codice
-        default_system_prompt = """Sei un esperto sviluppatore Python specializzato in Metaflow. 
+        logger.info("File deployato in cartella: %s/%s", workflow_id, file_name)
+        logger.info("Path Jupyter: %s/%s", workflow_id, file_name)
+    else:
+        # Deployment normale
+        deployment = deploy_workflow_to_ml_runner(
+            file_content=file_content,
+            file_name=file_name,
+            workflow_id=workflow_id
+        )
+        logger.info("File deployato: %s", file_name)
+    
+    logger.info("Status deployment: %s", deployment.status)
+    return deployment
+
+DEFAULT_ANALYSIS_SYSTEM_PROMPT = """Sei un esperto sviluppatore Python specializzato in Metaflow. 
 Analizza al fine di completare e migliorare il codice fornito. 
 IMPORTANTE: Rispondi SOLO con il codice Python migliorato, senza commenti, spiegazioni o testo aggiuntivo.
 Il tuo output deve essere codice Python valido che può essere salvato direttamente in un file .py."""
-        
-        system_prompt = analysis.system_prompt if analysis.system_prompt else default_system_prompt
-        logger.debug(f"System prompt lunghezza: {len(system_prompt)} caratteri")
-        
-        user_prompt_parts = [
-            "Migliora il seguente codice Python di un workflow Metaflow:",
-            "",
-            "```python",
-            workflow_content,
-            "```"
-        ]
-        
-        if analysis.user_prompt:
-            logger.debug(f"User prompt personalizzato fornito: {len(analysis.user_prompt)} caratteri")
+
+def build_analysis_prompt(intro: str, code: str, user_prompt: str, reminder: str, context: Optional[List[str]] = None,
+                          context_title: str = "Contesto del workflow (da non riscrivere):",
+                          examples: Optional[List[WorkflowStepCache]] = None) -> str:
+    """Prompt di analisi: codice da migliorare, contesto, esempi, richieste dell'utente e promemoria finale"""
+    user_prompt_parts = [intro, "", "```python", code, "```"]
+    
+    if context:
+        user_prompt_parts.extend(["", context_title, *context])
+    
+    if examples:
+        user_prompt_parts.extend(["", "Esempi di miglioramenti precedenti di step simili (solo come riferimento):"])
+        for example in examples:
             user_prompt_parts.extend([
                 "",
-                "Richieste specifiche:",
-                analysis.user_prompt
+                f"Step `{example.step_name}` della classe `{example.class_name}`, prima:",
+                "```python", example.source.rstrip(), "```",
+                "dopo:",
+                "```python", example.improved_source.rstrip(), "```",
             ])
-        
+    
+    if user_prompt:
+        logger.debug("User prompt personalizzato fornito: %s caratteri", len(user_prompt))
         user_prompt_parts.extend([
             "",
-            "RICORDA: Rispondi SOLO con il codice Python migliorato, senza commenti o spiegazioni."
+            "Richieste specifiche:",
+            user_prompt
         ])
+    
+    user_prompt_parts.extend(["", reminder])
+    return "\n".join(user_prompt_parts)
+
+def cacheable_prefix_length(prompt: str) -> int:
+    """Fine del blocco di codice del prompt di analisi: istruzioni e codice sono la parte stabile"""
+    start = prompt.find("```python\n")
+    end = prompt.find("\n```", start + len("```python\n")) if start >= 0 else -1
+    return end + len("\n```") if end >= 0 else 0
+
+def analysis_system_prompt(analysis: 'WorkflowFileAnalysis') -> str:
+    return analysis.system_prompt if analysis.system_prompt else DEFAULT_ANALYSIS_SYSTEM_PROMPT
+
+def analysis_prompt_hash(analysis: 'WorkflowFileAnalysis') -> str:
+    """Hash delle istruzioni dell'analisi: gli step migliorati valgono solo a parità di prompt"""
+    prompts = f"{analysis_system_prompt(analysis)}\0{analysis.user_prompt}"
+    return hashlib.sha256(prompts.encode('utf-8')).hexdigest()
+
+def step_cache_queryset(analysis: 'WorkflowFileAnalysis'):
+    return WorkflowStepCache.objects.filter(
+        workflow_file_path=analysis.workflow_file_path,
+        model=analysis.model,
+        prompt_hash=analysis_prompt_hash(analysis),
+    )
+
+def load_reused_steps(analysis: 'WorkflowFileAnalysis', chunks) -> None:
+    """
+    Step che non serve reinviare al modello: quelli con lo stesso sorgente di
+    un'analisi precedente (si riusa il risultato) e quelli già migliorati e
+    non più modificati (restano come sono)
+    """
+    steps_by_hash = {step.source_hash: step for step in chunks.steps}
+    cached_steps = step_cache_queryset(analysis).filter(
+        Q(source_hash__in=steps_by_hash) | Q(improved_hash__in=steps_by_hash)
+    ).only('source_hash', 'improved_hash', 'improved_source', 'imports')
+    
+    for cached in cached_steps:
+        if cached.source_hash in steps_by_hash:
+            chunks.reused[steps_by_hash[cached.source_hash].key] = (cached.improved_source, cached.imports)
+        else:
+            step = steps_by_hash[cached.improved_hash]
+            chunks.reused.setdefault(step.key, (step.source, []))
+    logger.info("Step riusati da analisi precedenti: %s/%s", len(chunks.reused), len(chunks.steps))
+
+def load_few_shot_examples(analysis: 'WorkflowFileAnalysis', chunks) -> List[WorkflowStepCache]:
+    """
+    Esempi few-shot dall'indice vettoriale: per step (chunks.examples) in
+    modalità 'chunked', per l'intero file (valore restituito) altrimenti.
+    Un indice assente o non utilizzabile non blocca l'analisi.
+    """
+    if not settings.LLM_FEW_SHOT_ENABLED or settings.LLM_FEW_SHOT_K <= 0:
+        return []
+    try:
+        if chunks is None:
+            return few_shot_examples([analysis.workflow_content])
+        own_hashes = [step.source_hash for step in chunks.steps]
+        if analysis.analysis_mode == 'chunked':
+            for step in chunks.pending_steps():
+                chunks.examples[step.key] = few_shot_examples([step.source], exclude_hashes=own_hashes)
+            return []
+        return few_shot_examples([step.source for step in chunks.steps], exclude_hashes=own_hashes)
+    except EmbeddingIndexUnavailable as e:
+        logger.debug("Esempi few-shot non disponibili: %s", e)
+    except Exception as e:
+        logger.warning("Ricerca degli esempi few-shot fallita: %s", e)
+    return []
+
+def refresh_embedding_index() -> None:
+    """Aggiornamento incrementale dell'indice; se un altro processo lo sta già aggiornando si salta"""
+    try:
+        updated = update_index(blocking=False)
+    except EmbeddingIndexUnavailable as e:
+        logger.debug("Indice vettoriale non aggiornato: %s", e)
+    except Exception as e:
+        logger.warning("Aggiornamento dell'indice vettoriale fallito: %s", e)
+    else:
+        if updated:
+            logger.info("Indice vettoriale aggiornato: %s step", updated)
+
+_index_refresh_lock = threading.Lock()
+_index_refresh_pending = False
+
+def refresh_stale_embedding_index() -> None:
+    """Thread in background: attende LLM_EMBEDDING_REFRESH_DELAY_S e aggiorna l'indice se è marcato"""
+    global _index_refresh_pending
+    try:
+        time.sleep(settings.LLM_EMBEDDING_REFRESH_DELAY_S)
+        with _index_refresh_lock:
+            _index_refresh_pending = False
+        if is_stale():
+            refresh_embedding_index()
+    finally:
+        connections.close_all()
+
+def schedule_embedding_index_refresh() -> None:
+    """
+    Dopo il commit degli step salvati da un'analisi: marca l'indice come da
+    aggiornare e, con LLM_EMBEDDING_AUTO_UPDATE, avvia (al massimo uno per
+    processo) il thread che lo aggiorna; le analisi ravvicinate ne condividono uno
+    """
+    global _index_refresh_pending
+    try:
+        mark_stale()
+    except OSError as e:
+        logger.warning("Indice vettoriale non marcato da aggiornare: %s", e)
+        return
+    if not settings.LLM_EMBEDDING_AUTO_UPDATE:
+        return
+    with _index_refresh_lock:
+        if _index_refresh_pending:
+            return
+        _index_refresh_pending = True
+    threading.Thread(target=refresh_stale_embedding_index, name='embedding-index-refresh', daemon=True).start()
+
+def store_step_cache(analysis: 'WorkflowFileAnalysis', chunks, improved_content: str) -> None:
+    """Salva per ogni step analizzato il sorgente inviato e quello migliorato (upsert in una query)"""
+    try:
+        improved = split_workflow(improved_content)
+    except WorkflowParseError as e:
+        logger.warning("Step migliorati non salvati: %s", e)
+        return
+    
+    improved_steps = {step.key: step for step in improved.steps}
+    added_imports = [statement for statement in improved.imports if statement not in chunks.imports]
+    prompt_hash = analysis_prompt_hash(analysis)
+    entries = [
+        WorkflowStepCache(
+            workflow_file_path=analysis.workflow_file_path,
+            model=analysis.model,
+            prompt_hash=prompt_hash,
+            class_name=step.class_name,
+            step_name=step.name,
+            source_hash=step.source_hash,
+            source=step.source,
+            improved_hash=improved_steps[step.key].source_hash,
+            improved_source=improved_steps[step.key].source,
+            imports=added_imports,
+        )
+        for step in chunks.steps
+        if step.key in improved_steps and step.key not in chunks.reused
+    ]
+    if entries:
+        WorkflowStepCache.objects.bulk_create(
+            entries,
+            update_conflicts=True,
+            unique_fields=['workflow_file_path', 'model', 'prompt_hash', 'source_hash'],
+            update_fields=['class_name', 'step_name', 'source', 'improved_hash', 'improved_source', 'imports', 'updated_at'],
+        )
+        if settings.LLM_FEW_SHOT_ENABLED:
+            transaction.on_commit(schedule_embedding_index_refresh)
+
+def plan_chunked_analysis(analysis: 'WorkflowFileAnalysis'):
+    """
+    Scompone il workflow nei suoi step e sceglie la modalità di analisi.
+    In modalità 'auto' si procede a blocchi oltre LLM_ANALYSIS_CHUNK_MIN_LINES righe
+    o se il workflow ha step già analizzati da riusare; se il file non è
+    analizzabile con ast si torna all'analisi del file intero. Gli step vengono
+    restituiti anche in modalità 'full', per salvarne i risultati (None se il
+    file non è analizzabile).
+    """
+    try:
+        chunks = split_workflow(analysis.workflow_content)
+    except WorkflowParseError as e:
+        logger.info("Workflow non scomponibile in step: %s", e)
+        chunks = None
+    
+    mode = analysis.analysis_mode
+    if chunks is None:
+        if mode == 'chunked':
+            logger.warning("Analisi a blocchi non possibile, uso il file intero")
+        mode = 'full'
+    elif mode == 'auto':
+        lines = analysis.workflow_content.count("\n") + 1
+        if len(chunks.steps) < 2:
+            mode = 'full'
+        elif lines >= settings.LLM_ANALYSIS_CHUNK_MIN_LINES:
+            mode = 'chunked'
+        elif settings.LLM_ANALYSIS_STEP_CACHE and step_cache_queryset(analysis).exists():
+            mode = 'chunked'
+        else:
+            mode = 'full'
+    
+    # Registra la modalità effettivamente usata
+    analysis.analysis_mode = mode
+    if mode == 'chunked' and settings.LLM_ANALYSIS_STEP_CACHE:
+        load_reused_steps(analysis, chunks)
+    return chunks
+
+def start_workflow_file_analysis(analysis: 'WorkflowFileAnalysis', timer: StageTimer):
+    """
+    Prima fase di un'analisi (ORM e file): lettura del workflow, richiesta LLM,
+    modelli da provare e scomposizione in step (vedi plan_chunked_analysis)
+    """
+    logger.info("Iniziando analisi workflow file...")
+    logger.debug("Analisi ID: %s, Path: %s", analysis.id if analysis.id else 'NUOVO', analysis.workflow_file_path)
+    logger.debug("Modello: %s, Provider: %s", analysis.model.name, analysis.model.provider.name)
+    timer.set_labels(provider=analysis.model.provider.name, model=analysis.model.name)
+    
+    analysis.status = 'processing'
+    with timer.stage('db_write'):
+        analysis.save()
+    logger.debug("Status analisi aggiornato a 'processing'")
+    
+    # Leggi il contenuto del file
+    logger.info("Leggendo file: %s", analysis.workflow_file_path)
+    with timer.stage('file_read'):
+        if not os.path.exists(analysis.workflow_file_path):
+            error_msg = f"File non trovato: {analysis.workflow_file_path}"
+            logger.error("%s", error_msg)
+            raise LLMServiceError(error_msg)
         
-        full_user_prompt = "\n".join(user_prompt_parts)
-        logger.debug(f"Prompt completo creato: {len(full_user_prompt)} caratteri")
+        with open(analysis.workflow_file_path, 'r', encoding='utf-8') as f:
+            workflow_content = f.read()
+    
+    logger.debug("Contenuto file letto: %s caratteri", len(workflow_content))
+    analysis.workflow_content = workflow_content
+    
+    with timer.stage('step_planning'):
+        chunks = plan_chunked_analysis(analysis)
+    logger.info("Modalità di analisi: %s", analysis.analysis_mode)
+    with timer.stage('db_write'):
+        analysis.save(update_fields=['workflow_content', 'analysis_mode'])
+    
+    with timer.stage('few_shot'):
+        examples = load_few_shot_examples(analysis, chunks)
+    
+    system_prompt = analysis_system_prompt(analysis)
+    logger.debug("System prompt lunghezza: %s caratteri", len(system_prompt))
+    
+    # Costruisci il prompt completo con istruzioni specifiche per solo codice
+    full_user_prompt = build_analysis_prompt(
+        "Migliora il seguente codice Python di un workflow Metaflow:",
+        workflow_content,
+        analysis.user_prompt,
+        "RICORDA: Rispondi SOLO con il codice Python migliorato, senza commenti o spiegazioni.",
+        examples=examples,
+    )
+    logger.debug("Prompt completo creato: %s caratteri", len(full_user_prompt))
+    
+    # Crea una richiesta LLM temporanea per l'analisi
+    from .models import LLMRequest
+    logger.info("Creando richiesta LLM temporanea...")
+    
+    temp_request = LLMRequest(
+        model=analysis.model,
+        prompt=full_user_prompt,
+        system_message=system_prompt,
+        temperature=0.3  # Temperatura più bassa per analisi più consistenti
+    )
+    temp_request.cacheable_prefix = cacheable_prefix_length(full_user_prompt)
+    logger.debug("Richiesta LLM temporanea creata")
+    
+    return resolve_fallback_chain(temp_request), temp_request, chunks
+
+def build_step_requests(analysis: 'WorkflowFileAnalysis', chunks, temp_request: LLMRequest):
+    """Una richiesta LLM (in memoria) per ogni step, con lo stesso system prompt dell'analisi"""
+    step_requests = []
+    for step in chunks.pending_steps():
+        context = [f"- step della classe {step.class_name}: {', '.join(chunks.step_names(step.class_name))}"]
+        if chunks.imports:
+            context.append(f"- import del modulo: {'; '.join(chunks.imports)}")
         
-        # Crea una richiesta LLM temporanea per l'analisi
-        from .models import LLMRequest
-        logger.info("Creando richiesta LLM temporanea...")
+        step_request = copy.copy(temp_request)
+        step_request.prompt = build_analysis_prompt(
+            f"Migliora il seguente step `{step.name}` della classe Metaflow `{step.class_name}`:",
+            step.source,
+            analysis.user_prompt,
+            f"RICORDA: Rispondi SOLO con il metodo `{step.name}` migliorato, decoratori compresi, "
+            "mantenendo nome, firma e le transizioni self.next(...); eventuali nuovi import vanno "
+            "prima del metodo. Nessun commento o spiegazione.",
+            context=context,
+            examples=chunks.examples.get(step.key),
+        )
+        step_request.cacheable_prefix = cacheable_prefix_length(step_request.prompt)
+        step_requests.append((step, step_request))
+    return step_requests
+
+def merge_step_results(analysis: 'WorkflowFileAnalysis', chunks, outcomes, elapsed_ms: float) -> Dict[str, Any]:
+    """
+    Ricompone il workflow con gli step migliorati e somma i token delle chiamate.
+    Gli step falliti o non validi restano invariati (e vengono elencati in
+    error_message); l'analisi fallisce solo se nessuno step è stato migliorato.
+    """
+    replacements = {key: code for key, (code, _) in chunks.reused.items()}
+    new_imports = [statement for _, imports in chunks.reused.values() for statement in imports]
+    problems = []
+    served = Counter()
+    usage = {'prompt_tokens': 0, 'completion_tokens': 0, 'tokens_used': 0, 'cache_read_tokens': 0}
+    estimated = False
+    
+    for step, result in outcomes:
+        if result.get('served_by'):
+            served[result['served_by']] += 1
+        for key in usage:
+            usage[key] += result.get(key) or 0
+        estimated = estimated or result.get('tokens_estimated', False)
         
-        temp_request = LLMRequest(
+        if result.get('status') != 'completed':
+            problems.append(f"{step.name}: {result.get('error_message')}")
+            continue
+        try:
+            code, imports = parse_step(extract_code(result.get('response', '')), step.name)
+        except WorkflowParseError as e:
+            problems.append(str(e))
+            continue
+        replacements[step.key] = code
+        new_imports.extend(imports)
+    
+    merged = {
+        **usage,
+        'tokens_estimated': estimated,
+        'served_by': served.most_common(1)[0][0] if served else None,
+        'response_time_ms': int(elapsed_ms),
+    }
+    if not replacements:
+        return {**merged, 'status': 'failed', 'error_message': "Nessuno step migliorato: " + "; ".join(problems)}
+    try:
+        response = stitch_workflow(chunks, replacements, new_imports, filename=analysis.workflow_file_path or '<workflow>')
+    except WorkflowParseError as e:
+        return {**merged, 'status': 'failed', 'error_message': str(e)}
+    
+    logger.info("Analisi a blocchi: %s/%s step migliorati (%s riusati)", len(replacements), len(chunks.steps), len(chunks.reused))
+    error_message = ("Step lasciati invariati: " + "; ".join(problems)) if problems else ''
+    return {**merged, 'status': 'completed', 'response': response, 'error_message': error_message}
+
+def generate_coalesced_in_thread(request: LLMRequest, chain: List[LLMModel]) -> Dict[str, Any]:
+    try:
+        return generate_coalesced(request, chain)
+    finally:
+        connections.close_all()
+
+def generate_chunked_analysis(analysis: 'WorkflowFileAnalysis', chunks, temp_request: LLMRequest,
+                              chain: List[LLMModel]) -> Dict[str, Any]:
+    """Analizza gli step in parallelo (thread): il tempo dipende dallo step più lungo, non dal file"""
+    step_requests = build_step_requests(analysis, chunks, temp_request)
+    start = time.perf_counter()
+    outcomes = []
+    if step_requests:
+        workers = min(settings.LLM_ANALYSIS_CHUNK_WORKERS, len(step_requests))
+        with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='llm-step') as executor:
+            futures = [executor.submit(generate_coalesced_in_thread, request, chain) for _, request in step_requests]
+            outcomes = [(step, future.result()) for (step, _), future in zip(step_requests, futures)]
+    return merge_step_results(analysis, chunks, outcomes, (time.perf_counter() - start) * 1000)
+
+async def agenerate_chunked_analysis(analysis: 'WorkflowFileAnalysis', chunks, temp_request: LLMRequest,
+                                     chain: List[LLMModel]) -> Dict[str, Any]:
+    """Versione async di generate_chunked_analysis: le chiamate concorrenti sono limitate da un semaforo"""
+    step_requests = build_step_requests(analysis, chunks, temp_request)
+    semaphore = asyncio.Semaphore(max(settings.LLM_ANALYSIS_CHUNK_WORKERS, 1))
+    
+    async def analyze_step(request):
+        async with semaphore:
+            return await agenerate_coalesced(request, chain)
+    
+    start = time.perf_counter()
+    results = await asyncio.gather(*(analyze_step(request) for _, request in step_requests))
+    outcomes = [(step, result) for (step, _), result in zip(step_requests, results)]
+    return merge_step_results(analysis, chunks, outcomes, (time.perf_counter() - start) * 1000)
+
+def check_analysis_code(analysis: 'WorkflowFileAnalysis', result: Dict[str, Any]) -> Optional[CodeValidationError]:
+    """Estrae il codice dalla risposta (result['code']) e lo valida; restituisce l'errore, se c'è"""
+    result['code'] = extract_code(result.get('response', ''))
+    if not settings.LLM_ANALYSIS_VALIDATION:
+        return None
+    try:
+        validate_workflow_code(result['code'], analysis.workflow_content, analysis.workflow_file_path or '<workflow>')
+    except CodeValidationError as e:
+        return e
+    return None
+
+def lookup_structure_cache(analysis: 'WorkflowFileAnalysis') -> Optional[Dict[str, Any]]:
+    """
+    Risultato di un'analisi precedente di un workflow con la stessa struttura
+    normalizzata, lo stesso modello e lo stesso prompt, con gli identificatori
+    rinominati come nel workflow corrente. None se manca o se il codice
+    rinominato non è valido: l'analisi procede con la chiamata al modello.
+    Calcola analysis.structure, usata da store_structure_cache.
+    """
+    if not settings.LLM_ANALYSIS_STRUCTURE_CACHE:
+        return None
+    started = time.perf_counter()
+    try:
+        analysis.structure = normalize_structure(analysis.workflow_content)
+    except WorkflowParseError as e:
+        logger.info("Struttura del workflow non calcolabile: %s", e)
+        return None
+    
+    cached = WorkflowStructureCache.objects.filter(
+        model=analysis.model,
+        prompt_hash=analysis_prompt_hash(analysis),
+        structure_hash=analysis.structure.hash,
+    ).first()
+    if cached is None:
+        return None
+    
+    try:
+        code = remap_identifiers(cached.improved_source, cached.identifiers, analysis.structure.identifiers)
+    except WorkflowParseError as e:
+        logger.info("Risultato con la stessa struttura non riusabile: %s", e)
+        return None
+    result = {
+        'status': 'completed', 'response': code, 'error_message': '', **SHARED_USAGE,
+        'shared_completion_id': cached.analysis_id, 'structure_reused': True,
+    }
+    error = check_analysis_code(analysis, result)
+    if error is not None:
+        logger.info("Risultato con la stessa struttura non valido: %s", error)
+        return None
+    
+    WorkflowStructureCache.objects.filter(pk=cached.pk).update(hits=F('hits') + 1)
+    logger.info("Risultato riusato da un workflow con la stessa struttura (analisi %s)", cached.analysis_id)
+    result['response_time_ms'] = int((time.perf_counter() - started) * 1000)
+    return result
+
+def store_structure_cache(analysis: 'WorkflowFileAnalysis', improved_content: str) -> None:
+    """Salva il risultato per i workflow con la stessa struttura (solo analisi complete con chiamata al modello)"""
+    if analysis.structure is None or analysis.shared_completion_id or analysis.error_message:
+        return
+    WorkflowStructureCache.objects.bulk_create(
+        [WorkflowStructureCache(
             model=analysis.model,
-            prompt=full_user_prompt,
-            system_message=system_prompt,
-            temperature=0.3  # Temperatura più bassa per analisi più consistenti
-        )
-        logger.debug("Richiesta LLM temporanea creata")
+            prompt_hash=analysis_prompt_hash(analysis),
+            structure_hash=analysis.structure.hash,
+            identifiers=analysis.structure.identifiers,
+            improved_source=improved_content,
+            # Le analisi rapide non salvate non possono essere referenziate
+            analysis=None if analysis._state.adding else analysis,
+        )],
+        update_conflicts=True,
+        unique_fields=['model', 'prompt_hash', 'structure_hash'],
+        update_fields=['identifiers', 'improved_source', 'analysis', 'updated_at'],
+    )
+
+def build_repair_request(analysis: 'WorkflowFileAnalysis', temp_request: LLMRequest, code: str,
+                         error: CodeValidationError) -> LLMRequest:
+    repair_request = copy.copy(temp_request)
+    repair_request.prompt = build_analysis_prompt(
+        "Il seguente codice Python di un workflow Metaflow non supera la validazione:",
+        code,
+        analysis.user_prompt,
+        "RICORDA: Correggi i problemi indicati e rispondi SOLO con il codice Python completo, "
+        "senza commenti o spiegazioni.",
+        context=[f"- {problem}" for problem in error.problems],
+        context_title="Problemi rilevati:",
+    )
+    repair_request.cacheable_prefix = cacheable_prefix_length(repair_request.prompt)
+    return repair_request
+
+def combine_attempts(result: Dict[str, Any], repair_result: Dict[str, Any]) -> Dict[str, Any]:
+    """Risultato della correzione, con token e tempi sommati a quelli della prima risposta"""
+    combined = dict(repair_result)
+    for key in ('prompt_tokens', 'completion_tokens', 'tokens_used', 'cache_read_tokens', 'response_time_ms'):
+        combined[key] = (result.get(key) or 0) + (repair_result.get(key) or 0)
+    combined['tokens_estimated'] = result.get('tokens_estimated', False) or repair_result.get('tokens_estimated', False)
+    combined['served_by'] = repair_result.get('served_by') or result.get('served_by')
+    return combined
+
+def repair_attempts(analysis: 'WorkflowFileAnalysis') -> int:
+    # Le analisi a blocchi hanno già scartato gli step non validi: riscrivere l'intero file
+    # annullerebbe il vantaggio di inviare al modello solo gli step
+    return 0 if analysis.analysis_mode == 'chunked' else settings.LLM_ANALYSIS_REPAIR_ATTEMPTS
+
+def rejected_result(result: Dict[str, Any], error: CodeValidationError) -> Dict[str, Any]:
+    logger.error("Codice non valido, file non modificato: %s", error)
+    return {**result, 'status': 'failed', 'error_message': f"Codice non valido, file non modificato: {error}"}
+
+def validate_analysis_result(analysis: 'WorkflowFileAnalysis', result: Dict[str, Any], temp_request: LLMRequest,
+                             chain: List[LLMModel], timer: StageTimer) -> Dict[str, Any]:
+    """
+    Valida il codice della risposta prima di qualunque scrittura: se non è valido
+    chiede al modello una correzione (LLM_ANALYSIS_REPAIR_ATTEMPTS), altrimenti
+    l'analisi fallisce senza toccare il file né deployarlo
+    """
+    if result.get('status') != 'completed' or not result.get('response'):
+        return result
+    
+    with timer.stage('validation'):
+        error = check_analysis_code(analysis, result)
+    for _ in range(repair_attempts(analysis)):
+        if error is None:
+            break
+        logger.warning("Codice non valido (%s): richiesta di correzione al modello", error)
+        with timer.stage('repair'):
+            repair_result = generate_coalesced(build_repair_request(analysis, temp_request, result['code'], error), chain)
+        result = combine_attempts(result, repair_result)
+        if result.get('status') != 'completed':
+            return result
+        with timer.stage('validation'):
+            error = check_analysis_code(analysis, result)
+    
+    return rejected_result(result, error) if error else result
+
+async def avalidate_analysis_result(analysis: 'WorkflowFileAnalysis', result: Dict[str, Any], temp_request: LLMRequest,
+                                    chain: List[LLMModel], timer: StageTimer) -> Dict[str, Any]:
+    """Versione async di validate_analysis_result"""
+    if result.get('status') != 'completed' or not result.get('response'):
+        return result
+    
+    with timer.stage('validation'):
+        error = check_analysis_code(analysis, result)
+    for _ in range(repair_attempts(analysis)):
+        if error is None:
+            break
+        logger.warning("Codice non valido (%s): richiesta di correzione al modello", error)
+        with timer.stage('repair'):
+            repair_result = await agenerate_coalesced(build_repair_request(analysis, temp_request, result['code'], error), chain)
+        result = combine_attempts(result, repair_result)
+        if result.get('status') != 'completed':
+            return result
+        with timer.stage('validation'):
+            error = check_analysis_code(analysis, result)
+    
+    return rejected_result(result, error) if error else result
+
+def finish_workflow_file_analysis(analysis: 'WorkflowFileAnalysis', result: Dict[str, Any], timer: StageTimer,
+                                  chunks=None) -> 'WorkflowFileAnalysis':
+    """Ultima fase di un'analisi: salvataggio del risultato, riscrittura del file ed eventuale deploy"""
+    # Aggiorna l'analisi con il risultato
+    logger.debug("Aggiornando analisi con risultato: status=%s", result.get('status'))
+    analysis.analysis_response = result.get('response', '')
+    analysis.status = result.get('status', 'failed')
+    analysis.error_message = result.get('error_message', '')
+    analysis.tokens_used = result.get('tokens_used')
+    analysis.prompt_tokens = result.get('prompt_tokens')
+    analysis.completion_tokens = result.get('completion_tokens')
+    analysis.cache_read_tokens = result.get('cache_read_tokens')
+    analysis.tokens_estimated = result.get('tokens_estimated', False)
+    analysis.served_by = result.get('served_by')
+    analysis.shared_completion_id = result.get('shared_completion_id')
+    billed_model = analysis.served_by or analysis.model
+    analysis.cost = billed_model.compute_cost(
+        analysis.prompt_tokens, analysis.completion_tokens, analysis.cache_read_tokens
+    ) if analysis.tokens_used else None
+    analysis.response_time_ms = result.get('response_time_ms')
+    
+    if analysis.status == 'completed' and analysis.analysis_response:
+        analysis.completed_at = timezone.now()
+        logger.info("Analisi completata con successo")
         
-        # Ottieni il servizio appropriato
-        logger.info(f"Ottenendo servizio per provider: {analysis.model.provider.name}")
-        service = LLMServiceFactory.get_service(analysis.model.provider.name)
+        # Pulisci la risposta rimuovendo eventuali markdown code blocks
+        logger.debug("Pulendo risposta da markdown...")
+        with timer.stage('clean_response'):
+            # Codice già estratto (e validato) da validate_analysis_result
+            cleaned_response = result.get('code') or extract_code(analysis.analysis_response)
+        logger.debug("Pulizia completata: %s -> %s caratteri", len(analysis.analysis_response), len(cleaned_response))
         
-        # Genera la risposta
-        logger.info("Generando risposta analisi...")
-        result = service.generate_response(temp_request)
-        
-        # Aggiorna l'analisi con il risultato
-        logger.debug(f"Aggiornando analisi con risultato: status={result.get('status')}")
-        analysis.analysis_response = result.get('response', '')
-        analysis.status = result.get('status', 'failed')
-        analysis.error_message = result.get('error_message', '')
-        analysis.tokens_used = result.get('tokens_used')
-        analysis.response_time_ms = result.get('response_time_ms')
-        
-        if analysis.status == 'completed' and analysis.analysis_response:
-            analysis.completed_at = timezone.now()
-            logger.info("Analisi completata con successo")
-            
-            # Pulisci la risposta rimuovendo eventuali markdown code blocks
-            logger.debug("Pulendo risposta da markdown...")
-            cleaned_response = analysis.analysis_response.strip()
-            original_length = len(cleaned_response)
-            
-            if cleaned_response.startswith('```python'):
-                cleaned_response = cleaned_response[9:]  # Rimuovi ```python
-                logger.debug("Rimosso ```python iniziale")
-            if cleaned_response.startswith('```'):
-                cleaned_response = cleaned_response[3:]   # Rimuovi ```
-                logger.debug("Rimosso ``` iniziale")
-            if cleaned_response.endswith('```'):
-                cleaned_response = cleaned_response[:-3]  # Rimuovi ``` finale
-                logger.debug("Rimosso ``` finale")
+        # Sovrascrivi il file originale con il codice migliorato
+        try:
+            logger.info("Sovrascrivendo file originale: %s", analysis.workflow_file_path)
+            with timer.stage('file_write'):
+                with open(analysis.workflow_file_path, 'w', encoding='utf-8') as f:
+                    f.write(cleaned_response)
             
-            cleaned_response = cleaned_response.strip()
-            logger.debug(f"Pulizia completata: {original_length} -> {len(cleaned_response)} caratteri")
+            # Aggiorna il campo workflow_content con il nuovo contenuto
+            analysis.workflow_content = cleaned_response
+            logger.info("File sovrascritto con successo")
             
-            # Sovrascrivi il file originale con il codice migliorato
+            # Step migliorati, per rianalizzare in seguito solo quelli modificati.
+            # Le cache sono un'ottimizzazione: un loro errore non fa fallire l'analisi
             try:
-                logger.info(f"Sovrascrivendo file originale: {analysis.workflow_file_path}")
-                with open(analysis.workflow_file_path, 'w', encoding='utf-8') as f:
-                    f.write(cleaned_response)
-                
-                # Aggiorna il campo workflow_content con il nuovo contenuto
-                analysis.workflow_content = cleaned_response
-                logger.info("File sovrascritto con successo")
-                
-                # DEPLOYMENT AUTOMATICO DEL FILE FINALE
+                with timer.stage('db_write'), transaction.atomic():
+                    if chunks is not None and settings.LLM_ANALYSIS_STEP_CACHE:
+                        store_step_cache(analysis, chunks, cleaned_response)
+                    if settings.LLM_ANALYSIS_STRUCTURE_CACHE and not result.get('structure_reused'):
+                        store_structure_cache(analysis, cleaned_response)
+            except Exception as cache_error:
+                logger.warning("Cache dell'analisi non aggiornata (file comunque aggiornato): %s", cache_error)
+            
+            # DEPLOYMENT AUTOMATICO DEL FILE FINALE
+            if not settings.LLM_ANALYSIS_AUTO_DEPLOY:
+                logger.info("Deploy automatico disabilitato (LLM_ANALYSIS_AUTO_DEPLOY)")
+            else:
                 try:
                     logger.info("Iniziando deployment del file migliorato...")
-                    from ..ssh_deployment.services import deploy_workflow_to_ml_runner, deploy_workflow_to_ml_runner_with_folder
-                    
-                    # Estrai il workflow_id dal path
-                    workflow_id = None
-                    try:
-                        # Il path dovrebbe essere: {BASE_DIR}/src/generated_workflows/{workflow_id}/{file_name}
-                        # Normalizziamo il path per Windows
-                        normalized_path = os.path.normpath(analysis.workflow_file_path)
-                        path_parts = normalized_path.split(os.sep)
-                        
-                        if 'generated_workflows' in path_parts:
-                            workflow_idx = path_parts.index('generated_workflows')
-                            if len(path_parts) > workflow_idx + 1:
-                                workflow_id = path_parts[workflow_idx + 1]
-                                logger.info(f"Workflow ID estratto: {workflow_id}")
-                        
-                        # Fallback: cerca pattern UUID nel path
-                        if not workflow_id:
-                            import re
-                            uuid_pattern = r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
-                            for part in path_parts:
-                                if re.match(uuid_pattern, part, re.IGNORECASE):
-                                    workflow_id = part
-                                    logger.info(f"Workflow ID trovato tramite UUID pattern: {workflow_id}")
-                                    break
-                                    
-                    except Exception as extract_error:
-                        logger.warning(f"Impossibile estrarre workflow ID: {extract_error}")
-                        logger.debug(f"Path analizzato: {analysis.workflow_file_path}")
-                    
-                    # Nome del file
-                    file_name = os.path.basename(analysis.workflow_file_path)
-                    
-                    # Se abbiamo un workflow_id, crea una cartella specifica
-                    if workflow_id:
-                        # Deployment con cartella workflow_id
-                        deployment = deploy_workflow_to_ml_runner_with_folder(
-                            file_content=cleaned_response,
-                            file_name=file_name,
-                            workflow_id=workflow_id
-                        )
-                        
-                        logger.info(f"File deployato in cartella: {workflow_id}/{file_name}")
-                        logger.info(f"Path Jupyter: {workflow_id}/{file_name}")
-                    else:
-                        # Deployment normale
-                        deployment = deploy_workflow_to_ml_runner(
-                            file_content=cleaned_response,
-                            file_name=file_name,
-                            workflow_id=workflow_id
-                        )
-                        logger.info(f"File deployato: {file_name}")
-                    
-                    logger.info(f"Status deployment: {deployment.status}")
-                    
+                    with timer.stage('deploy'):
+                        deploy_improved_workflow(analysis.workflow_file_path, cleaned_response)
                 except Exception as deployment_error:
-                    logger.error(f"Errore nel deployment (file comunque aggiornato): {str(deployment_error)}")
-                
-            except Exception as file_error:
-                error_msg = f"Errore nella scrittura del file: {str(file_error)}"
-                logger.error(f"{error_msg}")
-                analysis.error_message = error_msg
-                analysis.status = 'failed'
-        else:
-            logger.warning(f"Analisi non completata correttamente: {analysis.error_message}")
-        
+                    logger.error("Errore nel deployment (file comunque aggiornato): %s", deployment_error)
+            
+        except Exception as file_error:
+            error_msg = f"Errore nella scrittura del file: {str(file_error)}"
+            logger.error("%s", error_msg)
+            analysis.error_message = error_msg
+            analysis.status = 'failed'
+    else:
+        logger.warning("Analisi non completata correttamente: %s", analysis.error_message)
+    
+    if settings.METRICS_STORE_STAGE_TIMINGS:
+        analysis.stage_timings = timer.as_dict()
+    
+    with timer.stage('db_write'):
         analysis.save()
-        logger.debug("Analisi salvata nel database")
-        return analysis
+    logger.debug("Analisi salvata nel database")
+    # Con lo stato definitivo (scrittura del file compresa). Anche le analisi
+    # rapide (non salvate) consumano token: vanno negli aggregati
+    record_llm_usage(analysis)
+    analysis.usage_recorded = True
+    timer.finish(analysis.status)
+    return analysis
+
+def fail_workflow_file_analysis(analysis: 'WorkflowFileAnalysis', error: Exception, timer: StageTimer) -> 'WorkflowFileAnalysis':
+    logger.error("Errore durante l'analisi workflow: %s", error)
+    analysis.status = 'failed'
+    analysis.error_message = str(error)
+    # Prima del salvataggio: l'errore può venire proprio dal database
+    record_llm_failure(analysis)
+    analysis.save()
+    timer.finish(analysis.status)
+    return analysis
+
+def process_workflow_file_analysis(analysis: 'WorkflowFileAnalysis', timer: Optional[StageTimer] = None) -> 'WorkflowFileAnalysis':
+    """Processa un'analisi di file workflow tramite LLM"""
+    if timer is None:
+        timer = StageTimer('workflow_analysis')
+    
+    try:
+        chain, temp_request, chunks = start_workflow_file_analysis(analysis, timer)
+        with timer.stage('structure_cache'):
+            result = lookup_structure_cache(analysis)
+        
+        # Genera la risposta
+        if result is None:
+            logger.info("Generando risposta analisi...")
+            with timer.stage('llm_call'):
+                if analysis.analysis_mode == 'chunked':
+                    result = generate_chunked_analysis(analysis, chunks, temp_request, chain)
+                else:
+                    result = generate_coalesced(temp_request, chain, owner=analysis)
+        
+        result = validate_analysis_result(analysis, result, temp_request, chain, timer)
+        return finish_workflow_file_analysis(analysis, result, timer, chunks)
         
     except Exception as e:
-        logger.error(f"Errore durante l'analisi workflow: {str(e)}")
-        analysis.status = 'failed'
-        analysis.error_message = str(e)
-        analysis.save()
-        return analysis
+        return fail_workflow_file_analysis(analysis, e, timer)
+
+async def aprocess_workflow_file_analysis(analysis: 'WorkflowFileAnalysis', timer: Optional[StageTimer] = None) -> 'WorkflowFileAnalysis':
+    """Versione async di process_workflow_file_analysis per le view ASGI"""
+    if timer is None:
+        timer = StageTimer('workflow_analysis')
+    
+    try:
+        chain, temp_request, chunks = await sync_to_async(start_workflow_file_analysis)(analysis, timer)
+        with timer.stage('structure_cache'):
+            result = await sync_to_async(lookup_structure_cache)(analysis)
+        
+        if result is None:
+            logger.info("Generando risposta analisi (async)...")
+            with timer.stage('llm_call'):
+                if analysis.analysis_mode == 'chunked':
+                    result = await agenerate_chunked_analysis(analysis, chunks, temp_request, chain)
+                else:
+                    result = await agenerate_coalesced(temp_request, chain, owner=analysis)
+        
+        result = await avalidate_analysis_result(analysis, result, temp_request, chain, timer)
+        return await sync_to_async(finish_workflow_file_analysis)(analysis, result, timer, chunks)
+        
+    except Exception as e:
+        return await sync_to_async(fail_workflow_file_analysis)(analysis, e, timer)
@@ -0,0 +1,13 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .catalog import invalidate_catalog
+from .models import LLMModel, LLMModelFallback, LLMProvider
+
+
+@receiver([post_save, post_delete], sender=LLMProvider)
+@receiver([post_save, post_delete], sender=LLMModel)
+@receiver([post_save, post_delete], sender=LLMModelFallback)
+def catalog_changed(sender, **kwargs):
+    """Provider, modelli e fallback modificati: il catalogo in memoria va ricaricato"""
+    invalidate_catalog()
@@ -1,3 +1,538 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, Client, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from src.apps.common.retention import delete_rows, strip_text
+
+from . import async_views, catalog, services
+from .archive import archive_conversation, rehydrate_conversation
+from .benchmarking import ensure_mock_model
+from .catalog import get_catalog, invalidate_catalog
+from .circuit_breaker import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, allow_model, model_breakers, record_model_outcome
+)
+from .management.commands.purge_history import POLICIES
+from .models import ConversationArchive, ConversationMessage, LLMConversation, LLMModel, LLMRequest, LLMResultOutbox
+from .workflow_ast import WorkflowParseError, normalize_structure, remap_identifiers
+
+WORKFLOW = '''
+from metaflow import FlowSpec, step
+
+
+class TrainFlow(FlowSpec):
+    """Addestra il modello"""
+
+    @step
+    def start(self):
+        self.rows = load_rows("data.csv")
+        self.next(self.train)
+
+    @step
+    def train(self):
+        total = len(self.rows)
+        self.score = total * 2
+        self.next(self.end)
+
+    @step
+    def end(self):
+        print(self.score)
+'''
+
+RENAMED = '''
+from metaflow import FlowSpec, step
+
+
+class ScoreFlow(FlowSpec):
+    # commento diverso, stessa struttura
+
+    @step
+    def start(self):
+        self.items = load_rows("data.csv")
+        self.next(self.fit)
+
+    @step
+    def fit(self):
+        count = len(self.items)
+        self.result = count * 2
+        self.next(self.end)
+
+    @step
+    def end(self):
+        print(self.result)
+'''
+
+
+class NormalizeStructureTests(SimpleTestCase):
+    """Hash strutturale usato da WorkflowStructureCache per riusare un'analisi"""
+
+    def test_renamed_identifiers_share_hash(self):
+        original = normalize_structure(WORKFLOW)
+        renamed = normalize_structure(RENAMED)
+        self.assertEqual(original.hash, renamed.hash)
+        self.assertEqual(len(original.identifiers), len(renamed.identifiers))
+        self.assertIn('TrainFlow', original.identifiers)
+        self.assertIn('ScoreFlow', renamed.identifiers)
+        # I nomi esterni (Metaflow, builtin) non sono identificatori da rinominare
+        self.assertNotIn('FlowSpec', original.identifiers)
+        self.assertNotIn('len', original.identifiers)
+
+    def test_constants_change_hash(self):
+        original = normalize_structure(WORKFLOW)
+        self.assertNotEqual(original.hash, normalize_structure(WORKFLOW.replace('total * 2', 'total * 3')).hash)
+        self.assertNotEqual(original.hash, normalize_structure(WORKFLOW.replace('"data.csv"', '"test.csv"')).hash)
+
+    def test_external_names_change_hash(self):
+        self.assertNotEqual(
+            normalize_structure(WORKFLOW).hash,
+            normalize_structure(WORKFLOW.replace('len(self.rows)', 'sum(self.rows)')).hash,
+        )
+
+    def test_unparsable_source(self):
+        with self.assertRaises(WorkflowParseError):
+            normalize_structure('def broken(:\n')
+
+
+class RemapIdentifiersTests(SimpleTestCase):
+    """Adattamento del codice migliorato di un workflow a un altro con la stessa struttura"""
+
+    def test_remap_renamed_workflow(self):
+        original = normalize_structure(WORKFLOW)
+        renamed = normalize_structure(RENAMED)
+        improved = WORKFLOW.replace('total * 2', 'total * 2  # migliorato')
+
+        code = remap_identifiers(improved, original.identifiers, renamed.identifiers)
+
+        self.assertEqual(code, RENAMED.replace('count * 2', 'count * 2  # migliorato').replace(
+            '    # commento diverso, stessa struttura\n', '    """Addestra il modello"""\n'
+        ))
+        self.assertEqual(normalize_structure(code).hash, renamed.hash)
+
+    def test_swap_cycle(self):
+        code = 'def first(a, b):\n    return a - b\n'
+        self.assertEqual(
+            remap_identifiers(code, ['first', 'a', 'b'], ['first', 'b', 'a']),
+            'def first(b, a):\n    return b - a\n',
+        )
+
+    def test_identical_identifiers_leave_code_untouched(self):
+        code = 'x = 1\n'
+        self.assertIs(remap_identifiers(code, ['x'], ['x']), code)
+
+    def test_rejects_new_name_colliding_with_target(self):
+        # Il modello ha introdotto 'count', che è il nome in cui 'total' va rinominato
+        improved = 'def train(rows):\n    total = len(rows)\n    count = 0\n    return total + count\n'
+        with self.assertRaises(WorkflowParseError):
+            remap_identifiers(improved, ['train', 'rows', 'total'], ['fit', 'items', 'count'])
+
+    def test_rejects_identifier_inside_string(self):
+        improved = 'def train(rows):\n    print("train done")\n    return rows\n'
+        with self.assertRaises(WorkflowParseError):
+            remap_identifiers(improved, ['train', 'rows'], ['fit', 'items'])
+
+    def test_substring_in_string_is_allowed(self):
+        improved = 'def train(rows):\n    print("training done")\n    return rows\n'
+        self.assertEqual(
+            remap_identifiers(improved, ['train', 'rows'], ['fit', 'items']),
+            'def fit(items):\n    print("training done")\n    return items\n',
+        )
+
+    def test_rejects_mismatched_identifiers(self):
+        with self.assertRaises(WorkflowParseError):
+            remap_identifiers('x = 1\n', ['x'], ['y', 'z'])
+
+
+@override_settings(LLM_OUTBOX_MAX_ATTEMPTS=3, LLM_OUTBOX_RETRY_BACKOFF_S=10)
+class LLMResultOutboxTests(TestCase):
+    """Applicazione dei risultati accodati: backoff e voci morte"""
+
+    def setUp(self):
+        self.model = ensure_mock_model()
+
+    def enqueue(self, response='ok'):
+        request = LLMRequest.objects.create(model=self.model, prompt='ciao', status='processing')
+        request.status = 'completed'
+        request.response = response
+        request.completed_at = timezone.now()
+        return request, services.enqueue_llm_result(request)
+
+    def make_due(self, entry):
+        LLMResultOutbox.objects.filter(pk=entry.pk).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+
+    def test_applies_result(self):
+        request, entry = self.enqueue()
+        self.assertEqual(services.apply_llm_result_outbox(), 1)
+        request.refresh_from_db()
+        entry.refresh_from_db()
+        self.assertEqual((request.status, request.response), ('completed', 'ok'))
+        self.assertIsNotNone(entry.applied_at)
+
+    def test_failed_entry_backs_off_without_blocking_newer_ones(self):
+        poison, poison_entry = self.enqueue()
+        with mock.patch.object(services, 'persist_llm_result', side_effect=RuntimeError('boom')):
+            self.assertEqual(services.apply_llm_result_outbox(), 0)
+        poison_entry.refresh_from_db()
+        self.assertEqual(poison_entry.attempts, 1)
+        self.assertEqual(poison_entry.last_error, 'boom')
+        self.assertGreater(poison_entry.next_attempt_at, timezone.now() + timedelta(seconds=5))
+
+        request, entry = self.enqueue(response='nuova')
+        self.assertEqual(services.apply_llm_result_outbox(), 1)
+        entry.refresh_from_db()
+        poison_entry.refresh_from_db()
+        self.assertIsNotNone(entry.applied_at)
+        # Non ancora scaduta: non viene ritentata
+        self.assertEqual(poison_entry.attempts, 1)
+        self.assertIsNone(poison_entry.applied_at)
+
+    def test_backoff_doubles(self):
+        self.assertEqual(services.outbox_retry_delay(1), timedelta(seconds=10))
+        self.assertEqual(services.outbox_retry_delay(3), timedelta(seconds=40))
+
+    def test_entry_dies_after_max_attempts(self):
+        request, entry = self.enqueue()
+        with mock.patch.object(services, 'persist_llm_result', side_effect=RuntimeError('boom')):
+            for _ in range(3):
+                self.make_due(entry)
+                services.apply_llm_result_outbox()
+        entry.refresh_from_db()
+        self.assertEqual(entry.attempts, 3)
+        self.assertIsNotNone(entry.dead_at)
+
+        # Una voce morta non viene più presa, nemmeno se scaduta
+        self.make_due(entry)
+        self.assertEqual(services.apply_llm_result_outbox(), 0)
+        entry.refresh_from_db()
+        self.assertEqual(entry.attempts, 3)
+
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHE, LLM_BREAKER_ENABLED=True, LLM_BREAKER_MIN_CALLS=3,
+    LLM_BREAKER_ERROR_RATE=0.5, LLM_BREAKER_SLOW_RATE=1.0, LLM_BREAKER_OPEN_S=60,
+)
+class CircuitBreakerTests(TestCase):
+    """Transizioni chiuso -> aperto -> half-open -> chiuso/aperto"""
+
+    def setUp(self):
+        cache.clear()
+        self.model = ensure_mock_model()
+        self.breaker = CircuitBreaker.for_model(self.model)
+
+    def open_breaker(self):
+        """Errori sul modello: si aprono i circuiti del modello e del suo provider"""
+        for _ in range(3):
+            record_model_outcome(self.model, success=False, latency_ms=10)
+
+    def expire(self, breaker):
+        """Simula la fine dell'apertura: il circuito passa a half-open"""
+        state = cache.get(breaker.key('state'))
+        cache.set(breaker.key('state'), {**state, 'open_until': time.time() - 1}, timeout=None)
+
+    def test_opens_on_error_rate(self):
+        record_model_outcome(self.model, success=False, latency_ms=10)
+        record_model_outcome(self.model, success=True, latency_ms=10)
+        self.assertEqual(self.breaker.status()['state'], CLOSED)
+        record_model_outcome(self.model, success=False, latency_ms=10)
+        self.assertEqual(self.breaker.status()['state'], OPEN)
+        self.assertFalse(allow_model(self.model))
+
+    def test_half_open_allows_a_single_probe(self):
+        self.open_breaker()
+        for breaker in model_breakers(self.model):
+            self.expire(breaker)
+        self.assertEqual(self.breaker.status()['state'], HALF_OPEN)
+        self.assertTrue(allow_model(self.model))
+        self.assertFalse(allow_model(self.model))
+
+    def test_successful_probe_closes(self):
+        self.open_breaker()
+        for breaker in model_breakers(self.model):
+            self.expire(breaker)
+        self.assertTrue(allow_model(self.model))
+        record_model_outcome(self.model, success=True, latency_ms=10)
+        status = self.breaker.status()
+        self.assertEqual(status['state'], CLOSED)
+        # La finestra viene azzerata: gli errori precedenti non lo riaprono
+        self.assertEqual(status['calls'], 0)
+        self.assertTrue(allow_model(self.model))
+
+    def test_failed_probe_reopens(self):
+        self.open_breaker()
+        for breaker in model_breakers(self.model):
+            self.expire(breaker)
+        self.assertTrue(allow_model(self.model))
+        record_model_outcome(self.model, success=False, latency_ms=10)
+        self.assertEqual(self.breaker.status()['state'], OPEN)
+        self.assertFalse(allow_model(self.model))
+
+    def test_open_breaker_keeps_half_open_probe_free(self):
+        provider_breaker = CircuitBreaker.for_provider(self.model.provider.name)
+        provider_breaker.open(time.time())
+        self.expire(provider_breaker)
+        self.breaker.open(time.time())
+        self.assertFalse(allow_model(self.model))
+        self.assertIsNone(cache.get(provider_breaker.key('probe')))
+
+    def test_non_retryable_errors_do_not_open(self):
+        request = LLMRequest(model=self.model, prompt='ciao')
+        with override_settings(MOCK_LLM_ENABLED=True, MOCK_LLM_LATENCY_MS=0), \
+                mock.patch.object(services.MockLLMService, 'call', side_effect=ValueError('prompt non valido')):
+            for _ in range(5):
+                result = services.call_model(request, self.model)
+        self.assertFalse(result['retryable'])
+        self.assertEqual(self.breaker.status()['state'], CLOSED)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CatalogETagTests(TestCase):
+    """Endpoint di provider e modelli serviti dal catalogo in memoria, con ETag"""
+
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_catalog()
+        self.client = Client(HTTP_HOST='localhost')
+        self.model = LLMModel.objects.filter(is_active=True, provider__is_active=True).first()
+
+    def test_unchanged_catalog_returns_304(self):
+        response = self.client.get('/api/llm/models/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        response = self.client.get('/api/llm/models/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_model_save_changes_etag(self):
+        etag = self.client.get(f'/api/llm/models/{self.model.pk}/')['ETag']
+
+        self.model.display_name = 'Nome aggiornato'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.model.save()
+
+        response = self.client.get(f'/api/llm/models/{self.model.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['display_name'], 'Nome aggiornato')
+
+    def test_deactivated_model_leaves_list(self):
+        self.model.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.model.save()
+
+        self.assertEqual(self.client.get(f'/api/llm/models/{self.model.pk}/').status_code, 404)
+        response = self.client.get('/api/llm/models/')
+        results = response.json()
+        results = results['results'] if isinstance(results, dict) else results
+        self.assertNotIn(self.model.pk, [item['id'] for item in results])
+
+
+@override_settings(CACHES=LOCMEM_CACHE, MOCK_LLM_ENABLED=True, MOCK_LLM_LATENCY_MS=0)
+class IdempotencyTests(TestCase):
+    """Header Idempotency-Key sulle action DRF sincrone e sulle view async"""
+    url = '/api/llm/requests/quick_request/'
+
+    def setUp(self):
+        cache.clear()
+        self.model = ensure_mock_model()
+        self.client = Client(HTTP_HOST='localhost')
+        self.body = {'model': self.model.pk, 'prompt': 'ciao'}
+
+    def post(self, body, key):
+        return self.client.post(self.url, body, content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+
+    async def apost(self, body, key):
+        request = AsyncRequestFactory().post(
+            self.url, json.dumps(body), content_type='application/json', headers={'Idempotency-Key': key}
+        )
+        return await async_views.quick_request(request)
+
+    def test_replays_saved_response(self):
+        first = self.post(self.body, 'chiave-1')
+        second = self.post(self.body, 'chiave-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.json()['id'], first.json()['id'])
+        self.assertEqual(LLMRequest.objects.count(), 1)
+
+    def test_different_body_is_rejected(self):
+        self.post(self.body, 'chiave-1')
+        response = self.post({**self.body, 'prompt': 'altro'}, 'chiave-1')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(LLMRequest.objects.count(), 1)
+
+    def test_without_key_every_post_runs(self):
+        self.client.post(self.url, self.body, content_type='application/json')
+        self.client.post(self.url, self.body, content_type='application/json')
+        self.assertEqual(LLMRequest.objects.count(), 2)
+
+    async def test_async_replays_saved_response(self):
+        first = await self.apost(self.body, 'chiave-async')
+        second = await self.apost(self.body, 'chiave-async')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(json.loads(second.content)['id'], json.loads(first.content)['id'])
+        self.assertEqual(await LLMRequest.objects.acount(), 1)
+
+    async def test_async_different_body_is_rejected(self):
+        await self.apost(self.body, 'chiave-async')
+        response = await self.apost({**self.body, 'prompt': 'altro'}, 'chiave-async')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(await LLMRequest.objects.acount(), 1)
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHE, LLM_COALESCING=True, LLM_COALESCE_POLL_MS=10, LLM_BREAKER_ENABLED=False,
+    MOCK_LLM_ENABLED=True, MOCK_LLM_LATENCY_MS=300, MOCK_LLM_LATENCY_DISTRIBUTION='fixed',
+)
+class CoalescingTests(TestCase):
+    """Richieste identiche in corso: una sola chiamata al provider"""
+
+    def setUp(self):
+        cache.clear()
+        self.model = ensure_mock_model()
+        get_catalog(force_check=True)
+        self.calls = []
+        call, acall = services.MockLLMService.call, services.MockLLMService.acall
+
+        def counting_call(service, payload):
+            self.calls.append(payload['prompt'])
+            return call(service, payload)
+
+        async def counting_acall(service, payload):
+            self.calls.append(payload['prompt'])
+            return await acall(service, payload)
+
+        for name, replacement in (('call', counting_call), ('acall', counting_acall)):
+            patcher = mock.patch.object(services.MockLLMService, name, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def new_request(self, prompt='riassumi'):
+        return LLMRequest(model=self.model, prompt=prompt)
+
+    def test_follower_gets_leader_result(self):
+        results = {}
+        leader = threading.Thread(
+            target=lambda: results.setdefault('leader', services.generate_coalesced(self.new_request(), [self.model]))
+        )
+        leader.start()
+        time.sleep(0.05)
+        follower = services.generate_coalesced(self.new_request('riassumi  \n'), [self.model])
+        leader.join()
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(follower['status'], 'completed')
+        self.assertEqual(follower['response'], results['leader']['response'])
+        self.assertEqual(follower['served_by'].pk, self.model.pk)
+        # Token e costo restano sulla richiesta che ha chiamato il provider
+        self.assertEqual(follower['tokens_used'], 0)
+        self.assertIsInstance(follower['response_time_ms'], int)
+
+    def test_different_prompts_are_not_shared(self):
+        leader = threading.Thread(target=services.generate_coalesced, args=(self.new_request(), [self.model]))
+        leader.start()
+        time.sleep(0.05)
+        services.generate_coalesced(self.new_request('altro'), [self.model])
+        leader.join()
+        self.assertEqual(len(self.calls), 2)
+
+    async def test_async_follower_with_cold_catalog(self):
+        async def follow():
+            await asyncio.sleep(0.05)
+            # Catalogo da ricaricare: il follower non deve interrogare il database nell'event loop
+            catalog._catalog = None
+            return await services.agenerate_coalesced(self.new_request(), [self.model])
+
+        leader, follower = await asyncio.gather(
+            services.agenerate_coalesced(self.new_request(), [self.model]), follow()
+        )
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(follower['response'], leader['response'])
+        self.assertEqual(follower['served_by'].pk, self.model.pk)
+
+
+class ConversationArchiveTests(TestCase):
+    """Archiviazione compressa dei messaggi e ripristino prima di una nuova scrittura"""
+
+    def setUp(self):
+        self.conversation = LLMConversation.objects.create(title='Archivio')
+        start = timezone.now() - timedelta(days=60)
+        for i, role in enumerate(['user', 'assistant', 'user']):
+            message = ConversationMessage.objects.create(conversation=self.conversation, role=role, content=f'messaggio {i} è qui')
+            ConversationMessage.objects.filter(pk=message.pk).update(created_at=start + timedelta(minutes=i))
+        LLMConversation.objects.filter(pk=self.conversation.pk).update(updated_at=start, message_count=3)
+        self.original = self.snapshot(self.conversation.messages.order_by('created_at'))
+
+    def snapshot(self, messages):
+        return [(str(m.id), m.role, m.content, m.created_at) for m in messages]
+
+    def test_roundtrip(self):
+        self.assertTrue(archive_conversation(self.conversation.pk, idle_days=30))
+        self.conversation.refresh_from_db()
+        self.assertIsNotNone(self.conversation.archived_at)
+        self.assertFalse(ConversationMessage.objects.filter(conversation=self.conversation).exists())
+        self.assertEqual(self.snapshot(self.conversation.history), self.original)
+        self.assertEqual(self.conversation.archive.message_count, 3)
+
+        self.assertTrue(rehydrate_conversation(self.conversation))
+        self.conversation.refresh_from_db()
+        self.assertIsNone(self.conversation.archived_at)
+        self.assertFalse(ConversationArchive.objects.filter(conversation_id=self.conversation.pk).exists())
+        self.assertEqual(self.snapshot(self.conversation.messages.order_by('created_at')), self.original)
+
+    def test_recent_conversation_not_archived(self):
+        self.assertFalse(archive_conversation(self.conversation.pk, idle_days=90))
+        self.assertEqual(self.conversation.messages.count(), 3)
+        self.assertFalse(rehydrate_conversation(self.conversation))
+
+
+class RetentionTests(TestCase):
+    """purge_history: testi svuotati e righe cancellate solo oltre la soglia e in stato finale"""
+
+    def setUp(self):
+        self.model = ensure_mock_model()
+        self.policy = POLICIES[0]
+        self.options = {'batch_size': 1, 'lock_timeout_ms': 0, 'pause_ms': 0}
+        old = timezone.now() - timedelta(days=100)
+        self.old_done = [self.make_request('completed', old), self.make_request('failed', old)]
+        self.old_running = self.make_request('processing', old)
+        self.recent = self.make_request('completed', timezone.now())
+
+    def make_request(self, status, created_at):
+        request = LLMRequest.objects.create(
+            model=self.model, prompt='prompt', system_message='sistema', response='risposta',
+            status=status, tokens_used=10,
+        )
+        LLMRequest.objects.filter(pk=request.pk).update(created_at=created_at)
+        return request
+
+    def test_strip_text(self):
+        stats = strip_text(self.policy, 30, **self.options)
+        self.assertEqual((stats.rows, stats.batches), (2, 2))
+        for request in self.old_done:
+            request.refresh_from_db()
+            self.assertEqual((request.prompt, request.system_message, request.response), ('', '', ''))
+            self.assertIsNotNone(request.content_purged_at)
+            self.assertEqual(request.tokens_used, 10)
+        for request in (self.old_running, self.recent):
+            request.refresh_from_db()
+            self.assertEqual(request.prompt, 'prompt')
+            self.assertIsNone(request.content_purged_at)
+        # Seconda esecuzione: nessuna riga ancora da svuotare
+        self.assertEqual(strip_text(self.policy, 30, **self.options).rows, 0)
+
+    def test_delete_rows(self):
+        stats = delete_rows(self.policy, 30, **self.options)
+        self.assertEqual(stats.rows, 2)
+        remaining = set(LLMRequest.objects.values_list('pk', flat=True))
+        self.assertEqual(remaining, {self.old_running.pk, self.recent.pk})
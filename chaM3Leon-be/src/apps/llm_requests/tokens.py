@@ -0,0 +1,46 @@
+import logging
+import math
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Rapporto medio caratteri/token per testo inglese e codice (tokenizer BPE)
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=32)
+def _get_encoding(model_name):
+    """
+    Restituisce l'encoding tiktoken per il modello, oppure None se tiktoken
+    non è installato o non riesce a caricare l'encoding (es. host offline)
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        # Modelli non OpenAI: o200k_base è una buona approssimazione
+        pass
+    except Exception as e:
+        logger.warning("Impossibile caricare l'encoding tiktoken per %s: %s", model_name, e)
+        return None
+
+    try:
+        return tiktoken.get_encoding('o200k_base')
+    except Exception as e:
+        logger.warning("Impossibile caricare l'encoding tiktoken o200k_base: %s", e)
+        return None
+
+
+def estimate_tokens(text, model_name=''):
+    """Stima il numero di token di un testo quando il provider non li restituisce"""
+    if not text:
+        return 0
+
+    encoding = _get_encoding(model_name)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
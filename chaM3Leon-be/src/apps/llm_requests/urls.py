@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import LLMProviderViewSet, LLMModelViewSet, LLMRequestViewSet, LLMConversationViewSet, WorkflowFileAnalysisViewSet
+from .views import LLMProviderViewSet, LLMModelViewSet, LLMRequestViewSet, LLMConversationViewSet, WorkflowFileAnalysisViewSet, LLMUsageViewSet
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'providers', LLMProviderViewSet, basename='llmprovider')
@@ -8,9 +10,18 @@ router.register(r'models', LLMModelViewSet, basename='llmmodel')
 router.register(r'requests', LLMRequestViewSet, basename='llmrequest')
 router.register(r'conversations', LLMConversationViewSet, basename='llmconversation')
 router.register(r'workflow-analysis', WorkflowFileAnalysisViewSet, basename='workflowfileanalysis')
+router.register(r'usage', LLMUsageViewSet, basename='llmusage')
 
 app_name = 'llm_requests'
 
 urlpatterns = [
     path('api/llm/', include(router.urls)),
-]
\ No newline at end of file
+]
+
+if settings.LLM_ASYNC_VIEWS:
+    # Stessi path delle action DRF: le view async vengono risolte prima del router
+    urlpatterns = [
+        path('api/llm/requests/', async_views.llm_request_collection, name='llmrequest-async-list'),
+        path('api/llm/requests/quick_request/', async_views.quick_request, name='llmrequest-async-quick-request'),
+        path('api/llm/workflow-analysis/quick_analysis/', async_views.quick_analysis, name='workflowfileanalysis-async-quick-analysis'),
+    ] + urlpatterns
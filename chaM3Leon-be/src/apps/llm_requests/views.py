@@ -3,16 +3,30 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 import os
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDay
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from .models import LLMProvider, LLMModel, LLMRequest, LLMConversation, ConversationMessage, WorkflowFileAnalysis
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime, parse_date
+from .models import LLMProvider, LLMModel, LLMRequest, LLMConversation, ConversationMessage, WorkflowFileAnalysis, LLMUsageHourly
 from .serializers import (
-    LLMProviderSerializer, LLMModelSerializer, LLMRequestSerializer,
-    CreateLLMRequestSerializer, LLMConversationSerializer, ConversationMessageSerializer,
-    WorkflowFileAnalysisSerializer, CreateWorkflowFileAnalysisSerializer, AvailableWorkflowFileSerializer
+    LLMProviderSerializer, LLMModelSerializer, LLMRequestSerializer, LLMRequestListSerializer,
+    CreateLLMRequestSerializer, LLMConversationSerializer, LLMConversationListSerializer,
+    ConversationMessageSerializer,
+    WorkflowFileAnalysisSerializer, WorkflowFileAnalysisListSerializer,
+    CreateWorkflowFileAnalysisSerializer, AvailableWorkflowFileSerializer, LLMUsageHourlySerializer
 )
+from .archive import ensure_active
+from .catalog import get_catalog
+from .circuit_breaker import CircuitBreaker
+from .idempotency import idempotent
+from ..common.metrics import StageTimer
+from ..common.pagination import CreatedAtCursorPagination, HourCursorPagination
 from .services import (
     process_llm_request, LLMServiceError, get_available_workflow_files, 
     resolve_workflow_file_path, process_workflow_file_analysis
@@ -22,17 +36,90 @@ import mlflow
 # Configura il logger
 logger = logging.getLogger(__name__)
 
-class LLMProviderViewSet(viewsets.ReadOnlyModelViewSet):
+def catalog_not_modified(request, catalog):
+    """304 se il client ha già questa versione del catalogo (If-None-Match)"""
+    return get_conditional_response(request, etag=catalog.etag)
+
+def with_catalog_etag(response, catalog):
+    response['ETag'] = catalog.etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+class CatalogViewSetMixin:
+    """
+    list e retrieve servite dal catalogo in memoria (vedi catalog.py), con ETag.
+    catalog_attr è la collezione del catalogo servita ('providers' o 'models').
+    """
+    catalog_attr = None
+    
+    def catalog_items(self, catalog):
+        """Oggetti attivi del catalogo restituiti dalla list (?provider= filtra per provider)"""
+        return catalog.active(self.catalog_attr, self.request.query_params.get('provider') or None)
+    
+    def catalog_data(self, catalog):
+        return catalog.data[self.catalog_attr]
+    
+    def list(self, request, *args, **kwargs):
+        catalog = get_catalog()
+        not_modified = catalog_not_modified(request, catalog)
+        if not_modified is not None:
+            return not_modified
+        data = self.catalog_data(catalog)
+        results = [data[item.pk] for item in self.catalog_items(catalog)]
+        page = self.paginate_queryset(results)
+        response = self.get_paginated_response(page) if page is not None else Response(results)
+        return with_catalog_etag(response, catalog)
+    
+    def retrieve(self, request, *args, **kwargs):
+        catalog = get_catalog()
+        items = {str(item.pk): item for item in self.catalog_items(catalog)}
+        item = items.get(str(kwargs[self.lookup_field]))
+        if item is None:
+            raise Http404
+        not_modified = catalog_not_modified(request, catalog)
+        if not_modified is not None:
+            return not_modified
+        return with_catalog_etag(Response(self.catalog_data(catalog)[item.pk]), catalog)
+
+class LLMProviderViewSet(CatalogViewSetMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet per visualizzare i provider LLM disponibili"""
     queryset = LLMProvider.objects.filter(is_active=True)
     serializer_class = LLMProviderSerializer
     permission_classes = [AllowAny]  # TEMPORANEO per test
+    catalog_attr = 'providers'
+    
+    @action(detail=False, methods=['get'])
+    def health(self, request):
+        """Stato dei circuit breaker dei provider attivi e dei loro modelli"""
+        catalog = get_catalog()
+        providers = [
+            (provider, sorted(catalog.active_models(provider.name), key=lambda model: model.name))
+            for provider in catalog.active_providers()
+        ]
+        return Response([
+            {
+                'id': provider.id,
+                'name': provider.name,
+                'display_name': provider.display_name,
+                'breaker': CircuitBreaker.for_provider(provider.name).status(),
+                'models': [
+                    {
+                        'id': model.id,
+                        'name': model.name,
+                        'breaker': CircuitBreaker.for_model(model).status(),
+                    }
+                    for model in models
+                ],
+            }
+            for provider, models in providers
+        ])
 
-class LLMModelViewSet(viewsets.ReadOnlyModelViewSet):
+class LLMModelViewSet(CatalogViewSetMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet per visualizzare i modelli LLM disponibili"""
     queryset = LLMModel.objects.filter(is_active=True).select_related('provider')
     serializer_class = LLMModelSerializer
     permission_classes = [AllowAny]  # TEMPORANEO per test
+    catalog_attr = 'models'
     
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -48,8 +135,18 @@ class LLMConversationViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         # Per i test, restituisci tutte le conversazioni
-        return LLMConversation.objects.all().prefetch_related('messages')
-        # return LLMConversation.objects.filter(user=self.request.user).prefetch_related('messages')
+        queryset = LLMConversation.objects.all()
+        # queryset = LLMConversation.objects.filter(user=self.request.user)
+        # I corpi dei messaggi servono solo nel dettaglio: la lista usa i contatori denormalizzati
+        if self.action == 'retrieve':
+            # Le conversazioni archiviate hanno i messaggi nell'archivio compresso
+            queryset = queryset.select_related('archive').prefetch_related('messages')
+        return queryset
+    
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return LLMConversationListSerializer
+        return LLMConversationSerializer
     
     def perform_create(self, serializer):
         # Per i test, non associare un utente specifico
@@ -63,9 +160,11 @@ class LLMConversationViewSet(viewsets.ModelViewSet):
         serializer = ConversationMessageSerializer(data=request.data)
         
         if serializer.is_valid():
-            serializer.save(conversation=conversation)
-            conversation.updated_at = timezone.now()
-            conversation.save()
+            ensure_active(conversation)
+            # Messaggio e contatori della conversazione insieme, come in persist_llm_result
+            with transaction.atomic():
+                message = serializer.save(conversation=conversation)
+                conversation.register_messages(1, at=message.created_at)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -74,23 +173,31 @@ class LLMConversationViewSet(viewsets.ModelViewSet):
     def messages(self, request, pk=None):
         """Ottieni tutti i messaggi di una conversazione"""
         conversation = self.get_object()
-        messages = conversation.messages.all()
-        serializer = ConversationMessageSerializer(messages, many=True)
+        serializer = ConversationMessageSerializer(conversation.history, many=True)
         return Response(serializer.data)
 
 class LLMRequestViewSet(viewsets.ModelViewSet):
     """ViewSet per gestire le richieste LLM"""
     serializer_class = LLMRequestSerializer
     permission_classes = [AllowAny]  # TEMPORANEO per test
+    pagination_class = CreatedAtCursorPagination
+    # Colonne pesanti caricate solo nelle route di dettaglio
+    list_deferred_fields = ['prompt', 'system_message', 'response', 'stage_timings']
     
     def get_queryset(self):
         # Per i test, restituisci tutte le richieste
-        return LLMRequest.objects.all().select_related('model__provider')
-        # return LLMRequest.objects.filter(user=self.request.user).select_related('model__provider')
+        queryset = LLMRequest.objects.all()
+        # queryset = LLMRequest.objects.filter(user=self.request.user)
+        if self.action == 'list':
+            # model_info arriva dal catalogo in memoria: nessun join sul modello
+            return queryset.defer(*self.list_deferred_fields)
+        return queryset.select_related('model__provider')
     
     def get_serializer_class(self):
         if self.action == 'create':
             return CreateLLMRequestSerializer
+        if self.action == 'list':
+            return LLMRequestListSerializer
         return LLMRequestSerializer
     
     def perform_create(self, serializer):
@@ -121,6 +228,7 @@ class LLMRequestViewSet(viewsets.ModelViewSet):
             request_obj.save()
             return request_obj
     
+    @idempotent('llm.requests')
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -132,6 +240,7 @@ class LLMRequestViewSet(viewsets.ModelViewSet):
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
     
     @action(detail=False, methods=['post'])
+    @idempotent('llm.quick_request')
     def quick_request(self, request):
         """Endpoint per richieste rapide senza conversazione"""
         serializer = CreateLLMRequestSerializer(data=request.data)
@@ -167,7 +276,7 @@ class LLMRequestViewSet(viewsets.ModelViewSet):
         request_obj.status = 'pending'
         request_obj.error_message = ''
         request_obj.response = ''
-        request_obj.save()
+        request_obj.save(update_fields=['status', 'error_message', 'response'])
         
         try:
             processed_request = process_llm_request(request_obj)
@@ -180,19 +289,133 @@ class LLMRequestViewSet(viewsets.ModelViewSet):
             response_serializer = LLMRequestSerializer(request_obj)
             return Response(response_serializer.data, status=status.HTTP_400_BAD_REQUEST)
 
+class QuickAnalysisRejected(Exception):
+    """Analisi rapida respinta prima della chiamata LLM: corpo e status HTTP della risposta"""
+    def __init__(self, payload, status_code):
+        super().__init__(payload.get('error', ''))
+        self.payload = payload
+        self.status_code = status_code
+
+def prepare_quick_analysis(validated_data, timer):
+    """
+    Verifica il workflow, risolve il path e legge il file: restituisce
+    l'analisi temporanea (non salvata) da passare al servizio LLM
+    """
+    # Risolvi il path del file
+    workflow_id = validated_data.get('workflow_id')
+    workflow_file_name = validated_data.get('workflow_file_name')
+    workflow_file_path = validated_data.get('workflow_file_path')
+    
+    logger.debug("Parametri per risoluzione path:")
+    logger.debug("  - workflow_id: %s", workflow_id)
+    logger.debug("  - workflow_file_name: %s", workflow_file_name)
+    logger.debug("  - workflow_file_path: %s", workflow_file_path)
+    
+    # Validation: se viene fornito un workflow_id, verifica lo stato prima di procedere
+    if workflow_id:
+        try:
+            from ..workflow_generator.models import WorkflowGeneration
+            with timer.stage('db_read'):
+                workflow = WorkflowGeneration.objects.filter(id=workflow_id).only(
+                    'id', 'status', 'error_message'
+                ).first()
+        except Exception as db_error:
+            logger.error("❌ Errore nella verifica del workflow: %s", db_error)
+            raise QuickAnalysisRejected({'error': f"Errore nella verifica del workflow: {str(db_error)}"}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        if workflow:
+            logger.info("Workflow %s trovato - Status: %s", workflow_id, workflow.status)
+            if workflow.status != 'completed':
+                error_msg = f"Il workflow {workflow_id} non è completato (status: {workflow.status}). "
+                if workflow.status == 'failed':
+                    error_msg += f"Errore: {workflow.error_message}"
+                elif workflow.status == 'processing':
+                    error_msg += "Attendi il completamento della generazione."
+                elif workflow.status == 'pending':
+                    error_msg += "Il workflow non è ancora stato processato."
+                logger.error("❌ %s", error_msg)
+                raise QuickAnalysisRejected({'error': error_msg}, status.HTTP_400_BAD_REQUEST)
+        else:
+            error_msg = f"Il workflow {workflow_id} non esiste nel database."
+            logger.error("❌ %s", error_msg)
+            raise QuickAnalysisRejected({'error': error_msg}, status.HTTP_404_NOT_FOUND)
+    
+    with timer.stage('path_resolution'):
+        resolved_path = resolve_workflow_file_path(
+            workflow_id=workflow_id,
+            workflow_file_name=workflow_file_name,
+            workflow_file_path=workflow_file_path
+        )
+    logger.info("✅ Path risolto: %s", resolved_path)
+    
+    # Leggi il contenuto del file
+    logger.info("Leggendo contenuto file...")
+    with timer.stage('file_read'):
+        with open(resolved_path, 'r', encoding='utf-8') as f:
+            workflow_content = f.read()
+    logger.debug("Contenuto letto: %s caratteri", len(workflow_content))
+    
+    # Crea un'analisi temporanea (non salvata nel DB)
+    logger.info("Creando analisi temporanea...")
+    logger.debug("Modello selezionato: %s", validated_data['model'])
+    
+    temp_analysis = WorkflowFileAnalysis(
+        model=validated_data['model'],
+        workflow_file_path=resolved_path,
+        workflow_content=workflow_content,
+        system_prompt=validated_data.get('system_prompt', WorkflowFileAnalysis._meta.get_field('system_prompt').default),
+        user_prompt=validated_data.get('user_prompt', ''),
+        analysis_mode=validated_data.get('analysis_mode', 'auto')
+    )
+    logger.debug("✅ Analisi temporanea creata")
+    return temp_analysis
+
+def quick_analysis_response_data(analysis, timer):
+    """Dati essenziali restituiti da un'analisi rapida"""
+    logger.info("✅ Analisi processata con status: %s", analysis.status)
+    return {
+        'workflow_file_path': analysis.workflow_file_path,
+        'analysis_response': analysis.analysis_response,
+        'status': analysis.status,
+        'error_message': analysis.error_message,
+        'tokens_used': analysis.tokens_used,
+        'served_by': analysis.served_by_id,
+        'response_time_ms': analysis.response_time_ms,
+        'stage_timings': analysis.stage_timings or timer.as_dict()
+    }
+
+def log_invalid_quick_analysis(serializer, data):
+    logger.error("❌ Serializer NON valido")
+    logger.error("Errori serializer: %s", serializer.errors)
+    logger.debug("Data ricevuta: %s", data)
+    logger.debug("Fields del serializer: %s", list(serializer.fields.keys()))
+    
+    # Log dettagliato per ogni campo
+    for field_name, field_errors in serializer.errors.items():
+        logger.error("Campo '%s': %s", field_name, field_errors)
+
 class WorkflowFileAnalysisViewSet(viewsets.ModelViewSet):
     """ViewSet per gestire l'analisi dei file workflow tramite LLM"""
     serializer_class = WorkflowFileAnalysisSerializer
     permission_classes = [AllowAny]  # TEMPORANEO per test
+    pagination_class = CreatedAtCursorPagination
+    # Colonne pesanti caricate solo nelle route di dettaglio
+    list_deferred_fields = ['workflow_content', 'system_prompt', 'user_prompt', 'analysis_response', 'stage_timings']
     
     def get_queryset(self):
         # Per i test, restituisci tutte le analisi
-        return WorkflowFileAnalysis.objects.all().select_related('model__provider')
-        # return WorkflowFileAnalysis.objects.filter(user=self.request.user).select_related('model__provider')
+        queryset = WorkflowFileAnalysis.objects.all()
+        # queryset = WorkflowFileAnalysis.objects.filter(user=self.request.user)
+        if self.action == 'list':
+            # model_info arriva dal catalogo in memoria: nessun join sul modello
+            return queryset.defer(*self.list_deferred_fields)
+        return queryset.select_related('model__provider')
     
     def get_serializer_class(self):
         if self.action == 'create':
             return CreateWorkflowFileAnalysisSerializer
+        if self.action == 'list':
+            return WorkflowFileAnalysisListSerializer
         return WorkflowFileAnalysisSerializer
     
     def perform_create(self, serializer):
@@ -200,23 +423,26 @@ class WorkflowFileAnalysisViewSet(viewsets.ModelViewSet):
         workflow_id = serializer.validated_data.pop('workflow_id', None)
         workflow_file_name = serializer.validated_data.pop('workflow_file_name', None)
         workflow_file_path = serializer.validated_data.get('workflow_file_path')
+        timer = StageTimer('workflow_analysis')
         
         try:
-            resolved_path = resolve_workflow_file_path(
-                workflow_id=workflow_id,
-                workflow_file_name=workflow_file_name,
-                workflow_file_path=workflow_file_path
-            )
+            with timer.stage('path_resolution'):
+                resolved_path = resolve_workflow_file_path(
+                    workflow_id=workflow_id,
+                    workflow_file_name=workflow_file_name,
+                    workflow_file_path=workflow_file_path
+                )
             serializer.validated_data['workflow_file_path'] = resolved_path
         except LLMServiceError as e:
             raise serializers.ValidationError({'workflow_file_path': str(e)})
         
         # Crea l'analisi
-        analysis = serializer.save()
+        with timer.stage('db_write'):
+            analysis = serializer.save()
         
         # Processa l'analisi
         try:
-            processed_analysis = process_workflow_file_analysis(analysis)
+            processed_analysis = process_workflow_file_analysis(analysis, timer=timer)
             return processed_analysis
         except LLMServiceError as e:
             analysis.status = 'failed'
@@ -224,6 +450,7 @@ class WorkflowFileAnalysisViewSet(viewsets.ModelViewSet):
             analysis.save()
             return analysis
     
+    @idempotent('llm.workflow_analysis')
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -346,122 +573,45 @@ class WorkflowFileAnalysisViewSet(viewsets.ModelViewSet):
             )
     
     @action(detail=False, methods=['post'])
+    @idempotent('llm.quick_analysis')
     def quick_analysis(self, request):
         """Endpoint per analisi rapide senza salvare nel database"""
         logger.info("QUICK_ANALYSIS: Ricevuta richiesta POST")
-        logger.debug(f"Request data: {request.data}")
-        logger.debug(f"Content-Type: {request.content_type}")
-        logger.debug(f"Request method: {request.method}")
+        logger.debug("Request data: %s", request.data)
+        logger.debug("Content-Type: %s", request.content_type)
+        logger.debug("Request method: %s", request.method)
         
-        # Debug: controlla i modelli disponibili
-        available_models = LLMModel.objects.filter(is_active=True)
-        logger.info(f"Modelli disponibili nel database: {available_models.count()}")
-        for model in available_models:
-            logger.debug(f"  - ID: {model.id}, Nome: {model.name}, Display: {model.display_name}, Provider: {model.provider.name}")
         
         serializer = CreateWorkflowFileAnalysisSerializer(data=request.data)
-        logger.debug(f"🔧 Serializer creato con data: {request.data}")
+        logger.debug("🔧 Serializer creato con data: %s", request.data)
         
         if serializer.is_valid():
             logger.info("Serializer valido, procedendo con l'analisi...")
-            logger.debug(f"Validated data: {serializer.validated_data}")
+            logger.debug("Validated data: %s", serializer.validated_data)
+            timer = StageTimer('quick_analysis')
             
             try:
-                # Risolvi il path del file
-                workflow_id = serializer.validated_data.get('workflow_id')
-                workflow_file_name = serializer.validated_data.get('workflow_file_name')
-                workflow_file_path = serializer.validated_data.get('workflow_file_path')
-                
-                logger.debug(f"Parametri per risoluzione path:")
-                logger.debug(f"  - workflow_id: {workflow_id}")
-                logger.debug(f"  - workflow_file_name: {workflow_file_name}")
-                logger.debug(f"  - workflow_file_path: {workflow_file_path}")
-                
-                # Validation: se viene fornito un workflow_id, verifica lo stato prima di procedere
-                if workflow_id:
-                    try:
-                        from ..workflow_generator.models import WorkflowGeneration
-                        workflow = WorkflowGeneration.objects.filter(id=workflow_id).first()
-                        if workflow:
-                            logger.info(f"Workflow {workflow_id} trovato - Status: {workflow.status}")
-                            if workflow.status != 'completed':
-                                error_msg = f"Il workflow {workflow_id} non è completato (status: {workflow.status}). "
-                                if workflow.status == 'failed':
-                                    error_msg += f"Errore: {workflow.error_message}"
-                                elif workflow.status == 'processing':
-                                    error_msg += "Attendi il completamento della generazione."
-                                elif workflow.status == 'pending':
-                                    error_msg += "Il workflow non è ancora stato processato."
-                                logger.error(f"❌ {error_msg}")
-                                return Response({'error': error_msg}, status=status.HTTP_400_BAD_REQUEST)
-                        else:
-                            error_msg = f"Il workflow {workflow_id} non esiste nel database."
-                            logger.error(f"❌ {error_msg}")
-                            return Response({'error': error_msg}, status=status.HTTP_404_NOT_FOUND)
-                    except Exception as db_error:
-                        logger.error(f"❌ Errore nella verifica del workflow: {str(db_error)}")
-                        return Response({'error': f"Errore nella verifica del workflow: {str(db_error)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-                
-                resolved_path = resolve_workflow_file_path(
-                    workflow_id=workflow_id,
-                    workflow_file_name=workflow_file_name,
-                    workflow_file_path=workflow_file_path
-                )
-                logger.info(f"✅ Path risolto: {resolved_path}")
-                
-                # Leggi il contenuto del file
-                logger.info("Leggendo contenuto file...")
-                with open(resolved_path, 'r', encoding='utf-8') as f:
-                    workflow_content = f.read()
-                logger.debug(f"Contenuto letto: {len(workflow_content)} caratteri")
-                
-                # Crea un'analisi temporanea (non salvata nel DB)
-                logger.info("Creando analisi temporanea...")
-                logger.debug(f"Modello selezionato: {serializer.validated_data['model']}")
-                
-                temp_analysis = WorkflowFileAnalysis(
-                    model=serializer.validated_data['model'],
-                    workflow_file_path=resolved_path,
-                    workflow_content=workflow_content,
-                    system_prompt=serializer.validated_data.get('system_prompt', WorkflowFileAnalysis._meta.get_field('system_prompt').default),
-                    user_prompt=serializer.validated_data.get('user_prompt', '')
-                )
-                logger.debug("✅ Analisi temporanea creata")
+                temp_analysis = prepare_quick_analysis(serializer.validated_data, timer)
                 
                 # Processa l'analisi senza salvare
                 logger.info("Processando analisi...")
-                processed_analysis = process_workflow_file_analysis(temp_analysis)
-                logger.info(f"✅ Analisi processata con status: {processed_analysis.status}")
+                processed_analysis = process_workflow_file_analysis(temp_analysis, timer=timer)
                 
-                # Restituisci solo i dati essenziali
-                response_data = {
-                    'workflow_file_path': resolved_path,
-                    'analysis_response': processed_analysis.analysis_response,
-                    'status': processed_analysis.status,
-                    'error_message': processed_analysis.error_message,
-                    'tokens_used': processed_analysis.tokens_used,
-                    'response_time_ms': processed_analysis.response_time_ms
-                }
-                logger.debug(f"Restituendo risposta: {list(response_data.keys())}")
+                response_data = quick_analysis_response_data(processed_analysis, timer)
+                logger.debug("Restituendo risposta: %s", list(response_data.keys()))
                 return Response(response_data)
                 
+            except QuickAnalysisRejected as e:
+                return Response(e.payload, status=e.status_code)
             except Exception as e:
-                logger.error(f"❌ Errore durante l'analisi: {str(e)}")
-                logger.error(f"Tipo errore: {type(e).__name__}")
+                logger.error("❌ Errore durante l'analisi: %s", e)
+                logger.error("Tipo errore: %s", type(e).__name__)
                 return Response(
                     {'error': str(e)}, 
                     status=status.HTTP_400_BAD_REQUEST
                 )
         else:
-            logger.error("❌ Serializer NON valido")
-            logger.error(f"Errori serializer: {serializer.errors}")
-            logger.debug(f"Data ricevuta: {request.data}")
-            logger.debug(f"Fields del serializer: {list(serializer.fields.keys())}")
-            
-            # Log dettagliato per ogni campo
-            for field_name, field_errors in serializer.errors.items():
-                logger.error(f"Campo '{field_name}': {field_errors}")
-            
+            log_invalid_quick_analysis(serializer, request.data)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=False, methods=['get'])
@@ -531,3 +681,116 @@ class WorkflowFileAnalysisViewSet(viewsets.ModelViewSet):
             analysis.save()
             response_serializer = WorkflowFileAnalysisSerializer(analysis)
             return Response(response_serializer.data, status=status.HTTP_400_BAD_REQUEST)
+
+class LLMUsageViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet in sola lettura sugli aggregati orari di token e costi.
+    
+    Filtri: from, to (ISO datetime o data), provider, model, user.
+    """
+    serializer_class = LLMUsageHourlySerializer
+    permission_classes = [AllowAny]  # TEMPORANEO per test
+    pagination_class = HourCursorPagination
+    
+    # Campi di raggruppamento per summary (?group_by=...)
+    SUMMARY_GROUPS = {
+        'model': ['model', 'model__name', 'provider__name'],
+        'provider': ['provider__name'],
+        'user': ['user', 'user__username'],
+    }
+    SUMMARY_DEFAULT_DAYS = 30
+    
+    def parse_bound(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            parsed_date = parse_date(value)
+            if parsed_date is None:
+                raise serializers.ValidationError({name: 'Formato data non valido'})
+            parsed = datetime.combine(parsed_date, datetime.min.time())
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+    
+    def get_queryset(self):
+        queryset = LLMUsageHourly.objects.all()
+        params = self.request.query_params
+        
+        start = self.parse_bound('from')
+        end = self.parse_bound('to')
+        if start:
+            queryset = queryset.filter(hour__gte=start)
+        if end:
+            queryset = queryset.filter(hour__lt=end)
+        if params.get('provider'):
+            queryset = queryset.filter(provider__name=params['provider'])
+        if params.get('model'):
+            queryset = queryset.filter(model_id=params['model'])
+        if params.get('user'):
+            queryset = queryset.filter(user_id=params['user'])
+        return queryset
+    
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """
+        Totali per modello, provider o utente (?group_by=), opzionalmente
+        suddivisi per ora o giorno (?granularity=hour|day).
+        Legge solo gli aggregati: il costo dipende dall'intervallo, non dal volume di richieste.
+        """
+        group_by = request.query_params.get('group_by', 'model')
+        granularity = request.query_params.get('granularity')
+        if group_by not in self.SUMMARY_GROUPS:
+            return Response(
+                {'error': f"group_by deve essere uno tra: {', '.join(self.SUMMARY_GROUPS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if granularity not in (None, 'hour', 'day'):
+            return Response({'error': "granularity deve essere 'hour' o 'day'"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        queryset = self.get_queryset()
+        start = self.parse_bound('from')
+        if start is None:
+            start = timezone.now() - timedelta(days=self.SUMMARY_DEFAULT_DAYS)
+            queryset = queryset.filter(hour__gte=start)
+        
+        group_fields = list(self.SUMMARY_GROUPS[group_by])
+        if granularity == 'day':
+            queryset = queryset.annotate(period=TruncDay('hour'))
+            group_fields.insert(0, 'period')
+        elif granularity == 'hour':
+            group_fields.insert(0, 'hour')
+        
+        rows = (
+            queryset
+            .order_by()
+            .values(*group_fields)
+            .annotate(
+                request_count=Sum('request_count'),
+                failed_count=Sum('failed_count'),
+                prompt_tokens=Sum('prompt_tokens'),
+                completion_tokens=Sum('completion_tokens'),
+                cache_read_tokens=Sum('cache_read_tokens'),
+                estimated_requests=Sum('estimated_requests'),
+                cost=Sum('cost'),
+                response_time_ms_total=Sum('response_time_ms_total'),
+            )
+            .order_by(*group_fields)
+        )
+        
+        results = []
+        for row in rows:
+            row['total_tokens'] = row['prompt_tokens'] + row['completion_tokens']
+            row['avg_response_time_ms'] = (
+                round(row.pop('response_time_ms_total') / row['request_count']) if row['request_count'] else None
+            )
+            results.append(row)
+        
+        return Response({
+            'from': start,
+            'to': self.parse_bound('to'),
+            'group_by': group_by,
+            'granularity': granularity,
+            'results': results,
+        })
@@ -0,0 +1,279 @@
+"""
+Scomposizione di un workflow Metaflow nei suoi metodi @step per l'analisi a blocchi.
+
+Ogni step viene estratto (decoratori compresi) come sorgente a sé, senza
+indentazione, così può essere inviato al modello LLM separatamente; i blocchi
+migliorati vengono poi reinseriti al loro posto nel file originale, che viene
+validato con compile() prima di essere restituito.
+
+normalize_structure e remap_identifiers riconoscono invece i workflow uguali a
+meno di spazi, commenti, docstring e nomi (classi, step, variabili), per
+riusare il risultato di un'analisi precedente rinominandone gli identificatori.
+"""
+import ast
+import hashlib
+import io
+import re
+import textwrap
+import tokenize
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+
+class WorkflowParseError(Exception):
+    """Il sorgente non è Python valido o non contiene metodi @step"""
+    pass
+
+
+@dataclass
+class StepChunk:
+    class_name: str
+    name: str
+    start: int  # indice (da 0) della prima riga, decoratori compresi
+    end: int  # indice della riga successiva all'ultima
+    indent: str
+    source: str  # sorgente dello step senza indentazione
+
+    @property
+    def key(self):
+        return f'{self.class_name}.{self.name}'
+
+    @property
+    def source_hash(self):
+        return code_hash(self.source)
+
+
+@dataclass
+class WorkflowChunks:
+    lines: List[str]
+    steps: List[StepChunk]
+    imports: List[str] = field(default_factory=list)
+    imports_end: int = 0  # riga dopo l'ultimo import di modulo
+    # Step già migliorati in analisi precedenti: chiave 'Classe.step' -> (sorgente, import)
+    reused: Dict[str, tuple] = field(default_factory=dict)
+    # Esempi few-shot per step: chiave 'Classe.step' -> righe di WorkflowStepCache simili
+    examples: Dict[str, list] = field(default_factory=dict)
+
+    def step_names(self, class_name):
+        return [step.name for step in self.steps if step.class_name == class_name]
+
+    def pending_steps(self):
+        """Step da inviare al modello (non coperti da analisi precedenti)"""
+        return [step for step in self.steps if step.key not in self.reused]
+
+
+def code_hash(code: str) -> str:
+    """Hash del sorgente normalizzato negli spazi finali di riga"""
+    normalized = '\n'.join(line.rstrip() for line in code.strip('\n').splitlines())
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def is_step_decorator(node):
+    """@step, @metaflow.step o @step(...)"""
+    if isinstance(node, ast.Call):
+        node = node.func
+    if isinstance(node, ast.Name):
+        return node.id == 'step'
+    return isinstance(node, ast.Attribute) and node.attr == 'step'
+
+
+def is_step(node):
+    return isinstance(node, ast.FunctionDef) and any(is_step_decorator(decorator) for decorator in node.decorator_list)
+
+
+def split_workflow(source: str) -> WorkflowChunks:
+    """Individua i metodi @step delle classi del modulo"""
+    try:
+        tree = ast.parse(source)
+    except SyntaxError as e:
+        raise WorkflowParseError(f"Workflow non analizzabile: {e}")
+
+    lines = source.splitlines(keepends=True)
+    chunks = WorkflowChunks(lines=lines, steps=[])
+
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            chunks.imports.append(ast.unparse(node))
+            chunks.imports_end = node.end_lineno
+        elif isinstance(node, ast.ClassDef):
+            for item in node.body:
+                if not is_step(item):
+                    continue
+                start = min([item.lineno] + [decorator.lineno for decorator in item.decorator_list]) - 1
+                step_lines = lines[start:item.end_lineno]
+                chunks.steps.append(StepChunk(
+                    class_name=node.name,
+                    name=item.name,
+                    start=start,
+                    end=item.end_lineno,
+                    indent=' ' * item.col_offset,
+                    source=textwrap.dedent(''.join(step_lines)),
+                ))
+
+    if not chunks.steps:
+        raise WorkflowParseError("Nessun metodo @step trovato nel workflow")
+    return chunks
+
+
+def parse_step(code: str, name: str):
+    """
+    Valida il codice restituito dal modello per uno step: deve definire un solo
+    metodo con lo stesso nome e ancora decorato con @step, eventualmente
+    preceduto da import. Restituisce (sorgente dello step, import aggiunti).
+    """
+    try:
+        tree = ast.parse(textwrap.dedent(code))
+    except SyntaxError as e:
+        raise WorkflowParseError(f"Step {name}: codice non valido ({e})")
+
+    imports, functions = [], []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            imports.append(ast.unparse(node))
+        elif isinstance(node, ast.FunctionDef):
+            functions.append(node)
+        elif not (isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant)):
+            raise WorkflowParseError(f"Step {name}: codice inatteso fuori dal metodo")
+
+    if len(functions) != 1 or functions[0].name != name or not is_step(functions[0]):
+        raise WorkflowParseError(f"Step {name}: la risposta non contiene il solo metodo @step {name}")
+
+    node = functions[0]
+    code_lines = textwrap.dedent(code).splitlines(keepends=True)
+    start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list]) - 1
+    return ''.join(code_lines[start:node.end_lineno]), imports
+
+
+def stitch_workflow(chunks: WorkflowChunks, replacements: Dict[str, str],
+                    new_imports: Optional[List[str]] = None, filename: str = '<workflow>') -> str:
+    """
+    Ricompone il file sostituendo gli step migliorati (chiave 'Classe.step') e
+    aggiungendo dopo gli import esistenti quelli nuovi; il risultato deve compilare.
+    """
+    lines = list(chunks.lines)
+    # Dal basso verso l'alto, così gli indici degli step precedenti restano validi
+    for step in sorted(chunks.steps, key=lambda step: step.start, reverse=True):
+        code = replacements.get(step.key)
+        if code is None:
+            continue
+        code = textwrap.indent(code.rstrip('\n') + '\n', step.indent)
+        lines[step.start:step.end] = code.splitlines(keepends=True)
+
+    missing = []
+    for statement in new_imports or []:
+        if statement not in chunks.imports and statement not in missing:
+            missing.append(statement)
+    if missing:
+        if chunks.imports_end and not lines[chunks.imports_end - 1].endswith('\n'):
+            lines[chunks.imports_end - 1] += '\n'
+        lines[chunks.imports_end:chunks.imports_end] = [statement + '\n' for statement in missing]
+
+    source = ''.join(lines)
+    try:
+        compile(source, filename, 'exec')
+    except SyntaxError as e:
+        raise WorkflowParseError(f"Il workflow ricomposto non compila: {e}")
+    return source
+
+
+@dataclass
+class WorkflowStructure:
+    hash: str  # hash dell'AST con gli identificatori canonici
+    identifiers: List[str]  # identificatori del modulo, in ordine di prima comparsa nell'AST
+
+
+def bound_names(tree):
+    """Nomi definiti nel modulo: classi, funzioni, argomenti, variabili e attributi assegnati"""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, ast.Attribute) and isinstance(node.ctx, ast.Store):
+            names.add(node.attr)
+        elif isinstance(node, ast.alias) and node.asname:
+            names.add(node.asname)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+    return names
+
+
+IDENTIFIER_FIELDS = {
+    ast.ClassDef: 'name', ast.FunctionDef: 'name', ast.AsyncFunctionDef: 'name', ast.arg: 'arg',
+    ast.Name: 'id', ast.Attribute: 'attr', ast.alias: 'asname', ast.ExceptHandler: 'name', ast.keyword: 'arg',
+}
+
+
+def strip_docstring(node):
+    body = getattr(node, 'body', None)
+    if (isinstance(body, list) and len(body) > 1 and isinstance(body[0], ast.Expr)
+            and isinstance(body[0].value, ast.Constant) and isinstance(body[0].value.value, str)):
+        del body[0]
+
+
+def normalize_structure(source: str) -> WorkflowStructure:
+    """
+    Struttura del workflow indipendente da formattazione, commenti, docstring e
+    nomi definiti nel modulo: ogni nome diventa _N in ordine di comparsa. I nomi
+    esterni (builtin, moduli importati, API di Metaflow) e le costanti restano.
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError as e:
+        raise WorkflowParseError(f"Workflow non analizzabile: {e}")
+
+    names = bound_names(tree)
+    canonical = {}
+    for node in ast.walk(tree):
+        strip_docstring(node)
+        field_name = IDENTIFIER_FIELDS.get(type(node))
+        value = getattr(node, field_name, None) if field_name else None
+        if value in names:
+            setattr(node, field_name, canonical.setdefault(value, f'_{len(canonical)}'))
+
+    dump = ast.dump(tree, annotate_fields=False, include_attributes=False)
+    return WorkflowStructure(
+        hash=hashlib.sha256(dump.encode('utf-8')).hexdigest(),
+        identifiers=list(canonical),
+    )
+
+
+def remap_identifiers(code: str, old_identifiers: List[str], new_identifiers: List[str]) -> str:
+    """
+    Rinomina nel codice migliorato di un workflow gli identificatori del workflow
+    originale (old_identifiers) con quelli corrispondenti del nuovo, che ha la
+    stessa struttura. Rifiuta il codice se un nome nuovo introdotto dal modello
+    coincide con uno rinominato o se un nome da rinominare compare in una stringa.
+    """
+    if len(old_identifiers) != len(new_identifiers):
+        raise WorkflowParseError("Identificatori non corrispondenti")
+    mapping = {old: new for old, new in zip(old_identifiers, new_identifiers) if old != new}
+    if not mapping:
+        return code
+
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(code).readline))
+    except (tokenize.TokenError, SyntaxError) as e:
+        raise WorkflowParseError(f"Codice non tokenizzabile: {e}")
+
+    targets = set(mapping.values())
+    in_strings = re.compile(r'\b(?:' + '|'.join(map(re.escape, mapping)) + r')\b')
+    replacements = []
+    for token in tokens:
+        if token.type == tokenize.NAME:
+            if token.string in mapping:
+                replacements.append((token.start, token.end, mapping[token.string]))
+            elif token.string in targets:
+                raise WorkflowParseError(f"Il nome {token.string} è già usato nel codice migliorato")
+        elif token.type == tokenize.STRING and in_strings.search(token.string):
+            raise WorkflowParseError("Identificatori da rinominare presenti in una stringa")
+
+    lines = code.splitlines(keepends=True)
+    # Da destra verso sinistra, così le colonne dei token precedenti restano valide
+    for (row, start), (_, end), name in reversed(replacements):
+        line = lines[row - 1]
+        lines[row - 1] = line[:start] + name + line[end:]
+    return ''.join(lines)
@@ -31,7 +31,10 @@ class FileDeploymentAdmin(admin.ModelAdmin):
     list_display = ['file_name', 'ssh_connection', 'status', 'workflow_id', 'created_at']
     list_filter = ['status', 'created_at', 'ssh_connection']
     search_fields = ['file_name', 'workflow_id', 'ssh_connection__name']
-    readonly_fields = ['id', 'created_at', 'started_at', 'completed_at']
+    readonly_fields = ['id', 'created_at', 'started_at', 'completed_at', 'content_purged_at']
+    list_select_related = ['ssh_connection']
+    # Evita un secondo COUNT(*) sull'intera tabella quando si applicano filtri
+    show_full_result_count = False
     
     fieldsets = (
         ('Informazioni Base', {
@@ -48,7 +51,7 @@ class FileDeploymentAdmin(admin.ModelAdmin):
             'fields': ('workflow_id', 'deployment_notes', 'error_message')
         }),
         ('Timestamp', {
-            'fields': ('created_at', 'started_at', 'completed_at'),
+            'fields': ('created_at', 'started_at', 'completed_at', 'content_purged_at'),
             'classes': ('collapse',)
         }),
     )
\ No newline at end of file
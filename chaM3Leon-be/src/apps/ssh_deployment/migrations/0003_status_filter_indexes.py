@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ssh_deployment', '0002_filedeployment_created_id_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='filedeployment',
+            index=models.Index(fields=['workflow_id', '-created_at'], name='filedeploy_wf_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='filedeployment',
+            index=models.Index(fields=['status', '-created_at'], name='filedeploy_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='filedeployment',
+            index=models.Index(fields=['ssh_connection', '-created_at'], name='filedeploy_conn_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='filedeployment',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'uploading'])), fields=['-created_at'], name='filedeploy_active_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ssh_deployment', '0003_status_filter_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filedeployment',
+            name='content_purged_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='filedeployment',
+            index=models.Index(condition=models.Q(('content_purged_at__isnull', True)), fields=['created_at', 'id'], name='filedeploy_unpurged_idx'),
+        ),
+    ]
@@ -57,9 +57,27 @@ class FileDeployment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
+    # file_content svuotato dalla retention (purge_history)
+    content_purged_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='filedeploy_created_id_idx'),
+            models.Index(fields=['workflow_id', '-created_at'], name='filedeploy_wf_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='filedeploy_status_created_idx'),
+            models.Index(fields=['ssh_connection', '-created_at'], name='filedeploy_conn_created_idx'),
+            # Indice parziale: solo i deployment ancora in corso
+            models.Index(
+                fields=['-created_at'], name='filedeploy_active_idx',
+                condition=models.Q(status__in=['pending', 'uploading'])
+            ),
+            # Indice parziale: solo le righe non ancora toccate dalla retention
+            models.Index(
+                fields=['created_at', 'id'], name='filedeploy_unpurged_idx',
+                condition=models.Q(content_purged_at__isnull=True)
+            ),
+        ]
         verbose_name = "File Deployment"
         verbose_name_plural = "File Deployments"
 
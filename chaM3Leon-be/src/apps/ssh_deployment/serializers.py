@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import SSHConnection, FileDeployment
+from ..common.serializers import SparseModelSerializer
 
 
 class SSHConnectionSerializer(serializers.ModelSerializer):
@@ -48,6 +49,20 @@ class FileDeploymentSerializer(serializers.ModelSerializer):
         ]
 
 
+class FileDeploymentListSerializer(SparseModelSerializer):
+    """Serializer compatto per la lista dei deployment (senza contenuto e note)"""
+    ssh_connection_name = serializers.CharField(source='ssh_connection.name', read_only=True)
+    
+    class Meta:
+        model = FileDeployment
+        fields = [
+            'id', 'ssh_connection', 'ssh_connection_name', 'remote_file_path',
+            'file_name', 'status', 'error_message', 'workflow_id',
+            'created_at', 'started_at', 'completed_at'
+        ]
+        read_only_fields = fields
+
+
 class DeployWorkflowFileSerializer(serializers.Serializer):
     """Serializer per deployare un file workflow"""
     ssh_connection_id = serializers.UUIDField(help_text="ID della connessione SSH da utilizzare")
@@ -60,6 +75,9 @@ class DeployWorkflowFileSerializer(serializers.Serializer):
         """Valida che il nome del file abbia estensione .py"""
         if not value.endswith('.py'):
             raise serializers.ValidationError("Il nome del file deve avere estensione .py")
+        # Finisce in un path remoto: niente separatori né componenti relativi
+        if '/' in value or '\\' in value or value.startswith('.'):
+            raise serializers.ValidationError("Il nome del file non può contenere un percorso")
         return value
 
 
@@ -1,11 +1,16 @@
 import os
+import time
+import uuid
+import shlex
 import paramiko
 import tempfile
+from pathlib import Path
 from scp import SCPClient
 from django.utils import timezone
 from django.conf import settings
 from typing import Optional, Dict, Any
 from .models import SSHConnection, FileDeployment
+from ..common.metrics import StageTimer
 
 
 class SSHDeploymentError(Exception):
@@ -115,6 +120,110 @@ class SSHDeploymentService:
             raise SSHDeploymentError(f"Errore nell'esecuzione del comando: {str(e)}")
 
 
+class LocalDeploymentService(SSHDeploymentService):
+    """
+    Sostituto locale del server SSH per benchmark e sviluppo (SSH_DEPLOYMENT_BACKEND='local').
+    
+    Il filesystem remoto è la cartella SSH_LOCAL_ROOT: i path remoti vengono rimappati
+    al suo interno e rifiutati se ne escono. Nessun comando passa da una shell:
+    execute_command implementa solo quelli che i deployment inviano (echo, ls con
+    un eventuale grep). Ogni round trip attende SSH_LOCAL_LATENCY_MS per simulare
+    la rete (3 per la connessione: TCP, key exchange, autenticazione).
+    """
+    CONNECT_ROUND_TRIPS = 3
+    
+    def __init__(self, ssh_connection: SSHConnection):
+        super().__init__(ssh_connection)
+        self.root = Path(settings.SSH_LOCAL_ROOT).resolve()
+        self.connected = False
+    
+    def round_trip(self, count: int = 1):
+        if settings.SSH_LOCAL_LATENCY_MS > 0:
+            time.sleep(count * settings.SSH_LOCAL_LATENCY_MS / 1000)
+    
+    def local_path(self, remote_path: str) -> Path:
+        path = (self.root / remote_path.lstrip('/')).resolve()
+        if path != self.root and self.root not in path.parents:
+            raise SSHDeploymentError(f"Path fuori da SSH_LOCAL_ROOT: {remote_path}")
+        return path
+    
+    def connect(self) -> bool:
+        self.round_trip(self.CONNECT_ROUND_TRIPS)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.connected = True
+        return True
+    
+    def disconnect(self):
+        self.connected = False
+    
+    def create_remote_directory(self, remote_path: str) -> bool:
+        self.round_trip()
+        try:
+            self.local_path(remote_path).mkdir(parents=True, exist_ok=True)
+            return True
+        except OSError as e:
+            raise SSHDeploymentError(f"Errore nella creazione della directory remota: {str(e)}")
+    
+    def upload_file_content(self, file_content: str, remote_file_path: str) -> bool:
+        target = self.local_path(remote_file_path)
+        try:
+            self.create_remote_directory(os.path.dirname(remote_file_path))
+            # Trasferimento + verifica dell'esistenza, come la versione SCP
+            self.round_trip(2)
+            # Scrittura atomica nella stessa cartella del file finale
+            temp_path = target.with_name(f'.{target.name}.{uuid.uuid4().hex}.tmp')
+            temp_path.write_text(file_content, encoding='utf-8')
+            os.replace(temp_path, target)
+            return target.is_file()
+        except OSError as e:
+            raise SSHDeploymentError(f"Errore nel caricamento del file: {str(e)}")
+    
+    def list_directory(self, remote_path: str):
+        """Righe di 'ls -la' (nome e dimensione) per un file o una cartella sotto SSH_LOCAL_ROOT"""
+        path = self.local_path(remote_path)
+        entries = sorted(path.iterdir()) if path.is_dir() else [path]
+        return [f"{'d' if entry.is_dir() else '-'} {entry.stat().st_size:>8} {entry.name}" for entry in entries]
+    
+    def execute_command(self, command: str) -> Dict[str, Any]:
+        if not self.connected:
+            raise SSHDeploymentError("Errore nell'esecuzione del comando: connessione non aperta")
+        self.round_trip()
+        try:
+            exit_status, stdout, stderr = self.run_command(shlex.split(command))
+        except (ValueError, OSError, SSHDeploymentError) as e:
+            exit_status, stdout, stderr = 1, '', f'{e}\n'
+        return {
+            'exit_status': exit_status,
+            'stdout': stdout,
+            'stderr': stderr,
+            'success': exit_status == 0
+        }
+    
+    def run_command(self, argv):
+        """(exit status, stdout, stderr) dei comandi supportati: echo, ls [-opzioni] path [| grep testo]"""
+        pattern = None
+        if len(argv) == 5 and argv[2] == '|' and argv[3] == 'grep':
+            argv, pattern = argv[:3], argv[4]
+        if pattern is None and argv and argv[0] == 'echo':
+            return 0, ' '.join(argv[1:]) + '\n', ''
+        paths = [arg for arg in argv[1:] if not arg.startswith('-')]
+        if argv and argv[0] == 'ls' and len(paths) == 1:
+            lines = self.list_directory(paths[0])
+            if pattern is not None:
+                lines = [line for line in lines if pattern in line]
+                if not lines:
+                    return 1, '', ''
+            return 0, ''.join(f'{line}\n' for line in lines), ''
+        return 127, '', f"Comando non supportato dal backend locale: {' '.join(argv)}\n"
+
+
+def get_deployment_service(ssh_connection: SSHConnection) -> SSHDeploymentService:
+    """Restituisce il servizio di deployment configurato (SSH_DEPLOYMENT_BACKEND)"""
+    if settings.SSH_DEPLOYMENT_BACKEND == 'local':
+        return LocalDeploymentService(ssh_connection)
+    return SSHDeploymentService(ssh_connection)
+
+
 def deploy_workflow_file(
     ssh_connection_id: str,
     file_content: str,
@@ -137,6 +246,7 @@ def deploy_workflow_file(
     Returns:
         FileDeployment: Oggetto che traccia il deployment
     """
+    timer = StageTimer('ssh_deployment')
     try:
         # Recupera la connessione SSH
         ssh_connection = SSHConnection.objects.get(id=ssh_connection_id, is_active=True)
@@ -169,14 +279,17 @@ def deploy_workflow_file(
         deployment.remote_file_path = remote_file_path
         deployment.status = 'uploading'
         deployment.started_at = timezone.now()
-        deployment.save()
+        with timer.stage('db_write'):
+            deployment.save()
         
         # Effettua il deployment
-        service = SSHDeploymentService(ssh_connection)
-        service.connect()
+        service = get_deployment_service(ssh_connection)
+        with timer.stage('ssh_connect'):
+            service.connect()
         
         try:
-            success = service.upload_file_content(file_content, remote_file_path)
+            with timer.stage('ssh_upload'):
+                success = service.upload_file_content(file_content, remote_file_path)
             
             if success:
                 deployment.status = 'completed'
@@ -188,16 +301,20 @@ def deploy_workflow_file(
         finally:
             service.disconnect()
         
-        deployment.save()
+        with timer.stage('db_write'):
+            deployment.save()
+        timer.finish(deployment.status)
         return deployment
         
     except SSHConnection.DoesNotExist:
+        timer.finish('failed')
         raise SSHDeploymentError(f"Connessione SSH con ID {ssh_connection_id} non trovata")
     except Exception as e:
         if 'deployment' in locals():
             deployment.status = 'failed'
             deployment.error_message = str(e)
             deployment.save()
+        timer.finish('failed')
         raise SSHDeploymentError(f"Errore nel deployment: {str(e)}")
 
 
@@ -340,6 +457,7 @@ def deploy_workflow_to_ml_runner_with_folder(
     """
     import logging
     logger = logging.getLogger(__name__)
+    timer = StageTimer('ssh_deployment')
     
     try:
         logger.info(f"Deployment SSH con cartella workflow {workflow_id}")
@@ -355,51 +473,53 @@ def deploy_workflow_to_ml_runner_with_folder(
         logger.info(f"Path remoto: {remote_file_path}")
         
         # Crea il record di deployment
-        deployment = FileDeployment.objects.create(
-            ssh_connection=connection,
-            user=user,
-            file_name=file_name,
-            file_content=file_content,
-            remote_file_path=remote_file_path,
-            workflow_id=workflow_id,
-            deployment_notes=f"SSH deployment con cartella {workflow_id}",
-            status='pending'
-        )
-        
-        deployment.status = 'uploading'
-        deployment.started_at = timezone.now()
-        deployment.save()
+        with timer.stage('db_write'):
+            deployment = FileDeployment.objects.create(
+                ssh_connection=connection,
+                user=user,
+                file_name=file_name,
+                file_content=file_content,
+                remote_file_path=remote_file_path,
+                workflow_id=workflow_id,
+                deployment_notes=f"SSH deployment con cartella {workflow_id}",
+                status='uploading',
+                started_at=timezone.now()
+            )
         logger.info(f"Deployment record creato: {deployment.id}")
         
         # Effettua il deployment via SSH
-        service = SSHDeploymentService(connection)
+        service = get_deployment_service(connection)
         
         try:
             logger.info(f"🔌 Tentativo connessione SSH a {connection.host}:{connection.port}")
-            service.connect()
+            with timer.stage('ssh_connect'):
+                service.connect()
             logger.info("✅ Connessione SSH stabilita con successo")
             
-            # Test connessione con comando semplice
-            test_result = service.execute_command('echo "SSH test successful"')
-            logger.info(f"Test SSH: {test_result['stdout'].strip() if test_result['success'] else 'FAILED'}")
-            
-            # Crea la directory del workflow
-            workflow_dir = f"/app/workflows/{workflow_id}"
-            logger.info(f"Creando directory: {workflow_dir}")
-            dir_success = service.create_remote_directory(workflow_dir)
-            logger.info(f"Directory creata: {dir_success}")
-            
-            # Verifica che la directory esista
-            check_result = service.execute_command(f'ls -la /app/workflows/ | grep {workflow_id}')
-            logger.info(f"Verifica directory: {check_result['stdout'].strip()}")
+            with timer.stage('ssh_commands'):
+                # Test connessione con comando semplice
+                test_result = service.execute_command('echo "SSH test successful"')
+                logger.info(f"Test SSH: {test_result['stdout'].strip() if test_result['success'] else 'FAILED'}")
+                
+                # Crea la directory del workflow
+                workflow_dir = f"/app/workflows/{workflow_id}"
+                logger.info(f"Creando directory: {workflow_dir}")
+                dir_success = service.create_remote_directory(workflow_dir)
+                logger.info(f"Directory creata: {dir_success}")
+                
+                # Verifica che la directory esista
+                check_result = service.execute_command(f'ls -la /app/workflows/ | grep {shlex.quote(str(workflow_id))}')
+                logger.info(f"Verifica directory: {check_result['stdout'].strip()}")
             
             # Carica il file
             logger.info(f"Uploading file: {remote_file_path}")
-            success = service.upload_file_content(file_content, remote_file_path)
+            with timer.stage('ssh_upload'):
+                success = service.upload_file_content(file_content, remote_file_path)
             
             if success:
                 # Verifica che il file sia stato caricato
-                verify_result = service.execute_command(f'ls -la "{remote_file_path}"')
+                with timer.stage('ssh_commands'):
+                    verify_result = service.execute_command(f'ls -la {shlex.quote(remote_file_path)}')
                 logger.info(f"Verifica file: {verify_result['stdout'].strip()}")
                 
                 deployment.status = 'completed'
@@ -418,7 +538,9 @@ def deploy_workflow_to_ml_runner_with_folder(
             service.disconnect()
             logger.info("🔌 Connessione SSH chiusa")
         
-        deployment.save()
+        with timer.stage('db_write'):
+            deployment.save()
+        timer.finish(deployment.status)
         return deployment
         
     except Exception as e:
@@ -427,5 +549,6 @@ def deploy_workflow_to_ml_runner_with_folder(
             deployment.status = 'failed'
             deployment.error_message = str(e)
             deployment.save()
+        timer.finish('failed')
         raise SSHDeploymentError(f"Errore nel deployment SSH: {str(e)}")
     
\ No newline at end of file
@@ -7,11 +7,13 @@ from django.shortcuts import get_object_or_404
 from .models import SSHConnection, FileDeployment
 from .serializers import (
     SSHConnectionSerializer, CreateSSHConnectionSerializer,
-    FileDeploymentSerializer, DeployWorkflowFileSerializer,
+    FileDeploymentSerializer, FileDeploymentListSerializer, DeployWorkflowFileSerializer,
     TestSSHConnectionSerializer
 )
+from ..common.pagination import CreatedAtCursorPagination
+from ..llm_requests.idempotency import idempotent, release_on_retry
 from .services import (
-    deploy_workflow_file, SSHDeploymentService, SSHDeploymentError,
+    deploy_workflow_file, get_deployment_service, SSHDeploymentError,
     get_ml_runner_connection, create_ml_runner_connection
 )
 
@@ -32,7 +34,7 @@ class SSHConnectionViewSet(viewsets.ModelViewSet):
         ssh_connection = self.get_object()
         
         try:
-            service = SSHDeploymentService(ssh_connection)
+            service = get_deployment_service(ssh_connection)
             service.connect()
             
             # Esegui un comando di test
@@ -80,11 +82,26 @@ class SSHConnectionViewSet(viewsets.ModelViewSet):
 
 class FileDeploymentViewSet(viewsets.ModelViewSet):
     """ViewSet per gestire i deployment dei file"""
-    queryset = FileDeployment.objects.all()
+    queryset = FileDeployment.objects.all().select_related('ssh_connection')
     serializer_class = FileDeploymentSerializer
     permission_classes = [AllowAny]  # TEMPORANEO per test
+    pagination_class = CreatedAtCursorPagination
+    # Colonne pesanti caricate solo nelle route di dettaglio
+    list_deferred_fields = ['file_content', 'local_file_path', 'deployment_notes']
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = queryset.defer(*self.list_deferred_fields)
+        return queryset
+    
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return FileDeploymentListSerializer
+        return FileDeploymentSerializer
     
     @action(detail=False, methods=['post'])
+    @idempotent('deploy.workflow')
     def deploy_workflow(self, request):
         """Deploya un file workflow sul server remoto"""
         serializer = DeployWorkflowFileSerializer(data=request.data)
@@ -108,12 +125,14 @@ class FileDeploymentViewSet(viewsets.ModelViewSet):
             })
             
         except SSHDeploymentError as e:
-            return Response({
+            # Connessione o upload falliti: un retry con la stessa Idempotency-Key deve riprovare
+            return release_on_retry(Response({
                 'status': 'error',
                 'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+            }, status=status.HTTP_400_BAD_REQUEST))
     
     @action(detail=False, methods=['post'])
+    @idempotent('deploy.ml_runner')
     def deploy_to_ml_runner(self, request):
         """Deploya direttamente sul container ml_runner"""
         # Verifica che esista la connessione ml_runner
@@ -146,10 +165,10 @@ class FileDeploymentViewSet(viewsets.ModelViewSet):
             })
             
         except SSHDeploymentError as e:
-            return Response({
+            return release_on_retry(Response({
                 'status': 'error',
                 'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+            }, status=status.HTTP_400_BAD_REQUEST))
     
     @action(detail=True, methods=['post'])
     def retry_deployment(self, request, pk=None):
@@ -7,6 +7,8 @@ class WorkflowGenerationAdmin(admin.ModelAdmin):
     list_filter = ['status', 'created_at']
     search_fields = ['config_name', 'generated_class_name']
     readonly_fields = ['id', 'created_at', 'completed_at']
+    # Evita un secondo COUNT(*) sull'intera tabella quando si applicano filtri
+    show_full_result_count = False
     
     fieldsets = (
         ('Informazioni Base', {
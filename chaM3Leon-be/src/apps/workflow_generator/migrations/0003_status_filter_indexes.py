@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflow_generator', '0002_workflowgeneration_created_id_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='workflowgeneration',
+            index=models.Index(fields=['status', '-created_at'], name='workflowgen_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowgeneration',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'processing'])), fields=['-created_at'], name='workflowgen_active_idx'),
+        ),
+    ]
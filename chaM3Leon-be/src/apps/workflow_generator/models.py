@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
 import uuid
@@ -25,10 +26,19 @@ class WorkflowGeneration(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='workflowgen_created_id_idx'),
+            models.Index(fields=['status', '-created_at'], name='workflowgen_status_created_idx'),
+            # Indice parziale: solo i workflow ancora in generazione
+            models.Index(
+                fields=['-created_at'], name='workflowgen_active_idx',
+                condition=models.Q(status__in=['pending', 'processing'])
+            ),
+        ]
     
     def __str__(self):
         return f"Workflow {self.config_name} - {self.status}"
     
     @property
     def output_directory(self):
-        return os.path.join('/app/src/generated_workflows', str(self.id))
\ No newline at end of file
+        return os.path.join(settings.GENERATED_WORKFLOWS_DIR, str(self.id))
\ No newline at end of file
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import WorkflowGeneration
+from ..common.serializers import SparseModelSerializer
 
 class WorkflowGenerationSerializer(serializers.ModelSerializer):
     class Meta:
@@ -15,6 +16,16 @@ class WorkflowGenerationSerializer(serializers.ModelSerializer):
             'created_at', 'completed_at'
         ]
 
+class WorkflowGenerationListSerializer(SparseModelSerializer):
+    """Serializer compatto per la lista dei workflow (senza config e codice generato)"""
+    class Meta:
+        model = WorkflowGeneration
+        fields = [
+            'id', 'config_name', 'generated_class_name', 'generated_file_path',
+            'status', 'error_message', 'created_at', 'completed_at'
+        ]
+        read_only_fields = fields
+
 class CreateWorkflowSerializer(serializers.ModelSerializer):    
     class Meta:
         model = WorkflowGeneration
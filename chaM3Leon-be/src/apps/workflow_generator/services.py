@@ -3,6 +3,7 @@ import json
 import tempfile
 from django.utils import timezone
 from .models import WorkflowGeneration
+from ..common.metrics import StageTimer
 from chameleon.ml_runner.metaflow.runner.templating.configuration_parser import generate_workflow
 import shutil
 
@@ -12,10 +13,12 @@ class WorkflowGenerationError(Exception):
 def generate_workflow_from_config(workflow_generation):
     import logging
     logger = logging.getLogger(__name__)
+    timer = StageTimer('workflow_generation')
     
     try:
         workflow_generation.status = 'processing'
-        workflow_generation.save()
+        with timer.stage('db_write'):
+            workflow_generation.save()
         logger.info(f"Iniziando generazione workflow ID: {workflow_generation.id}")
         
         # Assicurati che la directory di output esista prima di tutto
@@ -37,7 +40,8 @@ def generate_workflow_from_config(workflow_generation):
         logger.debug(f"Config JSON scritto in: {config_path}")
         
         logger.info("Chiamando generate_workflow...")
-        generated_file_path = generate_workflow(config_path, temp_dir)
+        with timer.stage('templating'):
+            generated_file_path = generate_workflow(config_path, temp_dir)
         logger.info(f"File generato dal templating: {generated_file_path}")
         
         if os.path.exists(generated_file_path):
@@ -52,8 +56,9 @@ def generate_workflow_from_config(workflow_generation):
         output_path = os.path.join(output_dir, file_name)
         
         logger.info(f"Salvando file finale in: {output_path}")
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(generated_content)
+        with timer.stage('file_write'):
+            with open(output_path, 'w', encoding='utf-8') as f:
+                f.write(generated_content)
         
         # Verifica che il file sia stato scritto correttamente
         if not os.path.exists(output_path):
@@ -67,7 +72,9 @@ def generate_workflow_from_config(workflow_generation):
         workflow_generation.generated_content = generated_content
         workflow_generation.status = 'completed'
         workflow_generation.completed_at = timezone.now()
-        workflow_generation.save()
+        with timer.stage('db_write'):
+            workflow_generation.save()
+        timer.finish(workflow_generation.status)
         
         logger.info(f"✅ Workflow generato con successo: {workflow_generation.id}")
         
@@ -84,6 +91,7 @@ def generate_workflow_from_config(workflow_generation):
         workflow_generation.status = 'failed'
         workflow_generation.error_message = str(e)
         workflow_generation.save()
+        timer.finish(workflow_generation.status)
         raise WorkflowGenerationError(f"Errore durante la generazione del workflow: {str(e)}")
 
 def process_uploaded_json(uploaded_file):
@@ -9,25 +9,35 @@ import os
 from .models import WorkflowGeneration
 from .serializers import (
     WorkflowGenerationSerializer, 
+    WorkflowGenerationListSerializer,
     CreateWorkflowSerializer,
     UploadWorkflowConfigSerializer
 )
+from ..common.pagination import CreatedAtCursorPagination
 from .services import generate_workflow_from_config, process_uploaded_json, WorkflowGenerationError
 
 class WorkflowGenerationViewSet(viewsets.ModelViewSet):
     """ViewSet per gestire la generazione di workflow"""
     serializer_class = WorkflowGenerationSerializer
     permission_classes = [AllowAny]  # TEMPORANEO per test
+    pagination_class = CreatedAtCursorPagination
+    # Colonne pesanti caricate solo nelle route di dettaglio
+    list_deferred_fields = ['config_data', 'generated_content']
     
     def get_queryset(self):
         # Per i test, restituisci tutte le generazioni
-        return WorkflowGeneration.objects.all()
+        queryset = WorkflowGeneration.objects.all()
+        if self.action == 'list':
+            queryset = queryset.defer(*self.list_deferred_fields)
+        return queryset
     
     def get_serializer_class(self):
         if self.action == 'create':
             return CreateWorkflowSerializer
         elif self.action == 'upload_config':
             return UploadWorkflowConfigSerializer
+        elif self.action == 'list':
+            return WorkflowGenerationListSerializer
         return WorkflowGenerationSerializer
     
     def perform_create(self, serializer):
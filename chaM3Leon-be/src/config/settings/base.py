@@ -1,5 +1,5 @@
 from pathlib import Path
-from decouple import config
+from decouple import Choices, Csv, config
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent.parent
 
@@ -110,6 +110,61 @@ DATABASES = {
     }
 }
 
+# Connessioni al database per ruolo del processo (PROCESS_ROLE):
+# - 'web': server WSGI (gunicorn), connessioni persistenti tra le richieste
+# - 'asgi': server ASGI (uvicorn), dove le connessioni persistenti non vengono
+#   riusate tra una richiesta e l'altra: meglio il pool di psycopg
+# - 'worker': processi lunghi (apply_llm_outbox --loop), connessioni persistenti
+#   rinnovate a ogni giro del ciclo
+# Ogni DB_* si può impostare per ruolo (es. DB_CONN_MAX_AGE_WORKER) o per tutti.
+# DB_POOL_MODE: 'off'; 'psycopg' per il pool integrato di Django (richiede
+# psycopg[pool] al posto di psycopg2, solo PostgreSQL); 'pgbouncer' quando il
+# database è dietro PgBouncer in transaction pooling (niente cursori lato server)
+PROCESS_ROLE = config('PROCESS_ROLE', default='web', cast=Choices(['web', 'asgi', 'worker']))
+DB_CONN_MAX_AGE_DEFAULTS = {'web': 60, 'asgi': 0, 'worker': 600}
+
+
+def role_config(name, **kwargs):
+    return config(f'{name}_{PROCESS_ROLE.upper()}', default=config(name, **kwargs), cast=kwargs.get('cast'))
+
+
+DB_POOL_MODE = role_config('DB_POOL_MODE', default='off', cast=Choices(['off', 'psycopg', 'pgbouncer']))
+DATABASES['default'].update({
+    'CONN_MAX_AGE': role_config('DB_CONN_MAX_AGE', default=DB_CONN_MAX_AGE_DEFAULTS[PROCESS_ROLE], cast=int),
+    # Ping della connessione riusata all'inizio di ogni richiesta: niente errori
+    # dopo un riavvio del database o la chiusura da parte di un proxy
+    'CONN_HEALTH_CHECKS': role_config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool),
+})
+if DB_POOL_MODE == 'psycopg' and 'postgresql' in DATABASES['default']['ENGINE']:
+    # Con il pool le connessioni tornano al pool a fine richiesta: CONN_MAX_AGE deve essere 0
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {'pool': {
+        'min_size': role_config('DB_POOL_MIN_SIZE', default=2, cast=int),
+        'max_size': role_config('DB_POOL_MAX_SIZE', default=10, cast=int),
+        'timeout': role_config('DB_POOL_TIMEOUT_S', default=10, cast=float),
+    }}
+elif DB_POOL_MODE == 'pgbouncer':
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+# Cache condivisa tra i worker (es. stato dei circuit breaker LLM): Redis se REDIS_URL
+# è configurato (richiede il pacchetto redis), altrimenti una tabella del database
+# creata da 'manage.py createcachetable'
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+        }
+    }
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -183,6 +238,64 @@ LOGGING = {
     },
 }
 
+# LOGGING_MODE=fast: handler non bloccanti (coda + thread dedicato) e sink strutturato
+# JSON Lines in logs/app.jsonl. I logger delle app restano a INFO, così logger.debug
+# non crea nemmeno il LogRecord; con LOG_DEBUG_SAMPLE_RATE > 0 passano a DEBUG e
+# viene registrata solo quella frazione dei record DEBUG (stessa scelta per tutti gli handler)
+LOGGING_MODE = config('LOGGING_MODE', default='default')
+LOG_DEBUG_SAMPLE_RATE = config('LOG_DEBUG_SAMPLE_RATE', default=0.0, cast=float)
+
+if LOGGING_MODE == 'fast':
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {
+            'colored': LOGGING['formatters']['colored'],
+            'json': {
+                '()': 'src.apps.common.log_handlers.JsonFormatter',
+            },
+        },
+        'filters': {
+            'sample_debug': {
+                '()': 'src.apps.common.log_handlers.SampledDebugFilter',
+                'rate': LOG_DEBUG_SAMPLE_RATE,
+            },
+        },
+        'handlers': {
+            'console': {
+                'class': 'src.apps.common.log_handlers.NonBlockingHandler',
+                'formatter': 'colored',
+                'filters': ['sample_debug'],
+            },
+            'json_file': {
+                'class': 'src.apps.common.log_handlers.NonBlockingHandler',
+                'filename': BASE_DIR / 'logs' / 'app.jsonl',
+                'formatter': 'json',
+                'filters': ['sample_debug'],
+            },
+        },
+        'root': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+        'loggers': {
+            'django': {
+                'handlers': ['console'],
+                'level': 'INFO',
+                'propagate': False,
+            },
+            # I moduli delle app usano logging.getLogger(__name__) -> 'src.apps.*'
+            'src.apps': {
+                'handlers': ['console', 'json_file'],
+                'level': 'DEBUG' if LOG_DEBUG_SAMPLE_RATE > 0 else 'INFO',
+                # I filtri di un logger non vedono i record propagati dai figli
+                # (src.apps.*): per quelli decide il filtro del primo handler
+                'filters': ['sample_debug'],
+                'propagate': False,
+            },
+        },
+    }
+
 #!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
 # Django REST Framework settings (TEMPORANEO - Solo per test)
 REST_FRAMEWORK = {
@@ -200,6 +313,145 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+# LLM
+# Con LLM_RESULT_OUTBOX i risultati vengono accodati e applicati da 'manage.py apply_llm_outbox'
+LLM_RESULT_OUTBOX = config('LLM_RESULT_OUTBOX', default=False, cast=bool)
+# Una voce che non si riesce ad applicare viene riprovata dopo LLM_OUTBOX_RETRY_BACKOFF_S
+# secondi (raddoppiati a ogni tentativo); dopo LLM_OUTBOX_MAX_ATTEMPTS resta come morta
+LLM_OUTBOX_MAX_ATTEMPTS = config('LLM_OUTBOX_MAX_ATTEMPTS', default=5, cast=int)
+LLM_OUTBOX_RETRY_BACKOFF_S = config('LLM_OUTBOX_RETRY_BACKOFF_S', default=10, cast=float)
+# Deploy automatico su ml_runner del file migliorato dopo un'analisi
+LLM_ANALYSIS_AUTO_DEPLOY = config('LLM_ANALYSIS_AUTO_DEPLOY', default=True, cast=bool)
+# Analisi a blocchi (analysis_mode 'chunked', o 'auto' oltre la soglia di righe):
+# ogni metodo @step viene inviato al modello separatamente, fino a N chiamate in parallelo
+LLM_ANALYSIS_CHUNK_MIN_LINES = config('LLM_ANALYSIS_CHUNK_MIN_LINES', default=300, cast=int)
+LLM_ANALYSIS_CHUNK_WORKERS = config('LLM_ANALYSIS_CHUNK_WORKERS', default=8, cast=int)
+# Risultati per step (WorkflowStepCache): una nuova analisi dello stesso workflow
+# invia al modello solo gli step modificati e riusa gli altri
+LLM_ANALYSIS_STEP_CACHE = config('LLM_ANALYSIS_STEP_CACHE', default=True, cast=bool)
+# Risultati per struttura (WorkflowStructureCache): un workflow uguale a uno già
+# analizzato a meno di formattazione, commenti e nomi riusa il risultato rinominato
+LLM_ANALYSIS_STRUCTURE_CACHE = config('LLM_ANALYSIS_STRUCTURE_CACHE', default=True, cast=bool)
+# Esempi few-shot: gli step di analisi precedenti più simili a quello da migliorare
+# (indice vettoriale locale di WorkflowStepCache, vedi embedding_index.py) vengono
+# aggiunti al prompt come coppie prima/dopo. Backend 'hashing' (solo NumPy) o
+# 'fastembed' (modello ONNX LLM_EMBEDDING_MODEL, pacchetto opzionale fastembed)
+LLM_FEW_SHOT_ENABLED = config('LLM_FEW_SHOT_ENABLED', default=True, cast=bool)
+LLM_FEW_SHOT_K = config('LLM_FEW_SHOT_K', default=2, cast=int)
+LLM_FEW_SHOT_MIN_SCORE = config('LLM_FEW_SHOT_MIN_SCORE', default=0.35, cast=float)
+LLM_EMBEDDING_BACKEND = config('LLM_EMBEDDING_BACKEND', default='hashing')
+LLM_EMBEDDING_MODEL = config('LLM_EMBEDDING_MODEL', default='jinaai/jina-embeddings-v2-base-code')
+LLM_EMBEDDING_DIMENSION = config('LLM_EMBEDDING_DIMENSION', default=1024, cast=int)  # solo 'hashing'
+LLM_EMBEDDING_INDEX_DIR = config('LLM_EMBEDDING_INDEX_DIR', default=str(BASE_DIR / 'embedding_index'))
+# Le analisi marcano soltanto l'indice come da aggiornare: l'aggiornamento
+# incrementale avviene in un thread in background, LLM_EMBEDDING_REFRESH_DELAY_S
+# dopo il primo step salvato (raggruppando le analisi ravvicinate), oppure, con
+# LLM_EMBEDDING_AUTO_UPDATE=False, con 'manage.py update_embedding_index --if-stale' da cron
+LLM_EMBEDDING_AUTO_UPDATE = config('LLM_EMBEDDING_AUTO_UPDATE', default=True, cast=bool)
+LLM_EMBEDDING_REFRESH_DELAY_S = config('LLM_EMBEDDING_REFRESH_DELAY_S', default=30, cast=float)
+# Validazione del codice restituito prima di sovrascrivere il file e deployarlo
+# (sintassi, grafo degli step, import); se fallisce si chiede al modello una correzione
+LLM_ANALYSIS_VALIDATION = config('LLM_ANALYSIS_VALIDATION', default=True, cast=bool)
+LLM_ANALYSIS_REPAIR_ATTEMPTS = config('LLM_ANALYSIS_REPAIR_ATTEMPTS', default=1, cast=int)
+# View async per quick_request, turni di conversazione e quick_analysis: da attivare
+# quando il progetto gira sotto ASGI (uvicorn src.config.asgi:application --workers N)
+LLM_ASYNC_VIEWS = config('LLM_ASYNC_VIEWS', default=False, cast=bool)
+
+# Timeout e retry dei client SDK dei provider: con le catene di fallback conviene
+# ridurli, così un provider lento o irraggiungibile cede presto il passo al successivo
+LLM_PROVIDER_TIMEOUT_S = config('LLM_PROVIDER_TIMEOUT_S', default=60, cast=float)
+LLM_PROVIDER_MAX_RETRIES = config('LLM_PROVIDER_MAX_RETRIES', default=2, cast=int)
+# Cache dei prompt dei provider per le parti stabili (system prompt, istruzioni e codice
+# delle analisi): cache_control su Anthropic, prompt_cache_key su OpenAI. Su Gemini la
+# cache è implicita; LLM_GEMINI_EXPLICIT_CACHE crea un cached content per il system prompt
+LLM_PROMPT_CACHING = config('LLM_PROMPT_CACHING', default=True, cast=bool)
+LLM_GEMINI_EXPLICIT_CACHE = config('LLM_GEMINI_EXPLICIT_CACHE', default=False, cast=bool)
+LLM_GEMINI_CACHE_TTL_S = config('LLM_GEMINI_CACHE_TTL_S', default=3600, cast=int)
+# Catene di fallback per modello (LLMModelFallback, configurate da admin)
+LLM_FALLBACK_ENABLED = config('LLM_FALLBACK_ENABLED', default=True, cast=bool)
+# Catalogo in memoria di provider, modelli e fallback: ogni processo confronta la
+# versione condivisa nella cache al massimo ogni N secondi (0: a ogni accesso)
+LLM_CATALOG_CHECK_S = config('LLM_CATALOG_CHECK_S', default=5, cast=float)
+# Archiviazione delle conversazioni (compact_conversations): i messaggi delle conversazioni
+# inattive da N giorni passano in un blob JSON compresso ('gzip', o 'zstd' con il pacchetto
+# zstandard) e tornano nella tabella al primo nuovo messaggio
+LLM_CONVERSATION_ARCHIVE_IDLE_DAYS = config('LLM_CONVERSATION_ARCHIVE_IDLE_DAYS', default=30, cast=int)
+LLM_CONVERSATION_ARCHIVE_CODEC = config('LLM_CONVERSATION_ARCHIVE_CODEC', default='gzip')
+# Retention di LLMRequest e FileDeployment (purge_history): dopo HISTORY_TEXT_RETENTION_DAYS
+# giorni prompt, risposte e contenuti dei file vengono svuotati (restano stato, token, costi,
+# tempi e gli aggregati LLMUsageHourly); dopo HISTORY_DELETE_RETENTION_DAYS (0: mai) le righe
+# vengono cancellate. Batch brevi, con lock_timeout su PostgreSQL e una pausa tra un batch e l'altro
+HISTORY_TEXT_RETENTION_DAYS = config('HISTORY_TEXT_RETENTION_DAYS', default=90, cast=int)
+HISTORY_DELETE_RETENTION_DAYS = config('HISTORY_DELETE_RETENTION_DAYS', default=0, cast=int)
+HISTORY_PURGE_BATCH_SIZE = config('HISTORY_PURGE_BATCH_SIZE', default=1000, cast=int)
+HISTORY_PURGE_LOCK_TIMEOUT_MS = config('HISTORY_PURGE_LOCK_TIMEOUT_MS', default=2000, cast=int)
+HISTORY_PURGE_PAUSE_MS = config('HISTORY_PURGE_PAUSE_MS', default=50, cast=int)
+# Header Idempotency-Key sulle POST verso i provider LLM e sui deploy: risposte salvate
+# per IDEMPOTENCY_TTL_S; un retry attende fino a IDEMPOTENCY_WAIT_S la richiesta ancora
+# in corso; oltre IDEMPOTENCY_LOCK_S una chiave 'processing' è considerata abbandonata
+IDEMPOTENCY_TTL_S = config('IDEMPOTENCY_TTL_S', default=86400, cast=int)
+IDEMPOTENCY_WAIT_S = config('IDEMPOTENCY_WAIT_S', default=30, cast=float)
+IDEMPOTENCY_LOCK_S = config('IDEMPOTENCY_LOCK_S', default=900, cast=int)
+# Coalescing (single-flight): richieste identiche in corso nello stesso momento, anche
+# su processi diversi, attendono la chiamata della prima e ne condividono la risposta
+# (lock e risultato nella cache Django). Oltre LLM_COALESCE_WAIT_S chiamano il provider
+LLM_COALESCING = config('LLM_COALESCING', default=True, cast=bool)
+LLM_COALESCE_WAIT_S = config('LLM_COALESCE_WAIT_S', default=180, cast=float)
+LLM_COALESCE_RESULT_TTL_S = config('LLM_COALESCE_RESULT_TTL_S', default=30, cast=int)
+LLM_COALESCE_POLL_MS = config('LLM_COALESCE_POLL_MS', default=100, cast=float)
+# Hedging: se il modello non risponde entro il suo p95 recente parte anche il primo fallback
+LLM_HEDGING_ENABLED = config('LLM_HEDGING_ENABLED', default=False, cast=bool)
+LLM_HEDGE_QUANTILE = config('LLM_HEDGE_QUANTILE', default=95, cast=float)
+LLM_HEDGE_MIN_SAMPLES = config('LLM_HEDGE_MIN_SAMPLES', default=20, cast=int)
+LLM_HEDGE_DEFAULT_DELAY_MS = config('LLM_HEDGE_DEFAULT_DELAY_MS', default=10000, cast=float)  # finché i campioni sono pochi
+
+# Circuit breaker per provider e modello, con finestre mobili condivise nella cache:
+# si apre oltre LLM_BREAKER_ERROR_RATE di errori (o LLM_BREAKER_SLOW_RATE di chiamate
+# lente) su almeno LLM_BREAKER_MIN_CALLS chiamate; dopo LLM_BREAKER_OPEN_S lascia
+# passare una sola chiamata di prova (half-open) prima di richiudersi
+LLM_BREAKER_ENABLED = config('LLM_BREAKER_ENABLED', default=True, cast=bool)
+LLM_BREAKER_WINDOW_S = config('LLM_BREAKER_WINDOW_S', default=60, cast=int)
+LLM_BREAKER_BUCKET_S = config('LLM_BREAKER_BUCKET_S', default=10, cast=int)
+LLM_BREAKER_MIN_CALLS = config('LLM_BREAKER_MIN_CALLS', default=10, cast=int)
+LLM_BREAKER_ERROR_RATE = config('LLM_BREAKER_ERROR_RATE', default=0.5, cast=float)
+LLM_BREAKER_SLOW_CALL_MS = config('LLM_BREAKER_SLOW_CALL_MS', default=30000, cast=float)
+LLM_BREAKER_SLOW_RATE = config('LLM_BREAKER_SLOW_RATE', default=0.8, cast=float)
+LLM_BREAKER_OPEN_S = config('LLM_BREAKER_OPEN_S', default=30, cast=float)
+
+# Provider 'mock' per load test e benchmark offline (nessuna chiamata di rete)
+MOCK_LLM_ENABLED = config('MOCK_LLM_ENABLED', default=DEBUG, cast=bool)
+MOCK_LLM_LATENCY_MS = config('MOCK_LLM_LATENCY_MS', default=200, cast=float)  # mediana del tempo al primo token
+MOCK_LLM_LATENCY_DISTRIBUTION = config('MOCK_LLM_LATENCY_DISTRIBUTION', default='lognormal')  # fixed | uniform | lognormal
+MOCK_LLM_LATENCY_SPREAD = config('MOCK_LLM_LATENCY_SPREAD', default=0.5, cast=float)
+MOCK_LLM_STREAM_CHUNKS = config('MOCK_LLM_STREAM_CHUNKS', default=0, cast=int)  # 0 = risposta in un unico blocco
+MOCK_LLM_CHUNK_INTERVAL_MS = config('MOCK_LLM_CHUNK_INTERVAL_MS', default=20, cast=float)
+MOCK_LLM_ERROR_RATE = config('MOCK_LLM_ERROR_RATE', default=0.0, cast=float)
+MOCK_LLM_COMPLETION_TOKENS = config('MOCK_LLM_COMPLETION_TOKENS', default=256, cast=int)
+
+# Workflow generati (una cartella per workflow_id)
+GENERATED_WORKFLOWS_DIR = config('GENERATED_WORKFLOWS_DIR', default=str(BASE_DIR / 'src' / 'generated_workflows'))
+
+# Deployment: 'ssh' (paramiko) oppure 'local', che simula il server SSH su una cartella
+# locale (SSH_LOCAL_ROOT) con una latenza per round trip configurabile; usato dai benchmark
+SSH_DEPLOYMENT_BACKEND = config('SSH_DEPLOYMENT_BACKEND', default='ssh')
+SSH_LOCAL_ROOT = config('SSH_LOCAL_ROOT', default=str(BASE_DIR / 'local_ssh_root'))
+SSH_LOCAL_LATENCY_MS = config('SSH_LOCAL_LATENCY_MS', default=0, cast=float)
+
+# Moduli importabili sul runner, uno per riga (generato da 'manage.py sync_runner_manifest'):
+# se il file non esiste il controllo degli import nella validazione viene saltato
+ML_RUNNER_MODULES_MANIFEST = config('ML_RUNNER_MODULES_MANIFEST', default=str(BASE_DIR / 'ml_runner_modules.txt'))
+ML_RUNNER_EXTRA_MODULES = config('ML_RUNNER_EXTRA_MODULES', default='metaflow', cast=Csv())
+ML_RUNNER_PYTHON = config('ML_RUNNER_PYTHON', default='/opt/conda/envs/venv/bin/python')
+ML_RUNNER_PYTHONPATH = config('ML_RUNNER_PYTHONPATH', default='/app/projects')
+
+# Metriche
+# Salva i tempi per fase anche sui record LLMRequest / WorkflowFileAnalysis
+METRICS_STORE_STAGE_TIMINGS = config('METRICS_STORE_STAGE_TIMINGS', default=False, cast=bool)
+# Accesso a /metrics: token Bearer e/o IP ammessi (di default solo localhost).
+# Le metriche sono per processo: con più worker ognuno espone solo le proprie
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='127.0.0.1,::1', cast=Csv())
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'chaM3Leon API',
     'DESCRIPTION': 'API per la generazione e analisi di workflow Metaflow tramite LLM',